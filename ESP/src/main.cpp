@@ -2,6 +2,7 @@
 #include <HX711.h>
 #include <PubSubClient.h>
 #include <WiFi.h>
+#include <time.h>
 
 #include "config.h"
 
@@ -20,18 +21,45 @@ bool alarmTriggerd = false;
 #define DOUT_PIN 2     // GPIO for data pin (D2)
 #define SCK_PIN 4      // GPIO for clock pin (D4)
 
+// Binäres Batch-Format v1 (little-endian), siehe WebServer/payload.py
+#define BATCH_VERSION 1
+#define BATCH_HEADER_SIZE 16  // version, flags, count, sequence, base time
+#define BATCH_READING_SIZE 8  // offset in ms, float32 Gewicht
+#define MAX_BATCH_SIZE 28
+// Ein MQTT-Paket besteht aus festem Header (höchstens 5 Byte), Topic-Länge
+// (2 Byte), Topic "mailbox/<id>/weights" und Nutzdaten. Ein voller Batch
+// (16 + 28 * 8 = 240 Byte) passt nicht in den Standardpuffer von
+// PubSubClient (MQTT_MAX_PACKET_SIZE = 256), daher wird er in setup()
+// vergrößert.
+#define MQTT_FIXED_HEADER_SIZE 5
+#define MQTT_TOPIC_MAX_LENGTH 32  // "mailbox/" + bis zu 16 Ziffern + "/weights"
+#define BATCH_PACKET_SIZE                                \
+  (MQTT_FIXED_HEADER_SIZE + 2 + MQTT_TOPIC_MAX_LENGTH + \
+   BATCH_HEADER_SIZE + MAX_BATCH_SIZE * BATCH_READING_SIZE)
+uint8_t batchBuffer[BATCH_HEADER_SIZE + MAX_BATCH_SIZE * BATCH_READING_SIZE];
+uint16_t batchCount = 0;
+uint32_t batchSequence = 0;  // beginnt nach jedem Neustart bei 0
+uint64_t batchBaseTime = 0;
+
 // Funktionsdeklarationen
 void setup_wifi();
 void callback(char *topic, byte *message, unsigned int length);
 void reconnect();
 int readWeightSensor();
+uint64_t currentTimeMs();
+void addToBatch(float weight);
+bool publishBatch();
 
 void setup() {
   Serial.begin(115200);                 // Startet die serielle Kommunikation
   pinMode(BUZZER_PIN, OUTPUT);           // Setzt den Buzzer
   digitalWrite(BUZZER_PIN, LOW);         // Deaktiviert den Buzzer
   setup_wifi();                         // Initialisiert die WLAN-Verbindung
+  configTime(0, 0, ntp_server);  // Synchronisiert die Uhr für Zeitstempel
   client.setServer(mqtt_server, 1883);  // Setzt den MQTT-Server und Port
+  if (!client.setBufferSize(max(BATCH_PACKET_SIZE, MQTT_MAX_PACKET_SIZE))) {
+    Serial.println("MQTT-Puffer konnte nicht vergrößert werden");
+  }
   client.setCallback(callback);  // Setzt die Funktion, die bei eingehenden
                                  // MQTT-Nachrichten aufgerufen wird
   scale.begin(DOUT_PIN, SCK_PIN);
@@ -83,8 +111,12 @@ void loop() {
   int weight =
       readWeightSensor();  // Ruft die aktuelle Gewichtsmessung vom Sensor ab
   // Gewicht senden
-  client.publish(("mailbox/" + String(sensor_id) + "/weight").c_str(),
-                 String(weight).c_str());
+  if (weight_batch_size > 1) {
+    addToBatch(weight);
+  } else {
+    client.publish(("mailbox/" + String(sensor_id) + "/weight").c_str(),
+                   String(weight).c_str());
+  }
 
   Serial.println("Alarm Time: " + String(millis() - disarmTime));
   // Alarm Logik
@@ -117,6 +149,61 @@ int readWeightSensor() {
   return weight;
 }
 
+// Millisekunden seit 1970, vor der NTP-Synchronisation seit Start; der Server
+// korrigiert unsynchronisierte Zeitstempel
+uint64_t currentTimeMs() {
+  struct timeval tv;
+  gettimeofday(&tv, NULL);
+  return (uint64_t)tv.tv_sec * 1000 + tv.tv_usec / 1000;
+}
+
+void writeLE(uint8_t *buffer, uint64_t value, int bytes) {
+  for (int i = 0; i < bytes; i++) {
+    buffer[i] = (value >> (8 * i)) & 0xFF;
+  }
+}
+
+// Hängt eine Messung an den Batch an und sendet ihn, sobald er voll ist.
+// Ein nicht gesendeter Batch bleibt erhalten und wird mit der nächsten Messung
+// erneut gesendet; solange das fehlschlägt, werden neue Messungen verworfen.
+void addToBatch(float weight) {
+  if (batchCount >= MAX_BATCH_SIZE && !publishBatch()) {
+    Serial.println("Batch nicht gesendet, Messung verworfen");
+    return;
+  }
+  uint64_t now = currentTimeMs();
+  if (batchCount == 0) {
+    batchBaseTime = now;
+  }
+  uint8_t *reading =
+      batchBuffer + BATCH_HEADER_SIZE + batchCount * BATCH_READING_SIZE;
+  writeLE(reading, (uint32_t)(now - batchBaseTime), 4);
+  memcpy(reading + 4, &weight, 4);  // ESP32 ist little-endian
+  batchCount++;
+  if (batchCount >= min(weight_batch_size, MAX_BATCH_SIZE)) {
+    publishBatch();
+  }
+}
+
+// Sendet den Batch; nur ein gesendeter Batch wird geleert und zählt die
+// Sequenznummer hoch
+bool publishBatch() {
+  batchBuffer[0] = BATCH_VERSION;
+  batchBuffer[1] = 0;
+  writeLE(batchBuffer + 2, batchCount, 2);
+  writeLE(batchBuffer + 4, batchSequence, 4);
+  writeLE(batchBuffer + 8, batchBaseTime, 8);
+  if (!client.publish(("mailbox/" + String(sensor_id) + "/weights").c_str(),
+                      batchBuffer,
+                      BATCH_HEADER_SIZE + batchCount * BATCH_READING_SIZE)) {
+    Serial.println("Batch konnte nicht gesendet werden");
+    return false;
+  }
+  batchSequence++;
+  batchCount = 0;
+  return true;
+}
+
 // falls die Verbindung zum MQTT-Broker verloren geht
 void reconnect() {
   while (!client.connected()) {  // Solange der Client nicht verbunden ist,
@@ -1,10 +1,19 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, g, render_template, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from models import db, init_db, Weights, Alarms, EmailNotification, AlarmStatus
 from configweb import Config
-from control_server import control_server_task
-import paho.mqtt.client as mqtt
+from control_server import control_server_task, config_cache, slow_events
+from mqtt_publisher import get_publisher
+from history import ResponseCache, parse_timestamp, query_weight_history, query_weight_steps
+from sensors import parse_settings, query_sensors, update_sensor_settings
+from export import CONTENT_TYPES, FORMATS, TABLES, export
+from live_updates import EventBroadcaster, MqttEventSource, format_sse
+from metrics import REGISTRY, CONTENT_TYPE, Histogram
+from profiling import ProfilerBusy, authorized, sample_stacks
+from sqlalchemy import select, text
+from datetime import datetime, timedelta
 import threading
+import time
 
 config = Config()
 
@@ -15,28 +24,237 @@ app.config['SECRET_KEY'] = config.SECRET_KEY
 app.config['DEBUG'] = config.DEBUG
 
 # Initialisiere die Datenbank
-init_db(app)
+init_db(app, config)
+
+# Gemeinsame MQTT-Verbindung für alle Anfragen, wird beim ersten Senden aufgebaut
+mqtt_publisher = get_publisher(config)
+
+# Kurzlebiger Cache, den alle Dashboards mit derselben Abfrage teilen
+response_cache = ResponseCache(ttl=config.HISTORY_CACHE_TTL)
+
+# Eine MQTT-Subscription pro Prozess, die neue Messwerte an alle verbundenen Browser verteilt
+broadcaster = EventBroadcaster(
+    history_size=config.LIVE_HISTORY_SIZE,
+    client_queue_size=config.LIVE_CLIENT_QUEUE_SIZE
+)
+live_event_source = MqttEventSource(
+    broadcaster,
+    config.MQTT_BROKER,
+    config.MQTT_PORT,
+    config.MQTT_USERNAME,
+    config.MQTT_PASSWORD
+)
+
+REQUEST_SECONDS = Histogram('http_request_seconds', 'Duration of the Flask requests.', ['endpoint', 'method', 'status'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.labels(request.endpoint or 'unknown', request.method, response.status_code).observe(
+            time.perf_counter() - started
+        )
+    return response
+
+def cached_json_response(key, compute):
+    """
+    Liefert eine gecachte JSON-Antwort mit ETag.
+
+    Stimmt der ETag mit `If-None-Match` der Anfrage überein, wird nur
+    `304 Not Modified` ohne Inhalt gesendet.
+
+    Args:
+        key (tuple): Der Cache-Schlüssel der Abfrage.
+        compute (callable): Berechnet die Antwortdaten bei einem Cache-Fehltreffer.
+
+    Returns:
+        Response: Die JSON-Antwort oder eine 304-Antwort.
+    """
+    body, etag = response_cache.get_or_compute(key, compute)
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.max_age = int(config.HISTORY_CACHE_TTL)
+    return response.make_conditional(request)
+
+def notify_sensor_config_changed(sensor_id):
+    """
+    Benachrichtigt den Control-Server über eine geänderte Sensorkonfiguration.
+
+    Der Konfigurations-Cache und die gecachten API-Antworten im selben Prozess
+    werden direkt invalidiert, für Control-Server in anderen Prozessen wird
+    zusätzlich eine MQTT-Nachricht auf `mailbox/<sensor_id>/config` gesendet.
+    Jede Route, die Sensoreinstellungen schreibt, muss diese Funktion aufrufen.
+
+    Args:
+        sensor_id (int): Die ID des geänderten Sensors.
+    """
+    config_cache.invalidate(sensor_id)
+    response_cache.invalidate()
+    try:
+        mqtt_publisher.publish(f"mailbox/{sensor_id}/config", "invalidate", wait=False)
+    except Exception as e:
+        print(f"Fehler beim Senden der Konfigurationsänderung: {e}")
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+@app.route('/metrics')
+def metrics():
+    """
+    Liefert die Metriken des Webservers und des Control-Servers im Prometheus-Textformat.
+    """
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
+
+@app.route('/healthz')
+def healthz():
+    """
+    Liveness-Probe: Der Prozess beantwortet Anfragen.
+    """
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """
+    Readiness-Probe: Die Datenbank ist erreichbar.
+
+    Returns:
+        Response: 200, wenn Anfragen bedient werden können, sonst 503.
+    """
+    try:
+        db.session.execute(text('SELECT 1'))
+    except Exception as e:
+        return jsonify({'status': 'unavailable', 'message': str(e)}), 503
+    return jsonify({'status': 'ok'})
+
 @app.route('/data')
 def data():
-    weights = Weights.query.order_by(Weights.timestamp.desc()).limit(10).all()
-    alarms = Alarms.query.order_by(Alarms.timestamp.desc()).limit(5).all()
+    def compute():
+        weights = db.session.execute(
+            select(Weights.sensor_id, Weights.value, Weights.timestamp)
+            .order_by(Weights.timestamp.desc()).limit(10)
+        ).all()
+        alarms = db.session.execute(
+            select(Alarms.sensor_id, Alarms.value, Alarms.timestamp)
+            .order_by(Alarms.timestamp.desc()).limit(5)
+        ).all()
+
+        weights_data = [{'sensor_id': w.sensor_id, 'value': w.value, 'timestamp': w.timestamp.isoformat()} for w in weights]
+        alarms_data = [{'sensor_id': a.sensor_id, 'value': a.value, 'timestamp': a.timestamp.isoformat()} for a in alarms]
 
-    weights_data = [{'sensor_id': w.sensor_id, 'value': w.value, 'timestamp': w.timestamp} for w in weights]
-    alarms_data = [{'sensor_id': a.sensor_id, 'value': a.value, 'timestamp': a.timestamp} for a in alarms]
+        return {'weights': weights_data, 'alarms': alarms_data}
 
-    return {'weights': weights_data, 'alarms': alarms_data}
+    return cached_json_response(('data',), compute)
+
+@app.route('/history')
+def history():
+    """
+    Liefert den Gewichtsverlauf eines Sensors seitenweise.
+
+    Query-Parameter:
+        sensor_id (int): Die ID des Sensors (Pflicht).
+        start (str): Beginn des Zeitraums als ISO-8601-Zeitstempel, Standard: `end` minus eine Stunde.
+        end (str): Ende des Zeitraums als ISO-8601-Zeitstempel, Standard: jetzt.
+        cursor (str): `next_cursor` der vorherigen Seite.
+        limit (int): Maximale Anzahl Punkte pro Seite.
+        points (int): Zielanzahl Punkte für den gesamten Zeitraum, aktiviert das serverseitige Downsampling.
+            Der Mittelwert `avg` ist der Mittelwert der gespeicherten Messwerte, nicht über die Zeit:
+            Der Deadband-Filter speichert nur Änderungen und Heartbeats, unruhige Abschnitte zählen
+            daher mehr als ruhige. Den zeitlichen Verlauf liefert `mode=step`.
+        mode (str): `step` rekonstruiert die Treppenfunktion aus den gespeicherten Änderungen, benötigt `points`.
+
+    Returns:
+        Response: Eine JSON-Antwort mit den Punkten der Seite und dem Cursor der nächsten Seite.
+    """
+    sensor_id = request.args.get('sensor_id', type=int)
+    limit = request.args.get('limit', default=500, type=int)
+    points = request.args.get('points', type=int)
+    mode = request.args.get('mode')
+    if sensor_id is None:
+        return jsonify({'message': 'Sensor-ID fehlt.'}), 400
+    if not 0 < limit <= config.HISTORY_MAX_LIMIT or (points is not None and points <= 0):
+        return jsonify({'message': 'Ungültiges Limit oder ungültige Punktanzahl.'}), 400
+    if mode == 'step' and not (points and points <= config.HISTORY_MAX_LIMIT):
+        return jsonify({'message': 'Der Modus step benötigt eine gültige Punktanzahl.'}), 400
+    try:
+        start = parse_timestamp(request.args.get('start'))
+        end = parse_timestamp(request.args.get('end'))
+        cursor = parse_timestamp(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'message': f'Ungültiger Zeitstempel: {e}'}), 400
+
+    key = ('history', sensor_id, start, end, cursor, limit, points, mode)
+
+    def compute():
+        range_end = end or datetime.now()
+        range_start = start or range_end - timedelta(hours=1)
+        if mode == 'step':
+            return query_weight_steps(sensor_id, range_start, range_end, points)
+        return query_weight_history(sensor_id, range_start, range_end, cursor, limit, points)
+
+    return cached_json_response(key, compute)
+
+@app.route('/export')
+def export_history():
+    """
+    Exportiert den Gewichts- oder Alarmverlauf als Datei-Stream.
+
+    Die Zeilen werden in Blöcken aus der Datenbank gelesen und sofort
+    gesendet, sodass auch Exporte über Monate mit konstantem Speicher laufen.
+
+    Query-Parameter:
+        table (str): `weights` (Standard) oder `alarms`.
+        format (str): `csv` (Standard), `ndjson` oder `parquet`.
+        sensor_id (int): Kann mehrfach angegeben werden, Standard: alle Sensoren.
+        start (str): Beginn des Zeitraums als ISO-8601-Zeitstempel.
+        end (str): Ende des Zeitraums als ISO-8601-Zeitstempel.
+        bucket (float): Fasst die Gewichte zu Minimum, Maximum und Mittelwert je Intervall in Sekunden zusammen.
+            Der Mittelwert ist wie bei `/history` über die gespeicherten Messwerte gebildet, nicht über die Zeit.
+
+    Returns:
+        Response: Die Datei als Chunked-Response.
+    """
+    table = request.args.get('table', 'weights')
+    fmt = request.args.get('format', 'csv')
+    bucket = request.args.get('bucket', type=float)
+    if table not in TABLES or fmt not in FORMATS:
+        return jsonify({'message': 'Ungültige Tabelle oder ungültiges Format.'}), 400
+    if bucket is not None and (bucket <= 0 or table != 'weights'):
+        return jsonify({'message': 'Ungültiges Intervall.'}), 400
+    try:
+        start = parse_timestamp(request.args.get('start'))
+        end = parse_timestamp(request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'message': f'Ungültiger Zeitstempel: {e}'}), 400
+
+    try:
+        chunks = export(
+            db.engine,
+            table,
+            fmt,
+            sorted(set(request.args.getlist('sensor_id', type=int))),
+            start,
+            end,
+            timedelta(seconds=bucket) if bucket else None,
+            config.EXPORT_CHUNK_SIZE
+        )
+    except RuntimeError as e:
+        return jsonify({'message': str(e)}), 501
+    return Response(chunks, mimetype=CONTENT_TYPES[fmt], headers={
+        'Content-Disposition': f'attachment; filename="{table}.{fmt}"',
+        'X-Accel-Buffering': 'no',
+    })
 
 @app.route('/add_email', methods=['POST'])
 def add_email():
     """
     Fügt eine neue E-Mail-Adresse für Benachrichtigungen hinzu.
 
-    Diese Funktion empfängt eine E-Mail-Adresse über eine POST-Anfrage,
+    Diese Funktion empfängt eine E-Mail-Adresse und die Sensor-ID über eine POST-Anfrage,
     überprüft, ob die E-Mail-Adresse bereits existiert, und speichert sie
     in der Datenbank, falls sie noch nicht vorhanden ist.
 
@@ -46,8 +264,10 @@ def add_email():
     try:
         email = request.form.get('email')
         print(f"Erhaltene E-Mail: {email}")  # Debugging: Überprüfe die empfangene E-Mail
-        sensor_id = 1
+        sensor_id = request.form.get('sensor_id', type=int)
 
+        if sensor_id is None:
+            return jsonify({'message': 'Sensor-ID fehlt.'}), 400
         if not email:
             print("Fehler: Keine E-Mail-Adresse übergeben.")  # Debugging
             return jsonify({'message': 'E-Mail-Adresse fehlt.'}), 400
@@ -64,6 +284,8 @@ def add_email():
             db.session.add(new_email)
             db.session.commit()
 
+        notify_sensor_config_changed(sensor_id)
+
         return jsonify({'message': 'E-Mail-Adresse erfolgreich hinzugefügt.'})
 
     except Exception as e:
@@ -73,36 +295,216 @@ def add_email():
 @app.route('/disarm_alarm', methods=['POST'])
 def disarm_alarm():
     """
-    Schaltet den Alarm aus.
+    Schaltet den Alarm eines Sensors aus.
     
-    Diese Funktion empfängt eine POST-Anfrage, um den Alarm auszuschalten.
-    Sie sendet eine MQTT-Nachricht an den MQTT-Broker, um den Alarm auszuschalten.
+    Diese Funktion empfängt eine POST-Anfrage mit der Sensor-ID, um den Alarm auszuschalten.
+    Sie sendet über die gemeinsame MQTT-Verbindung eine MQTT-Nachricht an den MQTT-Broker
+    und wartet, bis der Broker sie bestätigt hat.
     
     Returns:
         str: Eine Antwort, die anzeigt, dass der Alarm ausgeschaltet wurde.
     """
+    sensor_id = request.form.get('sensor_id', type=int)
+    if sensor_id is None:
+        return jsonify({'message': 'Sensor-ID fehlt.'}), 400
     try:
-        is_active = request.form.get('is_active') == 'true'  # `true` aus der Anfrage konvertieren
-        with app.app_context():
-            #send mqtt message to disarm alarm
-            mqtt_client = mqtt.Client()
-            mqtt_client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
-            mqtt_client.connect(config.MQTT_BROKER, config.MQTT_PORT, 60)
-            mqtt_client.publish(f"mailbox/{1}/disarm_alarm", "disarm")
-            mqtt_client.publish(f"mailbox/{1}/arm_alarm", -9999999)
+        mqtt_publisher.publish(f"mailbox/{sensor_id}/disarm_alarm", "disarm")
+        mqtt_publisher.publish(f"mailbox/{sensor_id}/arm_alarm", -9999999)
     except Exception as e:
         print(f"Fehler beim Umschalten des Alarms: {e}")
         return jsonify({'message': f'Fehler: {e}'}), 500
     return "OK"
 
+@app.route('/api/sensors')
+def api_sensors():
+    """
+    Listet die Sensoren mit Einstellungen, Zustand und letztem Messwert.
+
+    Query-Parameter:
+        sensor_id (int): Kann mehrfach angegeben werden, um nur diese Sensoren zu listen.
+
+    Returns:
+        Response: Eine JSON-Antwort mit allen Sensoren, aus einer einzigen Datenbankabfrage.
+    """
+    sensor_ids = sorted(set(request.args.getlist('sensor_id', type=int)))
+    return cached_json_response(('sensors', tuple(sensor_ids)), lambda: query_sensors(sensor_ids))
+
+@app.route('/api/sensors/settings', methods=['PATCH'])
+def api_update_sensor_settings():
+    """
+    Ändert die Einstellungen vieler Sensoren in einer Transaktion.
+
+    Der JSON-Body ist eine Liste von Objekten mit `sensor_id` und beliebigen von
+    `upper_threshold`, `threshold_sensitivity` und `email_addresses`; letzteres
+    ersetzt alle Empfänger des Sensors. Laufende Control-Server übernehmen die
+    Änderungen ohne Neustart.
+
+    Returns:
+        Response: Die IDs der geänderten Sensoren oder eine Fehlermeldung.
+    """
+    try:
+        updates = parse_settings(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'message': f'Ungültige Einstellungen: {e}'}), 400
+    return apply_sensor_settings(updates)
+
+@app.route('/api/sensors/<int:sensor_id>/settings', methods=['PUT'])
+def api_update_sensor(sensor_id):
+    """
+    Ändert die Einstellungen eines Sensors, siehe `api_update_sensor_settings`.
+
+    Returns:
+        Response: Die ID des geänderten Sensors oder eine Fehlermeldung.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'message': 'Ungültige Einstellungen: expected an object'}), 400
+    try:
+        updates = parse_settings([{**body, 'sensor_id': sensor_id}])
+    except ValueError as e:
+        return jsonify({'message': f'Ungültige Einstellungen: {e}'}), 400
+    return apply_sensor_settings(updates)
+
+def apply_sensor_settings(updates):
+    """
+    Speichert geprüfte Einstellungen und verteilt die Änderung an die Control-Server.
+
+    Args:
+        updates (list): Die von `parse_settings` geprüften Änderungen.
+
+    Returns:
+        Response: Die IDs der geänderten Sensoren oder eine Fehlermeldung.
+    """
+    try:
+        sensor_ids = update_sensor_settings(updates)
+    except Exception as e:
+        print(f"Fehler beim Speichern der Einstellungen: {e}")
+        return jsonify({'message': f'Interner Serverfehler: {e}'}), 500
+    for sensor_id in sensor_ids:
+        notify_sensor_config_changed(sensor_id)
+    return jsonify({'updated': sensor_ids})
+
+@app.route('/stream')
+def stream():
+    """
+    Sendet neue Gewichts- und Alarmereignisse als Server-Sent Events.
+
+    Query-Parameter:
+        sensor_id (int): Kann mehrfach angegeben werden, um nur Ereignisse dieser Sensoren zu erhalten.
+
+    Beim Wiederverbinden sendet der Browser die ID des letzten empfangenen Ereignisses im
+    Header `Last-Event-ID`; verpasste Ereignisse werden dann nachgeliefert. Die IDs
+    bestehen aus Zeitstempel, Sensor und Ereignistyp und gelten daher in jedem
+    Gunicorn-Worker, auch wenn die neue Verbindung bei einem anderen Worker landet.
+    Ohne neue Ereignisse wird regelmäßig ein Heartbeat-Kommentar gesendet.
+
+    Returns:
+        Response: Ein `text/event-stream`-Stream.
+    """
+    sensor_ids = set(request.args.getlist('sensor_id', type=int)) or None
+    last_event_id = request.headers.get('Last-Event-ID')
+
+    live_event_source.start()
+    subscription = broadcaster.subscribe(sensor_ids, last_event_id)
+
+    def generate():
+        try:
+            yield f"retry: {config.LIVE_RETRY_MS}\n\n"
+            while not subscription.lagging:
+                event = subscription.get(timeout=config.LIVE_HEARTBEAT)
+                if event is None:
+                    yield ": heartbeat\n\n"
+                else:
+                    yield format_sse(event)
+        finally:
+            broadcaster.unsubscribe(subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+def admin_request_denied():
+    """
+    Prüft das Admin-Token einer Profiling-Anfrage.
+
+    Returns:
+        Response: 404, wenn kein Token konfiguriert ist, 401 bei falschem
+        Token, sonst None.
+    """
+    if not config.PROFILING_ADMIN_TOKEN:
+        return jsonify({'message': 'Nicht gefunden.'}), 404
+    if not authorized(request.headers.get('Authorization'), config.PROFILING_ADMIN_TOKEN):
+        return jsonify({'message': 'Ungültiges Admin-Token.'}), 401
+    return None
+
+@app.route('/admin/profile')
+def admin_profile():
+    """
+    Zeichnet für einige Sekunden die Stacks aller Threads des Prozesses auf.
+
+    Erfasst werden die Request-Threads von Flask und, falls der Control-Server
+    im selben Prozess läuft, dessen Threads. Das Ergebnis im Collapsed-Stack-
+    Format lässt sich mit flamegraph.pl oder speedscope als Flamegraph anzeigen.
+
+    Query-Parameter:
+        seconds (float): Dauer der Aufzeichnung, Standard: 10, höchstens `profiling.max_seconds`.
+
+    Returns:
+        Response: Die Stacks als Textdatei, 409, wenn bereits aufgezeichnet wird.
+    """
+    denied = admin_request_denied()
+    if denied:
+        return denied
+    seconds = request.args.get('seconds', 10, type=float)
+    if not 0 < seconds <= config.PROFILING_MAX_SECONDS:
+        return jsonify({'message': f'seconds muss zwischen 0 und {config.PROFILING_MAX_SECONDS} liegen.'}), 400
+    try:
+        stacks = sample_stacks(seconds, config.PROFILING_INTERVAL)
+    except ProfilerBusy as e:
+        return jsonify({'message': str(e)}), 409
+    return Response(stacks, mimetype='text/plain', headers={
+        'Content-Disposition': 'attachment; filename="profile.collapsed"',
+    })
+
+@app.route('/admin/slow-events')
+def admin_slow_events():
+    """
+    Liefert die langsamen Sensor-Ereignisse mit der Dauer jeder Verarbeitungsstufe.
+
+    Returns:
+        Response: Die Ereignisse als JSON, das neueste zuerst.
+    """
+    denied = admin_request_denied()
+    if denied:
+        return denied
+    return jsonify({
+        'threshold_ms': slow_events.threshold * 1000,
+        'events': slow_events.entries(),
+    })
+
+def shutdown():
+    """
+    Schließt die MQTT-Verbindungen des Prozesses, z. B. beim Beenden eines Gunicorn-Workers.
+    """
+    live_event_source.close()
+    mqtt_publisher.close()
+
 def control_server_task_context():
     """
-    Startet die Funktion `control_server_task` im Anwendungsk
+    Startet die Funktion `control_server_task` im Anwendungskontext
     """
     with app.app_context():
         control_server_task()
 
 def main():
+    """
+    Startet Webserver und Control-Server gemeinsam in einem Prozess für die Entwicklung.
+
+    Im Betrieb laufen beide getrennt: der Webserver mit Gunicorn
+    (`gunicorn -c gunicorn.conf.py wsgi:app`) und der Control-Server als
+    eigener Prozess (`python control_server.py`).
+    """
     thread = threading.Thread(target=control_server_task_context)
     thread.start()
     
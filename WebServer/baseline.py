@@ -0,0 +1,200 @@
+from collections import deque
+from datetime import datetime, timedelta
+from bisect import bisect_left, bisect_right, insort
+from sqlalchemy import select
+from models import Weights
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATISTICS = ('mean', 'median', 'trimmed_mean')
+
+
+class RollingWindow:
+    """
+    Sliding time window over the readings of a single sensor.
+
+    The window keeps a running sum and count, so the mean costs O(1) per
+    reading. For the robust statistics a sorted copy of the window is
+    maintained as well: finding the position of a reading is O(log n), but
+    inserting and evicting shift the list and cost O(n) per reading. Reading
+    the median is then O(1) and the trimmed mean O(n). With windows of a few
+    hundred readings the shifts are plain memory moves and cheaper than a
+    balanced tree in Python.
+    """
+
+    def __init__(self, window_seconds=60, statistic='mean', trim_fraction=0.1):
+        """
+        Initializes an empty window.
+
+        Args:
+            window_seconds (float): The length of the window in seconds.
+            statistic (str): One of 'mean', 'median' or 'trimmed_mean'.
+            trim_fraction (float): Fraction cut from each end for the trimmed mean.
+        """
+        if statistic not in STATISTICS:
+            raise ValueError(f"Unknown baseline statistic: {statistic}")
+        self.window = timedelta(seconds=window_seconds)
+        self.statistic = statistic
+        self.trim_fraction = trim_fraction
+        self._readings = deque()
+        self._sorted = [] if statistic != 'mean' else None
+        self._sum = 0.0
+
+    def __len__(self):
+        return len(self._readings)
+
+    def add(self, timestamp, value):
+        """
+        Adds a reading and evicts all readings that fell out of the window.
+
+        Args:
+            timestamp (datetime): The time of the reading.
+            value (float): The weight value.
+        """
+        self._readings.append((timestamp, value))
+        self._sum += value
+        if self._sorted is not None:
+            insort(self._sorted, value)
+        self.evict(timestamp)
+
+    def evict(self, now):
+        """
+        Removes all readings older than the window relative to `now`.
+
+        Args:
+            now (datetime): The reference time.
+        """
+        oldest = now - self.window
+        while self._readings and self._readings[0][0] < oldest:
+            _, value = self._readings.popleft()
+            self._sum -= value
+            if self._sorted is not None:
+                del self._sorted[bisect_left(self._sorted, value)]
+
+    def value(self):
+        """
+        Returns the configured statistic over the readings in the window.
+
+        Returns:
+            float: The baseline value, or None if the window is empty.
+        """
+        count = len(self._readings)
+        if not count:
+            return None
+        if self.statistic == 'mean':
+            return self._sum / count
+        if self.statistic == 'median':
+            middle = count // 2
+            if count % 2:
+                return self._sorted[middle]
+            return (self._sorted[middle - 1] + self._sorted[middle]) / 2
+        cut = int(count * self.trim_fraction)
+        trimmed = self._sorted[cut:count - cut]
+        return sum(trimmed) / len(trimmed)
+
+
+class BaselineTracker:
+    """
+    Keeps one rolling window per sensor and provides the baseline weight
+    used for package detection without querying the database.
+    """
+
+    def __init__(self, window_seconds=60, statistic='mean', trim_fraction=0.1):
+        """
+        Initializes the tracker.
+
+        Args:
+            window_seconds (float): The length of the window in seconds.
+            statistic (str): One of 'mean', 'median' or 'trimmed_mean'.
+            trim_fraction (float): Fraction cut from each end for the trimmed mean.
+        """
+        if statistic not in STATISTICS:
+            raise ValueError(f"Unknown baseline statistic: {statistic}")
+        self.window_seconds = window_seconds
+        self.statistic = statistic
+        self.trim_fraction = trim_fraction
+        self._windows = {}
+
+    def _window(self, sensor_id):
+        window = self._windows.get(sensor_id)
+        if window is None:
+            window = self._windows.setdefault(
+                sensor_id, RollingWindow(self.window_seconds, self.statistic, self.trim_fraction)
+            )
+        return window
+
+    def add(self, sensor_id, weight, timestamp=None):
+        """
+        Adds a reading to the window of a sensor.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+            weight (float): The weight value.
+            timestamp (datetime, optional): The time of the reading. Defaults to now.
+        """
+        self._window(sensor_id).add(timestamp or datetime.now(), weight)
+
+    def baseline(self, sensor_id):
+        """
+        Returns the baseline weight of a sensor.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+
+        Returns:
+            float: The baseline weight over the configured window.
+
+        Raises:
+            ValueError: If there is no reading of the sensor within the window.
+        """
+        window = self._windows.get(sensor_id)
+        value = window.value() if window is not None else None
+        if value is None:
+            raise ValueError(f"No weight data found for sensor_id {sensor_id} in the last {self.window_seconds} seconds.")
+        return value
+
+    def warm_start(self, engine, points=60, heartbeat_seconds=60):
+        """
+        Fills the windows with the step series of the readings stored within the window length.
+
+        The deadband filter only stores readings that changed noticeably and a
+        heartbeat, so the stored rows of a steady sensor are much sparser than
+        the ones of a noisy sensor. Instead of the rows, every window gets the
+        weight of its sensor at `points` evenly spaced times, carried forward
+        from the last stored reading like `history.fill_steps`, so each part of
+        the window counts as much as it does for the live readings.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): The engine used to load the readings.
+            points (int): The number of samples of the step series per sensor.
+            heartbeat_seconds (float): The heartbeat of the deadband filter; the
+                last reading within it before the window gives the initial weight.
+
+        Returns:
+            int: The number of loaded samples.
+        """
+        now = datetime.now()
+        window = timedelta(seconds=self.window_seconds)
+        since = now - window - timedelta(seconds=heartbeat_seconds)
+        query = select(Weights.sensor_id, Weights.timestamp, Weights.value).where(
+            Weights.timestamp >= since,
+            Weights.timestamp <= now,
+        ).order_by(Weights.timestamp)
+        readings = {}
+        with engine.connect() as connection:
+            for sensor_id, timestamp, value in connection.execute(query):
+                readings.setdefault(sensor_id, []).append((timestamp, value))
+
+        samples = [now - window + window * (i + 1) / points for i in range(points)]
+        loaded = 0
+        for sensor_id, steps in readings.items():
+            timestamps = [timestamp for timestamp, _ in steps]
+            for sample in samples:
+                # The weight at `sample` is the one of the last reading up to it
+                index = bisect_right(timestamps, sample)
+                if index:
+                    self.add(sensor_id, steps[index - 1][1], sample)
+                    loaded += 1
+        logger.info(f"Baseline warm start loaded {loaded} samples for {len(readings)} sensors.")
+        return loaded
@@ -0,0 +1,328 @@
+"""
+Load generator and end-to-end benchmark for the MQTT -> database -> alert pipeline.
+
+Simulates N virtual mailboxes that publish `mailbox/<id>/weight` (or, with
+`--batch`, binary batches on `mailbox/<id>/weights`, and occasionally
+`mailbox/<id>/alarm`) and drop packages on their scales, feeds
+them through the control server pipeline and reports
+
+- sustained throughput in messages per second,
+- latency percentiles from publish to the committed database row and from
+  the publish of a package reading to the `arm_alarm` publish,
+- alert correctness (detected, missed, duplicate and false package alerts).
+
+By default everything runs in-process: messages are passed straight to
+`control_server.on_message`, the database is a temporary file of the SQLite
+storage backend and the MQTT publisher and e-mail notifier are replaced by
+recording fakes. With `--broker` the readings travel through a real MQTT
+broker instead, and with `--db-uri` a real PostgreSQL/TimescaleDB database
+is used. The daily reports and the liveness watchdog are disabled.
+
+Example:
+    python benchmark.py --sensors 2000 --duration 30 --rate 1 --drops 0.01
+"""
+from flask import Flask
+from models import db, init_db, Weights
+from configweb import Config
+from payload import encode_batch
+from datetime import datetime
+import control_server
+import paho.mqtt.client as mqtt
+import argparse
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+
+class RecordingPublisher:
+    """
+    Stand-in for `MqttPublisher` that records the time of every publish.
+    """
+
+    def __init__(self):
+        self.published = []
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=1, retain=False, wait=True):
+        with self._lock:
+            self.published.append((time.perf_counter(), topic, payload))
+
+
+class RecordingNotifier:
+    """
+    Stand-in for `NotificationDispatcher` that records notifications instead of sending e-mails.
+    """
+
+    def __init__(self):
+        self.notifications = []
+        self._lock = threading.Lock()
+
+    def notify(self, sensor_id, subject, body, recipients, html_table=None):
+        with self._lock:
+            self.notifications.append((time.perf_counter(), sensor_id, subject))
+        return True
+
+    def close(self, timeout=30):
+        pass
+
+    def stats(self):
+        return {'recorded': len(self.notifications)}
+
+
+class InstrumentedWeightBuffer(control_server.WeightBuffer):
+    """
+    Weight buffer that records when each reading was committed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.committed = {}
+        self.committed_at = {}
+        super().__init__(*args, **kwargs)
+
+    def _write(self, batch):
+        written = super()._write(batch)
+        now = time.perf_counter()
+        for sensor_id, readings in batch.items():
+            for timestamp, weight in readings:
+                self.committed[(sensor_id, weight)] = now
+                self.committed_at[(sensor_id, round(timestamp.timestamp() * 1000))] = now
+        return written
+
+
+class Message:
+    """
+    Minimal stand-in for `mqtt.MQTTMessage`.
+    """
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class VirtualSensor:
+    """
+    A simulated mailbox scale with an empty weight, noise and package drops.
+    """
+
+    def __init__(self, sensor_id, drop_probability, package_weight):
+        self.sensor_id = sensor_id
+        self.drop_probability = drop_probability
+        self.package_weight = package_weight
+        self.weight = random.uniform(0, 20)
+        self.sequence = 0
+        self.batch_sequence = 0
+        self.batch = []
+
+    def next_reading(self):
+        """
+        Returns the next reading and whether a package was dropped with it.
+
+        The sequence number is encoded in the sub-milligram digits so every
+        reading of a sensor is unique and can be matched to its database row.
+        """
+        self.sequence += 1
+        dropped = random.random() < self.drop_probability
+        if dropped:
+            self.weight += random.uniform(*self.package_weight)
+        noise = random.uniform(-0.5, 0.5)
+        return round(self.weight + noise, 3) + self.sequence * 1e-7, dropped
+
+
+def percentiles(values, points=(50, 95, 99)):
+    if not values:
+        return {f"p{p}": None for p in points}
+    values = sorted(values)
+    return {f"p{p}": values[min(len(values) - 1, int(len(values) * p / 100))] * 1000 for p in points}
+
+
+def create_app(db_uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = db_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_db(app)
+    return app
+
+
+def run(args):
+    config = Config()
+    config.DISPATCHER_WORKERS = args.workers
+    config.INGEST_BATCH_SIZE = args.batch_size
+    config.INGEST_FLUSH_INTERVAL = args.flush_interval
+    config.MQTT_PARTITIONS = 1
+    config.MQTT_PARTITION = 0
+    config.REPORTS_ENABLED = False
+    config.WATCHDOG_OFFLINE_AFTER = 0
+
+    db_file = None
+    db_uri = args.db_uri
+    if db_uri is None:
+        db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False).name
+        db_uri = f"sqlite:///{db_file}"
+    app = create_app(db_uri)
+
+    publisher = RecordingPublisher()
+    notifier = RecordingNotifier()
+    sensors = [VirtualSensor(i + 1, args.drops, (args.package_min, args.package_max)) for i in range(args.sensors)]
+
+    with app.app_context():
+        for sensor in sensors:
+            control_server.initialize_sensor(sensor.sensor_id)
+        db.session.remove()
+
+        receiver = mqtt.Client() if args.broker else None
+        userdata = control_server.create_pipeline(config, receiver, notifier, publisher)
+        userdata['weight_buffer'].close()
+        userdata['weight_buffer'] = InstrumentedWeightBuffer(
+            db.engine,
+            batch_size=config.INGEST_BATCH_SIZE,
+            flush_interval=config.INGEST_FLUSH_INTERVAL,
+            max_pending=config.INGEST_MAX_PENDING,
+            put_timeout=config.INGEST_PUT_TIMEOUT,
+            spool=userdata.get('spool'),
+            replay_batch_size=config.INGEST_REPLAY_BATCH_SIZE
+        )
+        control_server.register_pipeline_metrics(userdata)
+
+        if args.broker:
+            host, _, port = args.broker.partition(':')
+            receiver.on_connect = control_server.on_connect
+            receiver.on_message = control_server.on_message
+            receiver.user_data_set(userdata)
+            receiver.connect(host, int(port or 1883))
+            receiver.loop_start()
+            sender = mqtt.Client()
+            sender.connect(host, int(port or 1883))
+            sender.loop_start()
+            time.sleep(1)
+
+            def send(topic, payload):
+                sender.publish(topic, payload)
+        else:
+            def send(topic, payload):
+                control_server.on_message(None, userdata, Message(topic, payload))
+
+        published = {}
+        drops = []
+        sent = 0
+        readings_sent = 0
+        interval = 1 / args.rate if args.rate > 0 else 0
+        started = time.perf_counter()
+        next_tick = started
+        while time.perf_counter() - started < args.duration:
+            for sensor in sensors:
+                weight, dropped = sensor.next_reading()
+                now = time.perf_counter()
+                if dropped:
+                    drops.append((now, sensor.sensor_id))
+                readings_sent += 1
+                if args.batch:
+                    # Batched readings are matched to their rows by the device timestamp,
+                    # the sequence digits of the weight do not survive float32
+                    timestamp = datetime.fromtimestamp(round(time.time() * 1000) / 1000)
+                    published[(sensor.sensor_id, round(timestamp.timestamp() * 1000))] = now
+                    sensor.batch.append((timestamp, weight))
+                    if len(sensor.batch) >= args.batch:
+                        send(f"mailbox/{sensor.sensor_id}/weights", encode_batch(sensor.batch_sequence, sensor.batch))
+                        sensor.batch_sequence += 1
+                        sensor.batch = []
+                        sent += 1
+                else:
+                    published[(sensor.sensor_id, weight)] = now
+                    send(f"mailbox/{sensor.sensor_id}/weight", str(weight).encode())
+                    sent += 1
+                if args.alarms and random.random() < args.alarms:
+                    send(f"mailbox/{sensor.sensor_id}/alarm", b"1")
+                    sent += 1
+            if interval:
+                next_tick += interval
+                time.sleep(max(0, next_tick - time.perf_counter()))
+
+        if args.broker:
+            time.sleep(1)
+            receiver.loop_stop()
+            sender.loop_stop()
+        buffer = userdata['weight_buffer']
+        control_server.shutdown_pipeline(userdata)
+        elapsed = time.perf_counter() - started
+        stored = db.session.query(Weights).count()
+
+    if db_file:
+        os.remove(db_file)
+
+    committed = buffer.committed_at if args.batch else buffer.committed
+    db_latencies = [
+        committed_at - published[key]
+        for key, committed_at in committed.items()
+        if key in published
+    ]
+
+    drops_by_sensor = {}
+    for dropped_at, sensor_id in drops:
+        drops_by_sensor.setdefault(sensor_id, []).append(dropped_at)
+    arms = {}
+    for timestamp, topic, _ in publisher.published:
+        if topic.endswith('/arm_alarm'):
+            arms.setdefault(int(topic.split('/')[1]), []).append(timestamp)
+
+    alert_latencies = []
+    matched_arms = 0
+    false_alerts = 0
+    for sensor_id, dropped_times in drops_by_sensor.items():
+        for dropped_at in dropped_times:
+            hits = [t for t in arms.get(sensor_id, []) if 0 <= t - dropped_at <= args.alert_window]
+            if hits:
+                alert_latencies.append(hits[0] - dropped_at)
+    for sensor_id, times in arms.items():
+        for t in times:
+            if any(0 <= t - dropped_at <= args.alert_window for dropped_at in drops_by_sensor.get(sensor_id, [])):
+                matched_arms += 1
+            else:
+                false_alerts += 1
+    detected = len(alert_latencies)
+
+    print(f"Sensors:              {args.sensors}")
+    print(f"Readings published:   {readings_sent}")
+    print(f"Messages published:   {sent}")
+    print(f"Rows stored:          {stored}")
+    print(f"Elapsed:              {elapsed:.2f} s")
+    print(f"Throughput:           {sent / elapsed:.0f} msg/s, {readings_sent / elapsed:.0f} readings/s")
+    print(f"Publish -> DB row:    {percentiles(db_latencies)} ms")
+    print(f"Drop -> arm_alarm:    {percentiles(alert_latencies)} ms")
+    print(f"Package drops:        {len(drops)}")
+    print(f"Detected:             {detected}")
+    print(f"Missed:               {len(drops) - detected}")
+    print(f"Duplicate alerts:     {max(0, matched_arms - detected)}")
+    print(f"False alerts:         {false_alerts}")
+    print(f"Notifications:        {len(notifier.notifications)}")
+    print(f"Dropped readings:     {buffer.dropped}, failed writes: {buffer.failed}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensors', type=int, default=100, help="number of virtual mailboxes")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to publish")
+    parser.add_argument('--rate', type=float, default=1, help="readings per second and sensor, 0 for as fast as possible")
+    parser.add_argument('--drops', type=float, default=0.01, help="probability of a package drop per reading")
+    parser.add_argument('--package-min', type=float, default=100, help="minimum package weight")
+    parser.add_argument('--package-max', type=float, default=2000, help="maximum package weight")
+    parser.add_argument('--alarms', type=float, default=0.0, help="probability of an alarm message per reading")
+    parser.add_argument('--alert-window', type=float, default=5, help="seconds within which a drop must be alerted")
+    parser.add_argument('--workers', type=int, default=4, help="dispatcher worker threads, 0 for inline processing")
+    parser.add_argument('--batch', type=int, default=0, help="readings per binary batch message, 0 for one plain-float message per reading")
+    parser.add_argument('--batch-size', type=int, default=500, help="weight buffer batch size")
+    parser.add_argument('--flush-interval', type=float, default=1.0, help="weight buffer flush interval")
+    parser.add_argument('--db-uri', help="database URI, defaults to a temporary SQLite database")
+    parser.add_argument('--broker', help="host[:port] of a local MQTT broker, defaults to in-process delivery")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    logging.basicConfig(level=logging.WARNING)
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,19 +13,84 @@ class Config:
             MQTT_CLIENT_ID (str): The MQTT client ID.
             MQTT_USERNAME (str): The MQTT username.
             MQTT_PASSWORD (str): The MQTT password.
+            MQTT_PARTITIONS (int): Number of control servers the sensors are split between.
+            MQTT_PARTITION (int): The partition of this control server, it handles the sensors with sensor_id % MQTT_PARTITIONS == MQTT_PARTITION.
+            MQTT_PERSISTENT_SESSION (bool): Whether the broker keeps the session of the control server across reconnects.
+            DB_BACKEND (str): 'postgres' for TimescaleDB or 'sqlite' for an embedded database file.
+            DB_PATH (str): The database file of the sqlite backend.
             DB_HOST (str): The database host.
             DB_PORT (int): The database port.
             DB_NAME (str): The database name.
             DB_USER (str): The database user.
             DB_PASSWORD (str): The database password.
+            DB_POOL_SIZE (int): Number of connections kept open in the pool of each process.
+            DB_MAX_OVERFLOW (int): Number of additional connections opened under load.
+            DB_POOL_TIMEOUT (float): Seconds to wait for a free connection before failing.
+            DB_POOL_RECYCLE (int): Seconds after which a connection is replaced, -1 to keep it forever.
+            DB_POOL_PRE_PING (bool): Whether a connection is tested before use, so broken ones are replaced.
             EMAIL_SMTP_SERVER (str): The SMTP server for email.
             EMAIL_PORT (int): The port for the SMTP server.
             EMAIL_USERNAME (str): The username for the email account.
             EMAIL_PASSWORD (str): The password for the email account.
             EMAIL_FROM_ADDRESS (str): The from address for the email.
+            EMAIL_USE_TLS (bool): Whether STARTTLS is used for the SMTP connection.
             LOG_LEVEL (str): The logging level.
             LOG_FILE (str): The logging file path.
             DB_URI (str): The database URI for SQLAlchemy.
+            TIMESCALE_WEIGHTS_COMPRESS_AFTER (str): Age after which weight chunks are compressed, e.g. '7 days'.
+            TIMESCALE_ALARMS_COMPRESS_AFTER (str): Age after which alarm chunks are compressed.
+            TIMESCALE_WEIGHTS_RETENTION (str): Age after which raw weights are dropped.
+            TIMESCALE_ALARMS_RETENTION (str): Age after which alarms are dropped.
+            TIMESCALE_WEIGHTS_1M_RETENTION (str): Age after which 1-minute aggregates are dropped.
+            TIMESCALE_WEIGHTS_1H_RETENTION (str): Age after which 1-hour aggregates are dropped.
+            INGEST_BATCH_SIZE (int): Number of pending readings that triggers a bulk insert.
+            INGEST_FLUSH_INTERVAL (float): Maximum seconds between two bulk inserts.
+            INGEST_MAX_PENDING (int): Maximum number of buffered readings before producers are throttled.
+            INGEST_PUT_TIMEOUT (float): Seconds a producer waits for buffer space before a reading is dropped.
+            INGEST_DEADBAND_EPSILON (float): Weight change that is always stored, smaller changes are suppressed.
+            INGEST_HEARTBEAT_SECONDS (float): Maximum seconds between two stored readings of a sensor.
+            INGEST_SPOOL_DIR (str): Directory of the spool for readings the database could not take, None disables it.
+            INGEST_SPOOL_MAX_BYTES (int): Disk space of the spool before the oldest readings are evicted.
+            INGEST_SPOOL_SEGMENT_BYTES (int): Size of a spool segment file.
+            INGEST_SPOOL_FSYNC (bool): Whether spooled batches are synced to disk before the flush continues.
+            INGEST_REPLAY_BATCH_SIZE (int): Number of spooled readings replayed with one insert.
+            BASELINE_WINDOW_SECONDS (float): Length of the rolling window used as baseline weight.
+            BASELINE_STATISTIC (str): Baseline statistic, one of 'mean', 'median' or 'trimmed_mean'.
+            BASELINE_TRIM_FRACTION (float): Fraction cut from each end of the window for 'trimmed_mean'.
+            DETECTION_ALGORITHM (str): Package detector, one of 'threshold', 'step' or 'cusum'.
+            DETECTION_DEBOUNCE (int): Readings above the threshold the step detector waits for.
+            DETECTION_CUSUM_DRIFT (float): Deviation ignored by the CUSUM detector, in multiples of the sensitivity.
+            DETECTION_CUSUM_THRESHOLD (float): Accumulated deviation reported by the CUSUM detector, in multiples of the sensitivity.
+            CONFIG_CACHE_TTL (float): Seconds the sensor configuration is cached by the control server.
+            NOTIFY_WORKERS (int): Number of threads sending e-mail notifications.
+            NOTIFY_MAX_QUEUE (int): Maximum number of queued notifications.
+            NOTIFY_MAX_RETRIES (int): Number of retries after a failed delivery.
+            NOTIFY_RETRY_BACKOFF (float): Seconds before the first retry, doubled for each further retry.
+            NOTIFY_IDLE_TIMEOUT (float): Seconds after which an unused SMTP connection is closed.
+            REPORTS_ENABLED (bool): Whether the control server sends the daily activity reports.
+            REPORTS_AT (str): Local time of day the report of the previous day is sent, e.g. '07:00'.
+            CONTROL_HEALTH_HOST (str): Address the control server serves its health checks and metrics on.
+            CONTROL_HEALTH_PORT (int): Port the control server serves its health checks and metrics on.
+            WATCHDOG_OFFLINE_AFTER (float): Seconds without message after which a sensor is reported offline, 0 disables the watchdog.
+            WATCHDOG_TICK (float): Seconds between two checks of the liveness watchdog.
+            WATCHDOG_SLOTS (int): Number of buckets of the timer wheel of the liveness watchdog.
+            WATCHDOG_NOTIFY (bool): Whether offline and online transitions are sent by e-mail.
+            DISPATCHER_WORKERS (int): Number of threads processing sensor events, 0 processes them on the MQTT thread.
+            DISPATCHER_MAX_QUEUE (int): Maximum number of queued events per worker.
+            DISPATCHER_OVERFLOW (str): Policy for full queues, one of 'block', 'drop_newest' or 'drop_oldest'.
+            DISPATCHER_PUT_TIMEOUT (float): Seconds the MQTT thread waits for queue space with the 'block' policy.
+            HISTORY_CACHE_TTL (float): Seconds dashboard and history responses are shared between requests.
+            HISTORY_MAX_LIMIT (int): Maximum number of points per history page.
+            EXPORT_CHUNK_SIZE (int): Rows an export reads from the database at a time.
+            LIVE_HEARTBEAT (float): Seconds between heartbeats on idle live update streams.
+            LIVE_RETRY_MS (int): Milliseconds browsers wait before reconnecting a live update stream.
+            LIVE_HISTORY_SIZE (int): Number of live events kept for replay after a reconnect.
+            LIVE_CLIENT_QUEUE_SIZE (int): Maximum number of undelivered live events per browser.
+            PROFILING_ADMIN_TOKEN (str): Bearer token of the profiling endpoints, None disables them.
+            PROFILING_MAX_SECONDS (float): Longest profile that can be requested.
+            PROFILING_INTERVAL (float): Seconds between two stack samples of the profiler.
+            PROFILING_SLOW_EVENT_THRESHOLD (float): Seconds after which a sensor event is logged with its stage timings, 0 disables it.
+            PROFILING_SLOW_EVENT_LOG_SIZE (int): Number of slow events kept for the profiling endpoints.
         """
         
         config_path = os.path.join(os.path.dirname(__file__), 'config.yml')
@@ -40,20 +105,125 @@ class Config:
         self.MQTT_CLIENT_ID = config['mqtt']['client_id']
         self.MQTT_USERNAME = config['mqtt']['username']
         self.MQTT_PASSWORD = config['mqtt']['password']
+        self.MQTT_PARTITIONS = config['mqtt'].get('partitions', 1)
+        self.MQTT_PARTITION = config['mqtt'].get('partition', 0)
+        if config['mqtt'].get('shared_group'):
+            # A shared subscription spreads the events of a sensor over all instances,
+            # which breaks their order and the per-sensor state of each instance
+            raise ValueError("mqtt.shared_group is not supported, split the sensors with mqtt.partitions and mqtt.partition")
+        if not 0 <= self.MQTT_PARTITION < self.MQTT_PARTITIONS:
+            raise ValueError(f"mqtt.partition must be between 0 and {self.MQTT_PARTITIONS - 1}")
+        self.MQTT_PERSISTENT_SESSION = config['mqtt'].get('persistent_session', True)
 
+        self.DB_BACKEND = config['database'].get('backend', 'postgres')
+        self.DB_PATH = config['database'].get('path', 'smart_mailbox.db')
         self.DB_HOST = config['database'].get('host')
         self.DB_PORT = config['database'].get('port')
         self.DB_NAME = config['database'].get('name')
         self.DB_USER = config['database'].get('user')
         self.DB_PASSWORD = config['database'].get('password')
+        self.DB_POOL_SIZE = config['database'].get('pool_size', 10)
+        self.DB_MAX_OVERFLOW = config['database'].get('max_overflow', 20)
+        self.DB_POOL_TIMEOUT = config['database'].get('pool_timeout', 10)
+        self.DB_POOL_RECYCLE = config['database'].get('pool_recycle', 1800)
+        self.DB_POOL_PRE_PING = config['database'].get('pool_pre_ping', True)
 
         self.EMAIL_SMTP_SERVER = config['email'].get('smtp_server')
         self.EMAIL_PORT = config['email'].get('port')
         self.EMAIL_USERNAME = config['email'].get('username')
         self.EMAIL_PASSWORD = config['email'].get('password')
         self.EMAIL_FROM_ADDRESS = config['email'].get('from_address')
+        self.EMAIL_USE_TLS = config['email'].get('use_tls', True)
 
         self.LOG_LEVEL = config['logging'].get('level')
         self.LOG_FILE = config['logging'].get('file')
 
-        self.DB_URI = f"postgresql+psycopg2://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+        timescale = config.get('timescale') or {}
+        self.TIMESCALE_WEIGHTS_COMPRESS_AFTER = timescale.get('weights_compress_after', '7 days')
+        self.TIMESCALE_ALARMS_COMPRESS_AFTER = timescale.get('alarms_compress_after', '30 days')
+        self.TIMESCALE_WEIGHTS_RETENTION = timescale.get('weights_retention')
+        self.TIMESCALE_ALARMS_RETENTION = timescale.get('alarms_retention')
+        self.TIMESCALE_WEIGHTS_1M_RETENTION = timescale.get('weights_1m_retention')
+        self.TIMESCALE_WEIGHTS_1H_RETENTION = timescale.get('weights_1h_retention')
+
+        ingest = config.get('ingest') or {}
+        self.INGEST_BATCH_SIZE = ingest.get('batch_size', 500)
+        self.INGEST_FLUSH_INTERVAL = ingest.get('flush_interval', 1.0)
+        self.INGEST_MAX_PENDING = ingest.get('max_pending', 10000)
+        self.INGEST_PUT_TIMEOUT = ingest.get('put_timeout', 1.0)
+        self.INGEST_DEADBAND_EPSILON = ingest.get('deadband_epsilon', 1.0)
+        self.INGEST_HEARTBEAT_SECONDS = ingest.get('heartbeat_seconds', 60)
+        self.INGEST_SPOOL_DIR = ingest.get('spool_dir')
+        self.INGEST_SPOOL_MAX_BYTES = ingest.get('spool_max_bytes', 512 * 1024 * 1024)
+        self.INGEST_SPOOL_SEGMENT_BYTES = ingest.get('spool_segment_bytes', 16 * 1024 * 1024)
+        self.INGEST_SPOOL_FSYNC = ingest.get('spool_fsync', True)
+        self.INGEST_REPLAY_BATCH_SIZE = ingest.get('replay_batch_size', 5000)
+
+        baseline = config.get('baseline') or {}
+        self.BASELINE_WINDOW_SECONDS = baseline.get('window_seconds', 60)
+        self.BASELINE_STATISTIC = baseline.get('statistic', 'mean')
+        self.BASELINE_TRIM_FRACTION = baseline.get('trim_fraction', 0.1)
+
+        detection = config.get('detection') or {}
+        self.DETECTION_ALGORITHM = detection.get('algorithm', 'threshold')
+        self.DETECTION_DEBOUNCE = detection.get('debounce', 3)
+        self.DETECTION_CUSUM_DRIFT = detection.get('cusum_drift', 0.5)
+        self.DETECTION_CUSUM_THRESHOLD = detection.get('cusum_threshold', 2.0)
+
+        cache = config.get('cache') or {}
+        self.CONFIG_CACHE_TTL = cache.get('sensor_config_ttl', 300)
+
+        notifications = config.get('notifications') or {}
+        self.NOTIFY_WORKERS = notifications.get('workers', 2)
+        self.NOTIFY_MAX_QUEUE = notifications.get('max_queue', 1000)
+        self.NOTIFY_MAX_RETRIES = notifications.get('max_retries', 3)
+        self.NOTIFY_RETRY_BACKOFF = notifications.get('retry_backoff', 2.0)
+        self.NOTIFY_IDLE_TIMEOUT = notifications.get('idle_timeout', 60)
+
+        reports = config.get('reports') or {}
+        self.REPORTS_ENABLED = reports.get('enabled', False)
+        self.REPORTS_AT = reports.get('at', '07:00')
+
+        control_server = config.get('control_server') or {}
+        self.CONTROL_HEALTH_HOST = control_server.get('health_host', '0.0.0.0')
+        self.CONTROL_HEALTH_PORT = control_server.get('health_port', 8001)
+
+        watchdog = config.get('watchdog') or {}
+        self.WATCHDOG_OFFLINE_AFTER = watchdog.get('offline_after', 300)
+        self.WATCHDOG_TICK = watchdog.get('tick', 1.0)
+        self.WATCHDOG_SLOTS = watchdog.get('slots', 512)
+        self.WATCHDOG_NOTIFY = watchdog.get('notify', True)
+
+        dispatcher = config.get('dispatcher') or {}
+        self.DISPATCHER_WORKERS = dispatcher.get('workers', 4)
+        self.DISPATCHER_MAX_QUEUE = dispatcher.get('max_queue', 1000)
+        self.DISPATCHER_OVERFLOW = dispatcher.get('overflow', 'block')
+        self.DISPATCHER_PUT_TIMEOUT = dispatcher.get('put_timeout', 1.0)
+
+        history = config.get('history') or {}
+        self.HISTORY_CACHE_TTL = history.get('cache_ttl', 5)
+        self.HISTORY_MAX_LIMIT = history.get('max_limit', 5000)
+
+        export = config.get('export') or {}
+        self.EXPORT_CHUNK_SIZE = export.get('chunk_size', 10000)
+
+        live = config.get('live') or {}
+        self.LIVE_HEARTBEAT = live.get('heartbeat', 15)
+        self.LIVE_RETRY_MS = live.get('retry_ms', 3000)
+        self.LIVE_HISTORY_SIZE = live.get('history_size', 1000)
+        self.LIVE_CLIENT_QUEUE_SIZE = live.get('client_queue_size', 100)
+
+        profiling = config.get('profiling') or {}
+        self.PROFILING_ADMIN_TOKEN = profiling.get('admin_token')
+        self.PROFILING_MAX_SECONDS = profiling.get('max_seconds', 60)
+        self.PROFILING_INTERVAL = profiling.get('interval', 0.005)
+        self.PROFILING_SLOW_EVENT_THRESHOLD = profiling.get('slow_event_threshold', 0.25)
+        self.PROFILING_SLOW_EVENT_LOG_SIZE = profiling.get('slow_event_log_size', 200)
+
+        if self.DB_BACKEND == 'sqlite':
+            # Flask-SQLAlchemy would resolve a relative path against the instance folder
+            self.DB_URI = f"sqlite:///{os.path.abspath(self.DB_PATH)}"
+        elif self.DB_BACKEND == 'postgres':
+            self.DB_URI = f"postgresql+psycopg2://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+        else:
+            raise ValueError(f"Unknown database backend: {self.DB_BACKEND}")
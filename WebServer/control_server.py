@@ -1,38 +1,297 @@
 from configweb import Config
 from email_server import EmailSender
+from notifications import NotificationDispatcher
+from dispatcher import ShardedDispatcher
+from mqtt_publisher import get_publisher
+from metrics import Counter, Gauge, Histogram, timed
+from flask import Flask, current_app
+from health import HealthServer
+from baseline import BaselineTracker
+from deadband import DeadbandFilter
+from detection import DetectionEngine, create_detector
+from sensor_state import SensorStateMachine, STATES
+from payload import PayloadError, SequenceTracker, decode_batch, decode_legacy
+from spool import MAX_SENSOR_ID, Spool
+from watchdog import LivenessWatchdog, OFFLINE
+from profiling import ProfilerBusy, SlowEventLog, sample_stacks
+from reports import ReportScheduler
 import paho.mqtt.client as mqtt
-from models import db, Weights, UpperThreshold, ThresholdSensitivity, EmailNotification, Alarms
-from sqlalchemy import func
-from psycopg2.errors import UniqueViolation
-from datetime import datetime, timedelta
+from models import db, init_db, Weights, UpperThreshold, ThresholdSensitivity, EmailNotification, Alarms, SensorStatusEvents
+from storage import get_storage
+from sqlalchemy.dialects.postgresql import insert
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import bindparam, select, text
+import argparse
+import json
 import logging
+import signal
+import struct
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 mqtt_client = mqtt.Client()
+mqtt_connected = threading.Event()
+draining = threading.Event()
 
+MESSAGES = Counter('control_server_messages', 'MQTT messages received by the control server.', ['event_type'])
+ON_MESSAGE_SECONDS = Histogram('control_server_on_message_seconds', 'Time spent in the on_message callback.', ['event_type'])
+EVENT_SECONDS = Histogram('control_server_event_seconds', 'Time to process a sensor event.', ['event_type'])
+DB_SECONDS = Histogram('control_server_db_seconds', 'Duration of the database helpers.', ['operation'])
+SENSOR_LAST_SEEN = Gauge('sensor_last_seen_timestamp_seconds', 'Unix time of the last message of a sensor.', ['sensor_id'])
+WEIGHT_BUFFER = Gauge('weight_buffer_readings', 'Readings pending, flushed, dropped or failed in the weight buffer.', ['state'])
+DEADBAND_READINGS = Gauge('deadband_readings', 'Readings stored or suppressed by the deadband filter.', ['state'])
+DISPATCHER_QUEUE_DEPTH = Gauge('dispatcher_queue_depth', 'Queued events per dispatcher worker.', ['worker'])
+DISPATCHER_EVENTS = Gauge('dispatcher_events', 'Events processed, dropped or failed by the dispatcher.', ['state'])
+SENSORS = Gauge('sensors', 'Sensors known to the registry and sensors initialized by this process.', ['state'])
+CONFIG_CACHE = Gauge('sensor_config_cache', 'Hits, misses and size of the sensor configuration cache.', ['state'])
+BATCHES = Counter('weight_batches', 'Weight batches received, by sequence state.', ['state'])
+BATCH_READINGS = Counter('weight_batch_readings', 'Readings received in weight batches.')
+SENSOR_STATES = Gauge('sensor_states', 'Sensors per state of the sensor state machine.', ['state'])
+SPOOL = Gauge('ingest_spool', 'Readings and bytes waiting in the ingest spool, readings spooled, replayed and evicted.', ['state'])
+SENSOR_LIVENESS = Gauge('sensor_liveness', 'Sensors online and offline according to the liveness watchdog.', ['state'])
+SLOW_EVENTS = Gauge('control_server_slow_events', 'Sensor events slower than the slow-event threshold.')
+NOTIFICATIONS = Gauge('notifications', 'Notifications sent, failed, coalesced, dropped or queued.', ['state'])
 
-def add_weight(sensor_id, weight):
+# Statements of the hot paths, built once so their compiled form is reused from the statement cache
+INSERT_WEIGHTS = insert(Weights).on_conflict_do_nothing()
+INSERT_ALARM = Alarms.__table__.insert()
+INSERT_UPPER_THRESHOLD = insert(UpperThreshold).on_conflict_do_nothing()
+INSERT_THRESHOLD_SENSITIVITY = insert(ThresholdSensitivity).on_conflict_do_nothing()
+SELECT_SENSOR_IDS = select(ThresholdSensitivity.sensor_id)
+SELECT_UPPER_THRESHOLD = select(UpperThreshold.value).where(UpperThreshold.sensor_id == bindparam('sensor_id'))
+SELECT_THRESHOLD_SENSITIVITY = select(ThresholdSensitivity.value).where(ThresholdSensitivity.sensor_id == bindparam('sensor_id'))
+SELECT_EMAIL_ADDRESSES = select(EmailNotification.email_address).where(EmailNotification.sensor_id == bindparam('sensor_id'))
+INSERT_STATUS_EVENTS = SensorStatusEvents.__table__.insert()
+
+SensorConfig = namedtuple('SensorConfig', ['threshold_sensitivity', 'upper_threshold', 'email_addresses'])
+
+
+class WeightBuffer:
     """
-    Adds a new weight entry to the database.
+    Write-behind buffer for weight readings.
 
-    Args:
-        sensor_id (int): The ID of the sensor.
-        weight (int): The weight value to be added.
+    Readings are collected in memory and written to the `weights` hypertable
+    with a single multi-row insert as soon as `batch_size` readings are
+    pending or `flush_interval` seconds have passed. The buffer holds at most
+    `max_pending` readings; producers block for up to `put_timeout` seconds
+    when it is full, which throttles the MQTT network loop instead of growing
+    memory without limit. Readings that still do not fit are dropped, or
+    appended to the `spool` if there is one.
 
-    Exceptions:
-        Rolls back the session if an exception occurs during the commit.
+    Batches the database rejects are appended to the spool as well and
+    replayed in bulk, oldest first, once inserts succeed again. Fresh
+    readings take precedence: the replay pauses whenever a full batch is
+    pending. A failed replay is retried after `replay_retry` seconds.
 
-    Closes the session after the operation is complete.
+    Readings that are pending or currently being written can be inspected
+    with `pending_readings`, so threshold checks see them before they reach
+    the database.
     """
-    try:
-        new_weight = Weights(timestamp=datetime.now(), sensor_id=sensor_id, value=weight)
-        db.session.add(new_weight)
-        db.session.commit()
-        logger.info(f"Added weight: {weight}")
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"Error adding weight: {e}")
-        
+    replay_retry = 5.0
+
+    def __init__(self, engine, batch_size=500, flush_interval=1.0, max_pending=10000, put_timeout=1.0,
+                 spool=None, replay_batch_size=5000):
+        """
+        Initializes the buffer and starts the background flush thread.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): The engine used for bulk inserts.
+            batch_size (int): Number of pending readings that triggers a flush.
+            flush_interval (float): Maximum seconds between two flushes.
+            max_pending (int): Maximum number of buffered readings.
+            put_timeout (float): Seconds `add` waits for space before dropping a reading.
+            spool (Spool, optional): Takes the readings the database could not take.
+            replay_batch_size (int): Number of spooled readings replayed with one insert.
+        """
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+        self.spool = spool
+        self.replay_batch_size = replay_batch_size
+        self._replay_after = 0.0
+
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._pending = {}
+        self._pending_count = 0
+        self._in_flight = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="weight-buffer", daemon=True)
+        self._thread.start()
+
+    def add(self, sensor_id, weight, timestamp=None):
+        """
+        Adds a reading to the buffer.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+            weight (float): The weight value.
+            timestamp (datetime, optional): The time of the reading. Defaults to now.
+
+        Returns:
+            bool: True if the reading was buffered, False if it was dropped.
+        """
+        if timestamp is None:
+            timestamp = datetime.now()
+        full = False
+        with self._condition:
+            deadline = time.monotonic() + self.put_timeout
+            while self._pending_count >= self.max_pending and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    full = True
+                    break
+                self._condition.notify_all()
+                self._condition.wait(remaining)
+            if self._closed:
+                self.dropped += 1
+                logger.warning(f"Weight buffer closed, dropping reading of sensor_id {sensor_id}.")
+                return False
+            if not full:
+                self._pending.setdefault(sensor_id, []).append((timestamp, weight))
+                self._pending_count += 1
+                if self._pending_count >= self.batch_size:
+                    self._condition.notify_all()
+                return True
+        # Spooled outside the lock, so the other producers do not wait for the disk
+        if self.spool is not None:
+            try:
+                self.spool.append([(sensor_id, timestamp, weight)], fsync=False)
+                return True
+            except (OSError, struct.error) as e:
+                logger.error(f"Error spooling reading of sensor_id {sensor_id}: {e}")
+        self.dropped += 1
+        logger.warning(f"Weight buffer full, dropping reading of sensor_id {sensor_id}.")
+        return False
+
+    def pending_readings(self, sensor_id):
+        """
+        Returns the readings of a sensor that have not been committed yet.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+
+        Returns:
+            list: A list of (timestamp, weight) tuples.
+        """
+        with self._condition:
+            return self._in_flight.get(sensor_id, []) + self._pending.get(sensor_id, [])
+
+    def flush(self):
+        """
+        Writes all pending readings to the database immediately.
+        """
+        with self._condition:
+            batch = self._take_batch()
+        self._write(batch)
+
+    def alive(self):
+        return self._thread.is_alive()
+
+    def close(self):
+        """
+        Stops the flush thread after writing all pending readings.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _take_batch(self):
+        batch = self._pending
+        self._pending = {}
+        self._pending_count = 0
+        self._in_flight = batch
+        self._condition.notify_all()
+        return batch
+
+    def _write(self, batch):
+        """
+        Inserts a batch, or spools it if the insert fails.
+
+        Returns:
+            bool: True if the database took the batch.
+        """
+        rows = [
+            {'timestamp': timestamp, 'sensor_id': sensor_id, 'value': weight}
+            for sensor_id, readings in batch.items()
+            for timestamp, weight in readings
+        ]
+        try:
+            if rows:
+                self._insert(rows)
+                self.flushed += len(rows)
+                logger.debug(f"Flushed {len(rows)} weights.")
+            return True
+        except Exception as e:
+            if self.spool is None:
+                self.failed += len(rows)
+                logger.error(f"Error flushing {len(rows)} weights: {e}")
+                return False
+            try:
+                self.spool.append([(row['sensor_id'], row['timestamp'], row['value']) for row in rows])
+                logger.warning(f"Error flushing {len(rows)} weights, spooled them: {e}")
+            except (OSError, struct.error) as spool_error:
+                self.failed += len(rows)
+                logger.error(f"Error flushing {len(rows)} weights: {e}, spooling failed: {spool_error}")
+            return False
+        finally:
+            with self._condition:
+                if self._in_flight is batch:
+                    self._in_flight = {}
+
+    def _insert(self, rows):
+        with DB_SECONDS.labels('flush_weights').time(), self.engine.begin() as connection:
+            connection.execute(INSERT_WEIGHTS, rows)
+
+    def _replay(self):
+        """
+        Replays spooled readings until the spool is empty or fresh readings are waiting.
+        """
+        def write(readings):
+            self._insert([
+                {'timestamp': timestamp, 'sensor_id': sensor_id, 'value': weight}
+                for sensor_id, timestamp, weight in readings
+            ])
+
+        while self.spool.depth and time.monotonic() >= self._replay_after:
+            with self._condition:
+                if self._closed or self._pending_count >= self.batch_size:
+                    return
+            try:
+                replayed = self.spool.replay(write, self.replay_batch_size)
+            except Exception as e:
+                self._replay_after = time.monotonic() + self.replay_retry
+                logger.warning(f"Error replaying spooled weights, {self.spool.depth} remain: {e}")
+                return
+            if replayed:
+                logger.info(f"Replayed {replayed} spooled weights, {self.spool.depth} remain.")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.flush_interval
+                while self._pending_count < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                closed = self._closed
+                batch = self._take_batch()
+            if self._write(batch) and self.spool is not None and not closed:
+                self._replay()
+            if closed:
+                return
+
+
+@timed(DB_SECONDS, 'add_alarm')
 def add_alarm(sensor_id, weight):
     """
     Adds a new alarm entry to the database.
@@ -42,167 +301,385 @@ def add_alarm(sensor_id, weight):
         weight (int): The weight value that triggered the alarm.
 
     Exceptions:
-        Rolls back the session if an exception occurs during the commit.
-
-    Closes the session after the operation is complete.
+        The transaction is rolled back if an exception occurs.
     """
     try:
-        new_alarm = Alarms(timestamp=datetime.now(), sensor_id=sensor_id, value=weight)
-        db.session.add(new_alarm)
-        db.session.commit()
+        with db.engine.begin() as connection:
+            connection.execute(INSERT_ALARM, {'timestamp': datetime.now(), 'sensor_id': sensor_id, 'value': weight})
         logger.info(f"Added alarm: {weight}")
     except Exception as e:
-        db.session.rollback()
         logger.error(f"Error adding alarm: {e}")
         
-def get_average_weight(sensor_id):
-    """
-    Calculates the average weight value of the last minute for a given sensor.
-
-    Args:
-        sensor_id (int): The ID of the sensor.
-
-    Returns:
-        float: The average weight value of the last minute.
-
-    Exceptions:
-        Rolls back the session if an exception occurs during the query.
-
-    Closes the session after the operation is complete.
-    """
-    try:
-        one_minute_ago = datetime.now() - timedelta(minutes=1)
-        avg_weight = db.session.query(func.avg(Weights.value)).filter(
-            Weights.sensor_id == sensor_id,
-            Weights.timestamp >= one_minute_ago
-        ).scalar()
-        if avg_weight is not None:
-            logger.info(f"Average weight for sensor_id {sensor_id} in the last minute: {avg_weight}")
-            return avg_weight
-        else:
-            logger.info(f"No weight data found for sensor_id {sensor_id} in the last minute.")
-            raise ValueError(f"No weight data found for sensor_id {sensor_id} in the last minute.")
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"Error calculating average weight: {e}")
-        raise
-            
-def get_upper_threshold(sensor_id):
+@timed(DB_SECONDS, 'get_upper_threshold')
+def get_upper_threshold(sensor_id, connection=None):
     """
     Retrieves the upper threshold value for a given sensor.
 
     Args:
         sensor_id (int): The ID of the sensor.
+        connection (sqlalchemy.engine.Connection, optional): The connection to use, a pooled one if omitted.
 
     Returns:
         float: The upper threshold value for the sensor.
-
-    Exceptions:
-        Rolls back the session if an exception occurs during the query.
-
-    Closes the session after the operation is complete.
     """
     try:
-        upper_threshold = db.session.query(UpperThreshold.value).filter(
-            UpperThreshold.sensor_id == sensor_id
-        ).scalar()
+        upper_threshold = _scalar(SELECT_UPPER_THRESHOLD, sensor_id, connection)
         if upper_threshold is not None:
-            logger.info(f"Upper threshold for sensor_id {sensor_id}: {upper_threshold}")
+            logger.debug("Upper threshold for sensor_id %s: %s", sensor_id, upper_threshold)
             return upper_threshold
         else:
             logger.info(f"No upper threshold found for sensor_id {sensor_id}.")
             raise ValueError(f"No upper threshold found for sensor_id {sensor_id}.")
+    except ValueError:
+        raise
     except Exception as e:
-        db.session.rollback()
         logger.error(f"Error retrieving upper threshold: {e}")
         raise
         
-def get_email_adresses(sensor_id):
+@timed(DB_SECONDS, 'get_email_adresses')
+def get_email_adresses(sensor_id, connection=None):
     """
     Retrieves the email addresses associated with a given sensor.
 
     Args:
         sensor_id (int): The ID of the sensor.
+        connection (sqlalchemy.engine.Connection, optional): The connection to use, a pooled one if omitted.
 
     Returns:
         list: A list of email addresses associated with the sensor.
-
-    Exceptions:
-        Rolls back the session if an exception occurs during the query.
-
-    Closes the session after the operation is complete.
     """
     try:
-        email_addresses = db.session.query(EmailNotification.email_address).filter(
-            EmailNotification.sensor_id == sensor_id
-        ).all()
-        email_list = [email[0] for email in email_addresses]
+        if connection is None:
+            with db.engine.connect() as connection:
+                return get_email_adresses(sensor_id, connection)
+        email_list = connection.execute(SELECT_EMAIL_ADDRESSES, {'sensor_id': sensor_id}).scalars().all()
         if not email_list:
             logger.info(f"No email addresses found for sensor_id {sensor_id}.")
             return []
         return email_list
     except Exception as e:
-        db.session.rollback()
         logger.error(f"Error retrieving email addresses: {e}")
         raise
         
-def get_threshold_sensitivity(sensor_id):
+@timed(DB_SECONDS, 'get_threshold_sensitivity')
+def get_threshold_sensitivity(sensor_id, connection=None):
     """
     Retrieves the threshold sensitivity value for a given sensor.
 
     Args:
         sensor_id (int): The ID of the sensor.
+        connection (sqlalchemy.engine.Connection, optional): The connection to use, a pooled one if omitted.
 
     Returns:
         float: The threshold sensitivity value for the sensor.
-
-    Exceptions:
-        Rolls back the session if an exception occurs during the query.
-
-    Closes the session after the operation is complete.
     """
     try:
-        threshold_sensitivity = db.session.query(ThresholdSensitivity.value).filter(
-            ThresholdSensitivity.sensor_id == sensor_id
-        ).scalar()
+        threshold_sensitivity = _scalar(SELECT_THRESHOLD_SENSITIVITY, sensor_id, connection)
         if threshold_sensitivity is not None:
-            logger.info(f"Threshold sensitivity for sensor_id {sensor_id}: {threshold_sensitivity}")
+            logger.debug("Threshold sensitivity for sensor_id %s: %s", sensor_id, threshold_sensitivity)
             return threshold_sensitivity
         else:
             logger.info(f"No threshold sensitivity found for sensor_id {sensor_id}.")
             raise ValueError(f"No threshold sensitivity found for sensor_id {sensor_id}.")
+    except ValueError:
+        raise
     except Exception as e:
-        db.session.rollback()
         logger.error(f"Error retrieving threshold sensitivity: {e}")
         raise
 
+def _scalar(statement, sensor_id, connection=None):
+    if connection is None:
+        with db.engine.connect() as connection:
+            return connection.execute(statement, {'sensor_id': sensor_id}).scalar()
+    return connection.execute(statement, {'sensor_id': sensor_id}).scalar()
+
+@timed(DB_SECONDS, 'initialize_sensor')
 def initialize_sensor(sensor_id):
     """
     Initializes a sensor by setting default values for the sensor.
 
+    Idempotent: rows that already exist, e.g. because another control server
+    initialized the sensor concurrently, are left unchanged.
+
     Args:
         sensor_id (int): The ID of the sensor.
 
-    Exceptions:
-        Rolls back the session if an exception occurs during the commit.
+    Returns:
+        bool: True if the sensor was not initialized before.
+    """
+    with db.engine.begin() as connection:
+        connection.execute(INSERT_UPPER_THRESHOLD, {'sensor_id': sensor_id, 'value': 50})
+        result = connection.execute(INSERT_THRESHOLD_SENSITIVITY, {'sensor_id': sensor_id, 'value': 50})
+    created = result.rowcount > 0
+    if created:
+        logger.info(f"Sensor {sensor_id} initialized.")
+    return created
 
-    Closes the session after the operation is complete.
+def load_sensor_config(sensor_id):
     """
+    Loads the configuration of a sensor from the database.
+
+    All three queries run on one pooled connection.
+
+    Args:
+        sensor_id (int): The ID of the sensor.
+
+    Returns:
+        SensorConfig: The threshold sensitivity, upper threshold and e-mail addresses of the sensor.
+
+    Raises:
+        ValueError: If the sensor has no threshold sensitivity, i.e. it is not initialized.
+    """
+    with db.engine.connect() as connection:
+        threshold_sensitivity = get_threshold_sensitivity(sensor_id, connection)
+        try:
+            upper_threshold = get_upper_threshold(sensor_id, connection)
+        except ValueError:
+            upper_threshold = None
+        email_addresses = get_email_adresses(sensor_id, connection)
+    return SensorConfig(threshold_sensitivity, upper_threshold, email_addresses)
+
+
+class SensorConfigCache:
+    """
+    Per-sensor cache of the rows in `threshold_sensetivety`, `upper_threshold`
+    and `email_notification`.
+
+    Entries expire after `ttl` seconds and can be dropped explicitly with
+    `invalidate`, which is triggered by the web app whenever it changes the
+    configuration of a sensor. Loads that race with an invalidation are not
+    stored, so a stale configuration cannot outlive the invalidation.
+    """
+
+    def __init__(self, ttl=300, loader=load_sensor_config):
+        """
+        Initializes an empty cache.
+
+        Args:
+            ttl (float): Seconds an entry stays valid.
+            loader (callable): Function loading the `SensorConfig` of a sensor id.
+        """
+        self.ttl = ttl
+        self.loader = loader
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, sensor_id):
+        """
+        Returns the configuration of a sensor, loading it on a miss.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+
+        Returns:
+            SensorConfig: The configuration of the sensor.
+
+        Raises:
+            ValueError: If the sensor is not initialized.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(sensor_id)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        sensor_config = self.loader(sensor_id)
+        with self._lock:
+            if generation == self._generation:
+                self._entries[sensor_id] = (now + self.ttl, sensor_config)
+        return sensor_config
+
+    def invalidate(self, sensor_id=None):
+        """
+        Drops the cached configuration of a sensor.
+
+        Args:
+            sensor_id (int, optional): The ID of the sensor. Drops all entries if omitted.
+        """
+        with self._lock:
+            self._generation += 1
+            if sensor_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(sensor_id, None)
+        logger.info(f"Sensor configuration cache invalidated for sensor_id {sensor_id}.")
+
+    def stats(self):
+        """
+        Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: The number of hits, misses and cached sensors.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+config_cache = SensorConfigCache()
+slow_events = SlowEventLog()
+
+
+class SensorRegistry:
+    """
+    The IDs of all initialized sensors.
+
+    The IDs are loaded once at startup, so a known sensor costs a set lookup
+    per message. A new sensor is initialized with one idempotent insert the
+    first time it is seen.
+    """
+
+    def __init__(self, initializer=initialize_sensor):
+        """
+        Initializes an empty registry.
+
+        Args:
+            initializer (callable): Function initializing a sensor id in the database.
+        """
+        self.initializer = initializer
+        self.created = 0
+        self._known = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._known)
+
+    def load(self, engine):
+        """
+        Loads the IDs of the initialized sensors.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): The engine used to load the IDs.
+
+        Returns:
+            int: The number of known sensors.
+        """
+        with engine.connect() as connection:
+            sensor_ids = connection.execute(SELECT_SENSOR_IDS).scalars().all()
+        with self._lock:
+            self._known.update(sensor_ids)
+        logger.info(f"Loaded {len(sensor_ids)} known sensors.")
+        return len(sensor_ids)
+
+    def ensure(self, sensor_id):
+        """
+        Initializes a sensor unless it is known.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+
+        Returns:
+            bool: True if the sensor was initialized by this call.
+        """
+        if sensor_id in self._known:
+            return False
+        created = self.initializer(sensor_id)
+        with self._lock:
+            self._known.add(sensor_id)
+            if created:
+                self.created += 1
+        return created
+
+    def ids(self):
+        with self._lock:
+            return list(self._known)
+
+    def forget(self, sensor_id):
+        """
+        Removes a sensor, so it is initialized again on its next message.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+        """
+        with self._lock:
+            self._known.discard(sensor_id)
+
+def send_emails(notifier, sensor_id, subject, body, email_addresses):
+    """
+    Queues an e-mail to all addresses of a sensor without waiting for the delivery.
+
+    Args:
+        notifier (NotificationDispatcher): The dispatcher sending the e-mails in the background.
+        sensor_id (int): The ID of the sensor.
+        subject (str): The subject of the e-mail.
+        body (str): The body of the e-mail.
+        email_addresses (list): The recipients.
+    """
+    logger.info(f"Queueing email to {email_addresses} with subject: {subject} and body: {body}")
+    notifier.notify(sensor_id, subject, body, email_addresses)
+
+def load_offline_sensors(engine):
+    """
+    Returns the sensors whose last recorded status is offline.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine used to load the status events.
+
+    Returns:
+        list: The IDs of the offline sensors.
+    """
+    query = get_storage(engine).latest(
+        [SensorStatusEvents.sensor_id], SensorStatusEvents.timestamp, SensorStatusEvents.status
+    )
+    with engine.connect() as connection:
+        return [row.sensor_id for row in connection.execute(query) if row.status == OFFLINE]
+
+def handle_status_events(engine, publisher, notifier, events, notify=True):
+    """
+    Records, publishes and notifies the offline and online transitions of the liveness watchdog.
+
+    All events of a tick are stored with one insert and their recipients are
+    loaded with one query. The status is published retained on
+    `mailbox/<sensor_id>/status`, so subscribers see it when they connect.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine used to store the events.
+        publisher (MqttPublisher): Publishes the status.
+        notifier (NotificationDispatcher): Sends the e-mail notifications.
+        events (list): The `watchdog.StatusEvent` tuples.
+        notify (bool): Whether the transitions are sent by e-mail.
+    """
+    for event in events:
+        log = logger.warning if event.status == OFFLINE else logger.info
+        log(f"Sensor {event.sensor_id} is {event.status}, last seen {event.last_seen}.")
+    sensor_ids = [event.sensor_id for event in events]
+    recipients = {}
     try:
-        new_upper_threshold = UpperThreshold(sensor_id=sensor_id, value=50)
-        new_threshold_sensitivity = ThresholdSensitivity(sensor_id=sensor_id, value=50)
-        db.session.add(new_upper_threshold)
-        db.session.add(new_threshold_sensitivity)
-        db.session.commit()
-        logger.info(f"Sensor {sensor_id} initialized.")
+        with DB_SECONDS.labels('status_events').time(), engine.begin() as connection:
+            connection.execute(INSERT_STATUS_EVENTS, [
+                {'timestamp': event.timestamp, 'sensor_id': event.sensor_id, 'status': event.status, 'last_seen': event.last_seen}
+                for event in events
+            ])
+            if notify:
+                rows = connection.execute(
+                    select(EmailNotification.sensor_id, EmailNotification.email_address)
+                    .where(EmailNotification.sensor_id.in_(sensor_ids))
+                )
+                for sensor_id, email_address in rows:
+                    recipients.setdefault(sensor_id, []).append(email_address)
     except Exception as e:
-        db.session.rollback()
-        logger.error(f"Error initializing sensor: {e}")
+        logger.error(f"Error recording {len(events)} sensor status events: {e}")
 
-def send_emails(email_server, subject, body, email_addresses):
-    logger.info(f"Sending email to {email_addresses} with subject: {subject} and body: {body}")
-    for email_address in email_addresses:
-        email_server.send_email(email_address, subject, body)
+    for event in events:
+        payload = json.dumps({
+            'status': event.status,
+            'timestamp': event.timestamp.isoformat(),
+            'last_seen': event.last_seen.isoformat() if event.last_seen else None,
+        })
+        try:
+            publisher.publish(f"mailbox/{event.sensor_id}/status", payload, qos=1, retain=True, wait=False)
+        except Exception as e:
+            logger.error(f"Error publishing the status of sensor_id {event.sensor_id}: {e}")
+        if event.sensor_id in recipients:
+            if event.status == OFFLINE:
+                subject, body = "SENSOR OFFLINE", f"No data received since {event.last_seen:%Y-%m-%d %H:%M:%S}"
+            else:
+                subject, body = "SENSOR ONLINE", "The sensor is sending data again"
+            send_emails(notifier, event.sensor_id, subject, body, recipients[event.sensor_id])
 
 def on_connect(mqtt_client, userdata, flags, rc):
     """
@@ -215,9 +692,19 @@ def on_connect(mqtt_client, userdata, flags, rc):
         rc (int): The connection result.
     """
     if rc == 0:
-        logger.info("Connected successfully")
+        logger.info(f"Connected successfully (session present: {bool(flags.get('session present'))})")
+        mqtt_connected.set()
+        watchdog = userdata.get('watchdog')
+        if watchdog is not None:
+            watchdog.resume()
+        # Alarms are QoS 1, so with a persistent session the broker queues them while the
+        # control server restarts; readings are QoS 0 and outlived by the next one.
+        # Every instance subscribes to all sensors and skips the ones of other partitions
         mqtt_client.subscribe("mailbox/+/weight", qos=0)
-        mqtt_client.subscribe("mailbox/+/alarm", qos=0)
+        mqtt_client.subscribe("mailbox/+/weights", qos=0)
+        mqtt_client.subscribe("mailbox/+/alarm", qos=1)
+        mqtt_client.subscribe("mailbox/+/disarm_alarm", qos=1)
+        mqtt_client.subscribe("mailbox/+/config", qos=1)
     else:
         logger.error(f"Connect failed with code {rc}")
 
@@ -230,42 +717,113 @@ def on_disconnect(mqtt_client, userdata, rc):
         userdata (any): The private user data as set in Client() or userdata_set().
         rc (int): The disconnection result.
     """
+    mqtt_connected.clear()
+    # Without a connection every sensor would look offline
+    watchdog = userdata.get('watchdog') if userdata else None
+    if watchdog is not None:
+        watchdog.suspend()
     logger.info("Disconnected with result code " + str(rc))
 
-def handle_weight_event(mqtt_client, userdata, sensor_id, payload):
+def process_weights(mqtt_client, userdata, sensor_id, readings):
     """
-    Handles the weight event.
+    Stores consecutive weight readings of a sensor and runs the package detection on them.
 
     Args:
         mqtt_client (mqtt.Client): The client instance for this callback.
         userdata (any): The private user data as set in Client() or userdata_set().
-        sensor_id (str): The ID of the sensor.
-        payload (str): The payload of the message.
+        sensor_id (int): The ID of the sensor.
+        readings (list): (timestamp, weight) tuples, oldest first.
     """
-    email_server = userdata['email_server']
+    notifier = userdata['notifier']
+    weight_buffer = userdata['weight_buffer']
+    baseline = userdata['baseline']
+    deadband = userdata['deadband']
+    states = userdata['states']
     try:
-        weight = float(payload)
-        add_weight(sensor_id=sensor_id, weight=weight)
-        average_weight = get_average_weight(sensor_id)
-        threshold_sensitivity =  get_threshold_sensitivity(sensor_id)
-        upper_threshold = average_weight + threshold_sensitivity
-        if upper_threshold > weight:
-            logger.info(f"Weight does not meet upper threshold")
+        with slow_events.stage('db_write'):
+            for timestamp, weight in readings:
+                if deadband.update(sensor_id, weight, timestamp):
+                    weight_buffer.add(sensor_id=sensor_id, weight=weight, timestamp=timestamp)
+        with slow_events.stage('baseline'):
+            baselines = []
+            for timestamp, weight in readings:
+                states.weight(sensor_id, weight)
+                baseline.add(sensor_id, weight, timestamp)
+                baselines.append(baseline.baseline(sensor_id))
+        with slow_events.stage('config_lookup'):
+            userdata['sensors'].ensure(sensor_id)
+            sensor_config = config_cache.get(sensor_id)
+        threshold_sensitivity = sensor_config.threshold_sensitivity
+        timestamps = [timestamp for timestamp, _ in readings]
+        weights = [weight for _, weight in readings]
+        with slow_events.stage('detection'):
+            detections = userdata['detection'].process(sensor_id, timestamps, weights, baselines, threshold_sensitivity)
+        if not detections:
+            logger.debug("Weight does not meet upper threshold")
             return
-        email_adresses = get_email_adresses(sensor_id)
-        package_weight = weight - average_weight
-        send_emails(email_server, "NEW PACKAGE", f"New package detected with weight {package_weight}", email_adresses)
-        lower_threshold = weight - threshold_sensitivity
-        mqtt_client.publish(f"mailbox/{sensor_id}/arm_alarm", lower_threshold)
-    except UniqueViolation as e:
-        initialize_sensor(sensor_id)
-        logger.error(f"Error processing weight event: {e} - Sensor initialized.")
+        email_adresses = sensor_config.email_addresses
+        for detection in detections:
+            lower_threshold = detection.weight - threshold_sensitivity
+            if not states.package_detected(sensor_id, lower_threshold):
+                continue
+            package_weight = detection.weight - detection.baseline
+            with slow_events.stage('email'):
+                send_emails(notifier, sensor_id, "NEW PACKAGE", f"New package detected with weight {package_weight}", email_adresses)
+            with slow_events.stage('publish'):
+                userdata['publisher'].publish(f"mailbox/{sensor_id}/arm_alarm", lower_threshold, wait=False)
+            states.armed(sensor_id)
     except ValueError as e:
-        initialize_sensor(sensor_id)
-        logger.error(f"Error processing weight event: {e} - Sensor initialized.")
+        # The configuration was deleted after the sensor was registered
+        userdata['sensors'].forget(sensor_id)
+        logger.warning(f"Error processing weight event: {e} - Sensor is initialized again on its next message.")
     except Exception as e:
         logger.error(f"Error processing weight event: {e}")
 
+def handle_weight_event(mqtt_client, userdata, sensor_id, payload):
+    """
+    Handles the legacy weight event with a single plain-float reading.
+
+    Args:
+        mqtt_client (mqtt.Client): The client instance for this callback.
+        userdata (any): The private user data as set in Client() or userdata_set().
+        sensor_id (int): The ID of the sensor.
+        payload (str): The payload of the message.
+    """
+    try:
+        with slow_events.stage('parse'):
+            readings = decode_legacy(payload)
+    except PayloadError as e:
+        logger.error(f"Error processing weight event: {e}")
+        return
+    process_weights(mqtt_client, userdata, sensor_id, readings)
+
+def handle_weights_event(mqtt_client, userdata, sensor_id, payload):
+    """
+    Handles a batch of timestamped weight readings in the compact binary format.
+
+    Args:
+        mqtt_client (mqtt.Client): The client instance for this callback.
+        userdata (any): The private user data as set in Client() or userdata_set().
+        sensor_id (int): The ID of the sensor.
+        payload (bytes): The payload of the message.
+    """
+    try:
+        with slow_events.stage('parse'):
+            sequence, base_time, readings = decode_batch(payload)
+    except PayloadError as e:
+        BATCHES.labels('invalid').inc()
+        logger.error(f"Error processing weights event for sensor_id {sensor_id}: {e}")
+        return
+    state = userdata['sequences'].check(sensor_id, sequence, base_time)
+    BATCHES.labels(state).inc()
+    if state == 'duplicate':
+        logger.debug("Skipping duplicate batch %s of sensor_id %s", sequence, sensor_id)
+        return
+    if state == 'gap':
+        logger.warning(f"Missing batches before sequence {sequence} of sensor_id {sensor_id}")
+    BATCH_READINGS.inc(len(readings))
+    process_weights(mqtt_client, userdata, sensor_id, readings)
+
 def handle_alarm_event(mqtt_client, userdata, sensor_id, payload):
     """
     Handles the alarm event.
@@ -273,54 +831,446 @@ def handle_alarm_event(mqtt_client, userdata, sensor_id, payload):
     Args:
         mqtt_client (mqtt.Client): The client instance for this callback.
         userdata (any): The private user data as set in Client() or userdata_set().
-        sensor_id (str): The ID of the sensor.
+        sensor_id (int): The ID of the sensor.
         payload (str): The payload of the message.
     """
-    email_server = userdata['email_server']
+    notifier = userdata['notifier']
     try:
-        weight = float(payload)
-        add_alarm(sensor_id=sensor_id, weight=weight)
-        email_adresses = get_email_adresses(sensor_id)
-        send_emails(email_server, "ALARM", f"Alarm detected with value {weight}", email_adresses)
+        with slow_events.stage('parse'):
+            weight = float(payload)
+        with slow_events.stage('db_write'):
+            add_alarm(sensor_id=sensor_id, weight=weight)
+        with slow_events.stage('config_lookup'):
+            userdata['sensors'].ensure(sensor_id)
+        if not userdata['states'].alarm(sensor_id):
+            logger.debug("Alarm of sensor_id %s already notified", sensor_id)
+            return
+        with slow_events.stage('config_lookup'):
+            email_adresses = config_cache.get(sensor_id).email_addresses
+        with slow_events.stage('email'):
+            send_emails(notifier, sensor_id, "ALARM", f"Alarm detected with value {weight}", email_adresses)
     except Exception as e:
         logger.error(f"Error processing alarm event: {e}")
 
+def handle_disarm_event(mqtt_client, userdata, sensor_id, payload):
+    """
+    Handles the disarming of an alarm from the web interface.
+
+    Args:
+        mqtt_client (mqtt.Client): The client instance for this callback.
+        userdata (any): The private user data as set in Client() or userdata_set().
+        sensor_id (int): The ID of the sensor.
+        payload (str): The payload of the message.
+    """
+    userdata['states'].disarm(sensor_id)
+
+def handle_event(mqtt_client, userdata, sensor_id, event):
+    """
+    Handles a sensor event on the worker thread responsible for the sensor.
+
+    Events slower than the threshold of the slow-event log, including the
+    time they waited in the dispatcher, are recorded with their stage timings.
+
+    Args:
+        mqtt_client (mqtt.Client): The client instance for this callback.
+        userdata (any): The private user data as set in Client() or userdata_set().
+        sensor_id (int): The ID of the sensor.
+        event (tuple): The event type, the payload of the message and the
+            `time.perf_counter()` value when it was received.
+    """
+    event_type, payload, received = event
+    try:
+        with EVENT_SECONDS.labels(event_type).time(), \
+                slow_events.trace(event_type, sensor_id, time.perf_counter() - received):
+            if event_type == "weight":
+                handle_weight_event(mqtt_client, userdata, sensor_id, payload)
+            elif event_type == "weights":
+                handle_weights_event(mqtt_client, userdata, sensor_id, payload)
+            elif event_type == "alarm":
+                handle_alarm_event(mqtt_client, userdata, sensor_id, payload)
+            elif event_type == "disarm_alarm":
+                handle_disarm_event(mqtt_client, userdata, sensor_id, payload)
+    finally:
+        # The handlers use pooled connections; never keep an ORM session open across events
+        db.session.remove()
+
+def in_partition(partition, sensor_id):
+    """
+    Returns whether a sensor is handled by this control server.
+
+    All events of a sensor go to the same instance, which keeps their order
+    and the per-sensor state (baseline, deadband, state machine, sequence
+    numbers and detector) in a single process.
+
+    Args:
+        partition (tuple): The partition of this instance and the number of partitions, None for a single instance.
+        sensor_id (int): The ID of the sensor.
+    """
+    if partition is None:
+        return True
+    index, count = partition
+    return sensor_id % count == index
+
 def on_message(mqtt_client, userdata, msg):
     """
     Callback function for when a PUBLISH message is received from the server.
 
+    Sensor events are handed to the sharded dispatcher, so the network loop
+    only parses the topic. Without a dispatcher they are handled inline.
+
     Args:
         mqtt_client (mqtt.Client): The client instance for this callback.
         userdata (any): The private user data as set in Client() or userdata_set().
         msg (mqtt.MQTTMessage): The message instance containing topic and payload.
     """
-    logger.info(f"Received message: {msg.payload} on topic: {msg.topic}")
+    received = time.perf_counter()
+    logger.debug("Received message: %s on topic: %s", msg.payload, msg.topic)
     
     splitted_topic = msg.topic.split('/')
     event_type = splitted_topic[2]
-    sensor_id = splitted_topic[1]
+    MESSAGES.labels(event_type).inc()
+    with ON_MESSAGE_SECONDS.labels(event_type).time():
+        try:
+            sensor_id = int(splitted_topic[1])
+        except ValueError:
+            sensor_id = None
+        if sensor_id is None or not 0 <= sensor_id <= MAX_SENSOR_ID:
+            logger.warning(f"Invalid sensor id in topic: {msg.topic}")
+            return
 
-    if event_type == "weight":
-        handle_weight_event(mqtt_client, userdata, sensor_id, msg.payload)
-    elif event_type == "alarm":
-        handle_alarm_event(mqtt_client, userdata, sensor_id, msg.payload)
-    else:
-        logger.warning(f"Unknown event type: {event_type}")
+        if event_type in ("weight", "weights", "alarm", "disarm_alarm"):
+            if not in_partition(userdata.get('partition'), sensor_id):
+                return
+            if event_type != "disarm_alarm":
+                SENSOR_LAST_SEEN.labels(sensor_id).set(time.time())
+                watchdog = userdata.get('watchdog')
+                if watchdog is not None:
+                    watchdog.seen(sensor_id)
+            dispatcher = userdata.get('dispatcher')
+            if dispatcher is not None:
+                dispatcher.submit(sensor_id, (event_type, msg.payload, received))
+            else:
+                handle_event(mqtt_client, userdata, sensor_id, (event_type, msg.payload, received))
+        elif event_type == "config":
+            config_cache.invalidate(sensor_id)
+        else:
+            logger.warning(f"Unknown event type: {event_type}")
         
-def control_server_task():
+def create_pipeline(config, client, notifier, publisher):
+    """
+    Creates the processing pipeline of the control server.
+
+    Starts the write-behind buffer for weight readings behind the deadband
+    filter and opens its spool, whose readings are replayed as soon as the
+    database takes inserts again, warm-starts the rolling baselines from the
+    readings already stored in the database, loads the sensor states, starts
+    the liveness watchdog, the scheduler of the daily reports and the sharded
+    dispatcher that processes the events of each sensor in order on worker
+    threads. Must be called within an application context.
+
+    Args:
+        config (Config): The configuration.
+        client (mqtt.Client): The MQTT client the events are received with.
+        notifier (NotificationDispatcher): Sends the e-mail notifications.
+        publisher (MqttPublisher): Publishes the commands to the mailboxes.
+
+    Returns:
+        dict: The user data for the MQTT client holding all pipeline components.
+    """
+    spool = None
+    if config.INGEST_SPOOL_DIR:
+        spool = Spool(
+            config.INGEST_SPOOL_DIR,
+            max_bytes=config.INGEST_SPOOL_MAX_BYTES,
+            segment_bytes=config.INGEST_SPOOL_SEGMENT_BYTES,
+            fsync=config.INGEST_SPOOL_FSYNC
+        )
+
+    weight_buffer = WeightBuffer(
+        db.engine,
+        batch_size=config.INGEST_BATCH_SIZE,
+        flush_interval=config.INGEST_FLUSH_INTERVAL,
+        max_pending=config.INGEST_MAX_PENDING,
+        put_timeout=config.INGEST_PUT_TIMEOUT,
+        spool=spool,
+        replay_batch_size=config.INGEST_REPLAY_BATCH_SIZE
+    )
+    
+    baseline = BaselineTracker(
+        window_seconds=config.BASELINE_WINDOW_SECONDS,
+        statistic=config.BASELINE_STATISTIC,
+        trim_fraction=config.BASELINE_TRIM_FRACTION
+    )
+    baseline.warm_start(db.engine, heartbeat_seconds=config.INGEST_HEARTBEAT_SECONDS)
+
+    detection = DetectionEngine(create_detector(
+        config.DETECTION_ALGORITHM,
+        debounce=config.DETECTION_DEBOUNCE,
+        drift=config.DETECTION_CUSUM_DRIFT,
+        threshold=config.DETECTION_CUSUM_THRESHOLD
+    ), settle_seconds=config.BASELINE_WINDOW_SECONDS)
+
+    sensors = SensorRegistry()
+    sensors.load(db.engine)
+
+    states = SensorStateMachine(db.engine)
+    states.load()
+
+    watchdog = None
+    if config.WATCHDOG_OFFLINE_AFTER > 0:
+        engine = db.engine
+        watchdog = LivenessWatchdog(
+            lambda events: handle_status_events(engine, publisher, notifier, events, config.WATCHDOG_NOTIFY),
+            offline_after=config.WATCHDOG_OFFLINE_AFTER,
+            tick=config.WATCHDOG_TICK,
+            slots=config.WATCHDOG_SLOTS
+        )
+        partition = (config.MQTT_PARTITION, config.MQTT_PARTITIONS)
+        watchdog.load(
+            [sensor_id for sensor_id in sensors.ids() if in_partition(partition, sensor_id)],
+            load_offline_sensors(engine)
+        )
+        watchdog.start()
+
+    reports = None
+    if config.REPORTS_ENABLED:
+        reports = ReportScheduler(db.engine, notifier.email_sender, at=config.REPORTS_AT)
+        reports.start()
+
+    slow_events.configure(config.PROFILING_SLOW_EVENT_THRESHOLD, config.PROFILING_SLOW_EVENT_LOG_SIZE)
+
+    deadband = DeadbandFilter(
+        epsilon=config.INGEST_DEADBAND_EPSILON,
+        heartbeat_seconds=config.INGEST_HEARTBEAT_SECONDS
+    )
+    
+    userdata = {
+        'notifier': notifier,
+        'weight_buffer': weight_buffer,
+        'spool': spool,
+        'baseline': baseline,
+        'deadband': deadband,
+        'detection': detection,
+        'states': states,
+        'sensors': sensors,
+        'watchdog': watchdog,
+        'reports': reports,
+        'publisher': publisher,
+        'sequences': SequenceTracker(),
+        'partition': (config.MQTT_PARTITION, config.MQTT_PARTITIONS)
+    }
+    if config.DISPATCHER_WORKERS > 0:
+        userdata['dispatcher'] = ShardedDispatcher(
+            lambda sensor_id, event: handle_event(client, userdata, sensor_id, event),
+            workers=config.DISPATCHER_WORKERS,
+            max_queue=config.DISPATCHER_MAX_QUEUE,
+            overflow=config.DISPATCHER_OVERFLOW,
+            put_timeout=config.DISPATCHER_PUT_TIMEOUT,
+            context=current_app._get_current_object().app_context
+        )
+    register_pipeline_metrics(userdata)
+    return userdata
+
+def register_pipeline_metrics(userdata):
+    """
+    Exposes the counters and queue depths of the pipeline components as metrics.
+
+    Args:
+        userdata (dict): The user data returned by `create_pipeline`.
+    """
+    weight_buffer = userdata['weight_buffer']
+    WEIGHT_BUFFER.labels('pending').set_function(lambda: weight_buffer._pending_count)
+    for state in ('flushed', 'dropped', 'failed'):
+        WEIGHT_BUFFER.labels(state).set_function(lambda state=state: getattr(weight_buffer, state))
+
+    spool = userdata.get('spool')
+    if spool is not None:
+        SPOOL.labels('readings').set_function(lambda: spool.depth)
+        SPOOL.labels('bytes').set_function(lambda: spool.size)
+        for state in ('spooled', 'replayed', 'evicted'):
+            SPOOL.labels(state).set_function(lambda state=state: getattr(spool, state))
+
+    deadband = userdata['deadband']
+    for state in ('stored', 'suppressed'):
+        DEADBAND_READINGS.labels(state).set_function(lambda state=state: getattr(deadband, state))
+
+    states = userdata['states']
+    for state in STATES:
+        SENSOR_STATES.labels(state).set_function(lambda state=state: states.counts()[state])
+
+    dispatcher = userdata.get('dispatcher')
+    if dispatcher is not None:
+        for worker in range(len(dispatcher.queue_depths())):
+            DISPATCHER_QUEUE_DEPTH.labels(worker).set_function(lambda worker=worker: dispatcher.queue_depths()[worker])
+        for state in ('processed', 'dropped', 'errors'):
+            DISPATCHER_EVENTS.labels(state).set_function(lambda state=state: getattr(dispatcher, state))
+
+    watchdog = userdata.get('watchdog')
+    if watchdog is not None:
+        for state in ('online', 'offline'):
+            SENSOR_LIVENESS.labels(state).set_function(lambda state=state: watchdog.counts()[state])
+
+    sensors = userdata['sensors']
+    SENSORS.labels('known').set_function(lambda: len(sensors))
+    SENSORS.labels('created').set_function(lambda: sensors.created)
+
+    for state in ('hits', 'misses', 'size'):
+        CONFIG_CACHE.labels(state).set_function(lambda state=state: config_cache.stats()[state])
+
+    notifier = userdata['notifier']
+    for state in ('sent', 'failed', 'coalesced', 'dropped', 'queued'):
+        NOTIFICATIONS.labels(state).set_function(lambda state=state: notifier.stats()[state])
+
+    SLOW_EVENTS.set_function(lambda: slow_events.slow)
+
+def shutdown_pipeline(userdata):
+    """
+    Stops the processing pipeline after processing all queued events, flushing
+    the buffered weight readings and sending the queued e-mails. Readings still
+    in the spool are replayed after the next start.
+
+    Args:
+        userdata (dict): The user data returned by `create_pipeline`.
+    """
+    dispatcher = userdata.get('dispatcher')
+    if dispatcher is not None:
+        dispatcher.close()
+        logger.info(f"Dispatcher: {dispatcher.stats()}")
+    userdata['weight_buffer'].close()
+    watchdog = userdata.get('watchdog')
+    if watchdog is not None:
+        watchdog.close()
+    reports = userdata.get('reports')
+    if reports is not None:
+        reports.close()
+    spool = userdata.get('spool')
+    if spool is not None:
+        spool.close()
+        if spool.depth:
+            logger.warning(f"{spool.depth} readings remain in the spool {spool.directory}.")
+    notifier = userdata['notifier']
+    notifier.close()
+    logger.info(f"Notifications: {notifier.stats()}")
+    logger.info(f"Sensor configuration cache: {config_cache.stats()}")
+
+def create_health_server(config, userdata):
+    """
+    Creates the health server of a control server process.
+
+    The process is live while the worker threads of the pipeline run, and
+    ready while it is connected to the broker and the database and is not
+    draining. With an admin token it also serves the profiler and the
+    slow-event log of the process. Must be called within an application context.
+
+    Args:
+        config (Config): The configuration with the health server address.
+        userdata (dict): The user data returned by `create_pipeline`.
+
+    Returns:
+        HealthServer: The server, not yet started.
+    """
+    engine = db.engine
+
+    def database_reachable():
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return True
+
+    liveness = {
+        'weight_buffer': userdata['weight_buffer'].alive,
+        'notifications': userdata['notifier'].alive,
+    }
+    dispatcher = userdata.get('dispatcher')
+    if dispatcher is not None:
+        liveness['dispatcher'] = dispatcher.alive
+    watchdog = userdata.get('watchdog')
+    if watchdog is not None:
+        liveness['watchdog'] = watchdog.alive
+    reports = userdata.get('reports')
+    if reports is not None:
+        liveness['reports'] = reports.alive
+    readiness = {
+        'mqtt': mqtt_connected.is_set,
+        'database': database_reachable,
+        'accepting': lambda: not draining.is_set(),
+    }
+
+    def profile(query):
+        try:
+            seconds = min(float(query.get('seconds', ['10'])[0]), config.PROFILING_MAX_SECONDS)
+        except ValueError:
+            return 400, 'Invalid seconds', 'text/plain'
+        try:
+            return 200, sample_stacks(seconds, config.PROFILING_INTERVAL), 'text/plain'
+        except ProfilerBusy as e:
+            return 409, str(e), 'text/plain'
+
+    admin_routes = {
+        '/debug/profile': profile,
+        '/debug/slow-events': lambda query: (200, json.dumps(slow_events.entries()), 'application/json'),
+    }
+    return HealthServer(
+        config.CONTROL_HEALTH_HOST,
+        config.CONTROL_HEALTH_PORT,
+        liveness,
+        readiness,
+        admin_token=config.PROFILING_ADMIN_TOKEN,
+        admin_routes=admin_routes
+    )
+
+def create_mqtt_client(config):
+    """
+    Creates the MQTT client of the control server.
+
+    With a persistent session the broker keeps the subscriptions and queues
+    QoS 1 messages while the control server is disconnected, which requires
+    a fixed client ID.
+
+    Args:
+        config (Config): The configuration with the MQTT settings.
+
+    Returns:
+        mqtt.Client: The client, also stored as module global `mqtt_client`.
+    """
+    global mqtt_client
+    persistent = config.MQTT_PERSISTENT_SESSION
+    if persistent and not config.MQTT_CLIENT_ID:
+        logger.warning("No MQTT client_id configured, using a clean session.")
+        persistent = False
+    mqtt_client = mqtt.Client(client_id=config.MQTT_CLIENT_ID or "", clean_session=not persistent)
+    return mqtt_client
+
+def request_shutdown(signum=None, frame=None):
+    """
+    Stops receiving messages, so `control_server_task` drains the pipeline and returns.
+
+    Installed as handler for SIGTERM and SIGINT by `main`.
+    """
+    logger.info(f"Shutdown requested (signal {signum}), draining.")
+    draining.set()
+    mqtt_client.disconnect()
+
+def control_server_task(health_server=False):
     """
     Initializes and starts the control server task.
     This function performs the following steps:
     1. Loads the configuration settings.
     2. Sets up logging based on the configuration.
-    3. Initializes the email server with the provided configuration.
-    4. Configures the MQTT client with connection, disconnection, and message handling callbacks.
-    5. Sets the MQTT client to clean session mode and configures authentication.
-    6. Connects the MQTT client to the broker.
-    7. Sets user data for the MQTT client.
-    8. Enables logging for the MQTT client.
-    9. Starts the MQTT client loop to process network traffic and dispatch callbacks.
-    The function also handles graceful shutdown on a keyboard interrupt, ensuring resources are cleaned up properly.
+    3. Initializes the email server and the background notification dispatcher.
+    4. Creates the MQTT client with a persistent session, if configured.
+    5. Starts the write-behind buffer for weight readings with its spool and warm-starts the
+       rolling baselines from the readings already stored in the database.
+    6. Starts the sharded dispatcher that processes the events of each sensor in order on worker threads.
+    7. Configures the MQTT client with connection, disconnection, and message handling callbacks and authentication.
+    8. Connects the MQTT client to the broker.
+    9. Sets user data for the MQTT client.
+    10. Enables logging for the MQTT client.
+    11. Starts the MQTT client loop to process network traffic and dispatch callbacks.
+    The function also handles graceful shutdown on a keyboard interrupt or `request_shutdown`, ensuring resources
+    are cleaned up properly: queued events are processed, buffered weight readings are flushed to the database and
+    queued e-mails are sent.
+    Args:
+        health_server (bool): Whether to serve the health checks and metrics on the configured health port.
     Raises:
         KeyboardInterrupt: If the server is stopped by the user.
     """
@@ -332,22 +1282,37 @@ def control_server_task():
     
     logger.info("Configuration loaded successfully.")
     
+    config_cache.ttl = config.CONFIG_CACHE_TTL
+    
     email_server = EmailSender(
         config.EMAIL_SMTP_SERVER, 
         config.EMAIL_PORT, 
         config.EMAIL_USERNAME, 
-        config.EMAIL_PASSWORD
+        config.EMAIL_PASSWORD,
+        use_tls=config.EMAIL_USE_TLS
+    )
+    
+    notifier = NotificationDispatcher(
+        email_server,
+        workers=config.NOTIFY_WORKERS,
+        max_queue=config.NOTIFY_MAX_QUEUE,
+        max_retries=config.NOTIFY_MAX_RETRIES,
+        retry_backoff=config.NOTIFY_RETRY_BACKOFF,
+        idle_timeout=config.NOTIFY_IDLE_TIMEOUT
     )
     
+    mqtt_client = create_mqtt_client(config)
+    userdata = create_pipeline(config, mqtt_client, notifier, get_publisher(config))
+    health = create_health_server(config, userdata) if health_server else None
+    if health is not None:
+        health.start()
+    
     mqtt_client.on_connect = on_connect
     mqtt_client.on_disconnect = on_disconnect
     mqtt_client.on_message = on_message
-    mqtt_client.clean_session = True
     mqtt_client.username_pw_set(config.MQTT_USERNAME, config.MQTT_PASSWORD)
     mqtt_client.connect(config.MQTT_BROKER, config.MQTT_PORT, 60)
-    mqtt_client.user_data_set({
-        'email_server': email_server
-    })
+    mqtt_client.user_data_set(userdata)
     mqtt_client.enable_logger(logger)
     
     try:
@@ -355,7 +1320,33 @@ def control_server_task():
     except KeyboardInterrupt:
         logger.info("Server stopped by user.")
     finally:
+        draining.set()
+        shutdown_pipeline(userdata)
+        if health is not None:
+            health.close()
         logger.info("Resources cleaned up and server stopped.")
+
+def main():
+    """
+    Runs the control server as its own process, separate from the web app.
+
+    SIGTERM and SIGINT stop receiving MQTT messages and drain all buffered
+    work before the process exits.
+    """
+    parser = argparse.ArgumentParser(description="Processes the MQTT messages of the mailboxes.")
+    parser.add_argument('--no-health-server', action='store_true', help="do not serve /healthz, /readyz and /metrics")
+    args = parser.parse_args()
+
+    config = Config()
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = config.DB_URI
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    init_db(app, config)
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    with app.app_context():
+        control_server_task(health_server=not args.no_health_server)
         
 if __name__ == "__main__":
-    control_server_task()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,60 @@
+from datetime import timedelta
+
+
+class DeadbandFilter:
+    """
+    Decides which weight readings are worth storing.
+
+    A reading is stored when it differs from the last stored reading of the
+    sensor by more than `epsilon`, or when `heartbeat_seconds` have passed
+    since the last stored reading. All other readings are within the noise of
+    a steady scale and are dropped before the database insert, so the stored
+    rows form a step series that can be reconstructed by carrying the last
+    value forward (see `history.query_weight_steps`).
+
+    The filter only affects storage: the baseline and threshold evaluation
+    still see every reading. Averages over the stored rows are weighted by
+    reading rather than by time; the baseline warm start therefore samples
+    the step series (see `BaselineTracker.warm_start`).
+    """
+
+    def __init__(self, epsilon=1.0, heartbeat_seconds=60):
+        """
+        Initializes the filter.
+
+        Args:
+            epsilon (float): Smaller weight changes are suppressed, 0 only suppresses unchanged readings.
+            heartbeat_seconds (float): Maximum seconds between two stored readings of a sensor, 0 stores every reading.
+        """
+        self.epsilon = epsilon
+        self.heartbeat = timedelta(seconds=heartbeat_seconds)
+        self.stored = 0
+        self.suppressed = 0
+        self._last = {}
+
+    def update(self, sensor_id, weight, timestamp):
+        """
+        Checks a reading and remembers it if it is to be stored.
+
+        Readings of a sensor must be passed in order from a single thread,
+        which the sharded dispatcher guarantees.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+            weight (float): The weight reading.
+            timestamp (datetime): The time of the reading.
+
+        Returns:
+            bool: True if the reading should be stored.
+        """
+        last = self._last.get(sensor_id)
+        if (
+            last is not None
+            and abs(weight - last[1]) <= self.epsilon
+            and timedelta(0) <= timestamp - last[0] < self.heartbeat
+        ):
+            self.suppressed += 1
+            return False
+        self._last[sensor_id] = (timestamp, weight)
+        self.stored += 1
+        return True
@@ -0,0 +1,282 @@
+"""
+Package detection engine.
+
+Detectors work on NumPy arrays of consecutive readings of one sensor
+together with the baseline weight at each reading and the threshold
+sensitivity of the sensor. They keep a small state per sensor between calls,
+so the same engine processes the live MQTT stream one reading (or one batch)
+at a time and replays months of stored readings in a few vectorized calls.
+
+All detectors are edge-triggered: a package is reported once when the
+weight rises above its reference, and the detector re-arms only after the
+weight has settled again. The reference is the baseline, except after a
+change the rolling baseline has not caught up with yet: after a reported
+package it is the reported weight, so a second package dropped on top of
+the first is reported as well, and after packages were taken out it is the
+remaining weight. Such a level holds for the length of the baseline window.
+"""
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+
+Detection = namedtuple('Detection', ['sensor_id', 'timestamp', 'weight', 'baseline', 'detector'])
+
+
+class ThresholdDetector:
+    """
+    Reports a package as soon as a reading exceeds the baseline by the sensitivity.
+    """
+    name = 'threshold'
+
+    def initial_state(self):
+        return {'above': False}
+
+    def detect(self, residuals, sensitivity, state):
+        """
+        Finds the readings at which a package is reported.
+
+        Args:
+            residuals (np.ndarray): The readings minus their baselines.
+            sensitivity (float): The threshold sensitivity of the sensor.
+            state (dict): The state of the sensor, updated in place.
+
+        Returns:
+            np.ndarray: The indices of the readings that report a package.
+        """
+        above = residuals >= sensitivity
+        previous = np.concatenate(([state['above']], above[:-1]))
+        state['above'] = bool(above[-1])
+        return np.flatnonzero(above & ~previous)
+
+
+class StepChangeDetector:
+    """
+    Reports a package once the weight stayed above the threshold for `debounce` readings.
+
+    Single spikes, e.g. from touching the mailbox, are ignored.
+    """
+    name = 'step'
+
+    def __init__(self, debounce=3):
+        self.debounce = debounce
+
+    def initial_state(self):
+        return {'run': 0}
+
+    def detect(self, residuals, sensitivity, state):
+        above = residuals >= sensitivity
+        index = np.arange(len(above))
+        last_below = np.maximum.accumulate(np.where(above, -1, index))
+        run = index - last_below
+        run[last_below < 0] += state['run']
+        state['run'] = int(min(run[-1], self.debounce))
+        return np.flatnonzero(run == self.debounce)
+
+
+class CusumDetector:
+    """
+    One-sided CUSUM over the deviation from the baseline.
+
+    Small deviations above `drift * sensitivity` accumulate until they reach
+    `threshold * sensitivity`, so slowly added or light packages are still
+    found while noise is averaged out. After a report the sum restarts once
+    the deviation fell below the drift again.
+    """
+    name = 'cusum'
+
+    def __init__(self, drift=0.5, threshold=2.0):
+        self.drift = drift
+        self.threshold = threshold
+
+    def initial_state(self):
+        return {'sum': 0.0, 'armed': True}
+
+    def detect(self, residuals, sensitivity, state):
+        drift = self.drift * sensitivity
+        limit = self.threshold * sensitivity
+        increments = residuals - drift
+        found = []
+        i = 0
+        while i < len(residuals):
+            if not state['armed']:
+                settled = np.flatnonzero(residuals[i:] <= drift)
+                if not settled.size:
+                    break
+                i += int(settled[0])
+                state['armed'] = True
+                state['sum'] = 0.0
+            # S_t = max(0, S_t-1 + x_t) equals C_t - min(0, min C_j) with C the running sum
+            running = state['sum'] + np.cumsum(increments[i:])
+            sums = running - np.minimum(np.minimum.accumulate(running), 0)
+            hits = np.flatnonzero(sums >= limit)
+            if not hits.size:
+                state['sum'] = float(sums[-1])
+                break
+            i += int(hits[0])
+            found.append(i)
+            state['armed'] = False
+            state['sum'] = 0.0
+            i += 1
+        return np.array(found, dtype=int)
+
+
+DETECTORS = ('threshold', 'step', 'cusum')
+
+
+def create_detector(name, debounce=3, drift=0.5, threshold=2.0):
+    """
+    Creates a detector by name.
+
+    Args:
+        name (str): One of 'threshold', 'step' or 'cusum'.
+        debounce (int): Readings above the threshold the step detector waits for.
+        drift (float): Deviation ignored by the CUSUM detector, in multiples of the sensitivity.
+        threshold (float): Accumulated deviation reported by the CUSUM detector, in multiples of the sensitivity.
+
+    Returns:
+        The detector.
+    """
+    if name == 'threshold':
+        return ThresholdDetector()
+    if name == 'step':
+        return StepChangeDetector(debounce)
+    if name == 'cusum':
+        return CusumDetector(drift, threshold)
+    raise ValueError(f"Unknown detector: {name}")
+
+
+class DetectionEngine:
+    """
+    Runs a detector over the readings of many sensors and keeps their state.
+
+    Readings of a sensor must be passed in order from a single thread,
+    which the sharded dispatcher guarantees.
+    """
+
+    def __init__(self, detector, settle_seconds=60):
+        """
+        Initializes the engine without any known sensor.
+
+        Args:
+            detector: The detector created by `create_detector`.
+            settle_seconds (float): Seconds the baseline needs to catch up with a changed
+                weight, usually the length of the baseline window.
+        """
+        self.detector = detector
+        self.settle_seconds = settle_seconds
+        self._states = {}
+        self._levels = {}
+
+    def process(self, sensor_id, timestamps, weights, baselines, sensitivity):
+        """
+        Processes consecutive readings of one sensor.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+            timestamps (sequence): The times of the readings.
+            weights (sequence): The weight readings.
+            baselines (sequence): The baseline weight at each reading.
+            sensitivity (float): The threshold sensitivity of the sensor.
+
+        Returns:
+            list: The detected packages as `Detection` tuples, their `baseline` is the
+            reference the package was detected against.
+        """
+        weights = np.asarray(weights, dtype=float)
+        if not len(weights):
+            return []
+        baselines = np.asarray(baselines, dtype=float)
+        state = self._states.get(sensor_id)
+        if state is None:
+            state = self._states.setdefault(sensor_id, self.detector.initial_state())
+        times = _seconds(timestamps)
+        detections = []
+        start = 0
+        while start < len(weights):
+            held = self._levels.get(sensor_id)
+            if held is None:
+                reference = baselines[start:]
+                # A weight far below the baseline means packages were taken out
+                ends = np.flatnonzero(weights[start:] < reference - sensitivity)
+            else:
+                level, until = held
+                reference = np.full(len(weights) - start, level)
+                ends = np.flatnonzero((times[start:] > until) | (weights[start:] < level - sensitivity))
+            end = start + int(ends[0]) if ends.size else len(weights)
+            if end == start:
+                if weights[start] < reference[0] - sensitivity:
+                    self._levels[sensor_id] = (float(weights[start]), times[start] + self.settle_seconds)
+                else:
+                    del self._levels[sensor_id]
+                continue
+            indices = self.detector.detect(weights[start:end] - reference[:end - start], sensitivity, state)
+            if not len(indices):
+                start = end
+                continue
+            # Re-arm relative to the reported weight and detect the following readings against it
+            index = int(indices[0])
+            i = start + index
+            detections.append(Detection(sensor_id, timestamps[i], float(weights[i]), float(reference[index]), self.detector.name))
+            self._levels[sensor_id] = (float(weights[i]), times[i] + self.settle_seconds)
+            state.clear()
+            state.update(self.detector.initial_state())
+            start = i + 1
+        return detections
+
+    def process_batch(self, batch):
+        """
+        Processes the readings of many sensors.
+
+        Args:
+            batch (iterable): (sensor_id, timestamps, weights, baselines, sensitivity) tuples.
+
+        Returns:
+            list: The detected packages of all sensors.
+        """
+        detections = []
+        for sensor_id, timestamps, weights, baselines, sensitivity in batch:
+            detections.extend(self.process(sensor_id, timestamps, weights, baselines, sensitivity))
+        return detections
+
+    def reset(self, sensor_id=None):
+        """
+        Forgets the state of one or all sensors.
+
+        Args:
+            sensor_id (int, optional): The ID of the sensor, all sensors if omitted.
+        """
+        if sensor_id is None:
+            self._states.clear()
+            self._levels.clear()
+        else:
+            self._states.pop(sensor_id, None)
+            self._levels.pop(sensor_id, None)
+
+
+def _seconds(timestamps):
+    # Live readings carry datetimes, replayed ones seconds
+    if len(timestamps) and isinstance(timestamps[0], datetime):
+        return np.array([timestamp.timestamp() for timestamp in timestamps])
+    return np.asarray(timestamps, dtype=float)
+
+
+def rolling_mean(times, weights, window_seconds):
+    """
+    Computes the mean over the trailing time window at every reading.
+
+    Matches `baseline.RollingWindow` with the 'mean' statistic: the window
+    ends at and includes the reading.
+
+    Args:
+        times (np.ndarray): The times of the readings in seconds, ascending.
+        weights (np.ndarray): The weight readings.
+        window_seconds (float): The length of the window.
+
+    Returns:
+        np.ndarray: The baseline at every reading.
+    """
+    weights = np.asarray(weights, dtype=float)
+    cumulative = np.concatenate(([0.0], np.cumsum(weights)))
+    end = np.arange(1, len(weights) + 1)
+    start = np.searchsorted(times, times - window_seconds, side='left')
+    return (cumulative[end] - cumulative[start]) / (end - start)
@@ -0,0 +1,157 @@
+from contextlib import nullcontext
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+class ShardedDispatcher:
+    """
+    Distributes events onto a fixed set of worker threads by sensor id.
+
+    All events of one sensor are hashed onto the same worker and therefore
+    processed in order, while events of different sensors are processed in
+    parallel. Every worker has a bounded queue; when it is full the
+    `overflow` policy decides what happens:
+
+    - 'block': wait up to `put_timeout` seconds for space, then drop the new event.
+    - 'drop_newest': drop the new event immediately.
+    - 'drop_oldest': drop the oldest queued event of the worker to make room.
+    """
+
+    def __init__(self, handler, workers=4, max_queue=1000, overflow='block', put_timeout=1.0, context=None):
+        """
+        Initializes the dispatcher and starts the worker threads.
+
+        Args:
+            handler (callable): Called as `handler(sensor_id, event)` on a worker thread.
+            workers (int): Number of worker threads.
+            max_queue (int): Maximum number of queued events per worker.
+            overflow (str): One of 'block', 'drop_newest' or 'drop_oldest'.
+            put_timeout (float): Seconds `submit` waits for space with the 'block' policy.
+            context (callable, optional): Returns a context manager every worker runs in,
+                e.g. `app.app_context` to give each worker its own database session.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.handler = handler
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self.context = context or nullcontext
+
+        # Updated by the producers and all workers
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self._counter_lock = threading.Lock()
+
+        self._queues = [queue.Queue(maxsize=max_queue) for _ in range(workers)]
+        self._threads = [
+            threading.Thread(target=self._run, args=(shard,), name=f"dispatcher-{i}", daemon=True)
+            for i, shard in enumerate(self._queues)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, sensor_id, event):
+        """
+        Queues an event on the worker responsible for the sensor.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+            event (any): The event passed on to the handler.
+
+        Returns:
+            bool: True if the event was queued, False if it was dropped.
+        """
+        shard = self._queues[hash(sensor_id) % len(self._queues)]
+        item = (sensor_id, event)
+        try:
+            if self.overflow == 'block':
+                shard.put(item, timeout=self.put_timeout)
+            else:
+                shard.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        if self.overflow == 'drop_oldest':
+            try:
+                shard.get_nowait()
+                shard.task_done()
+                self._count('dropped')
+            except queue.Empty:
+                pass
+            try:
+                shard.put_nowait(item)
+                logger.warning(f"Dispatcher queue full, dropped the oldest event to make room for sensor_id {sensor_id}.")
+                return True
+            except queue.Full:
+                pass
+        self._count('dropped')
+        logger.warning(f"Dispatcher queue full, dropping event of sensor_id {sensor_id}.")
+        return False
+
+    def queue_depths(self):
+        """
+        Returns the number of queued events of every worker.
+
+        Returns:
+            list: The queue depth per worker.
+        """
+        return [shard.qsize() for shard in self._queues]
+
+    def stats(self):
+        """
+        Returns the counters and queue depths of the dispatcher.
+
+        Returns:
+            dict: Processed, dropped and failed events and the queue depth per worker.
+        """
+        return {
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'queue_depths': self.queue_depths(),
+        }
+
+    def alive(self):
+        return all(thread.is_alive() for thread in self._threads)
+
+    def close(self, timeout=30):
+        """
+        Processes all queued events and stops the workers.
+
+        Args:
+            timeout (float): Seconds to wait for all workers to finish.
+        """
+        deadline = time.monotonic() + timeout
+        for shard in self._queues:
+            try:
+                shard.put(None, timeout=max(0, deadline - time.monotonic()))
+            except queue.Full:
+                logger.warning(f"Dispatcher queue still full after {timeout}s, abandoning {shard.qsize()} events.")
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.monotonic()))
+
+    def _count(self, counter):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _run(self, shard):
+        with self.context():
+            while True:
+                item = shard.get()
+                try:
+                    if item is None:
+                        return
+                    self.handler(*item)
+                    self._count('processed')
+                except Exception as e:
+                    self._count('errors')
+                    logger.error(f"Error processing event of sensor_id {item[0]}: {e}")
+                finally:
+                    shard.task_done()
@@ -1,17 +1,20 @@
 import smtplib
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 
 class EmailSender:
-    def __init__(self, smtp_server, smtp_port, username, password):
+    def __init__(self, smtp_server, smtp_port, username, password, use_tls=True, timeout=30):
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
         self.username = username
         self.password = password
         self.sender_email = username
+        self.use_tls = use_tls
+        self.timeout = timeout
 
-    def send_email(self, recipient_email, subject, message, html_table=None):
+    def create_message(self, recipient_email, subject, message, html_table=None):
         msg = MIMEMultipart()
         msg['From'] = self.sender_email
         msg['To'] = recipient_email
@@ -25,13 +28,75 @@ class EmailSender:
         msg.attach(text_part)
         if html_table:
             msg.attach(html_part)
+        return msg
 
-
+    def connect(self):
+        # Open an authenticated connection, the caller is responsible for closing it
+        server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
         try:
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
+            if self.use_tls:
                 server.starttls()
+            if self.username:
                 server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def send_email(self, recipient_email, subject, message, html_table=None):
+        msg = self.create_message(recipient_email, subject, message, html_table)
+
+        try:
+            with self.connect() as server:
                 server.send_message(msg)
             print("Email sent successfully!")
         except Exception as e:
-            print(f"Failed to send email. Error: {str(e)}")
\ No newline at end of file
+            print(f"Failed to send email. Error: {str(e)}")
+
+
+class SMTPSession:
+    """
+    Keeps one authenticated SMTP connection open across several messages.
+
+    The connection is opened lazily, reopened once if the server dropped it
+    and closed by `close_if_idle` after `idle_timeout` seconds without mail.
+    """
+
+    def __init__(self, email_sender, idle_timeout=60):
+        self.email_sender = email_sender
+        self.idle_timeout = idle_timeout
+        self._server = None
+        self._last_used = 0.0
+
+    def send(self, recipients, subject, message, html_table=None):
+        # One envelope for all recipients; the addresses are not disclosed to each other
+        msg = self.email_sender.create_message("undisclosed-recipients:;", subject, message, html_table)
+        try:
+            self._connection().send_message(msg, to_addrs=recipients)
+        except smtplib.SMTPServerDisconnected:
+            self._server = None
+            self._connection().send_message(msg, to_addrs=recipients)
+        except Exception:
+            self.close()
+            raise
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._server is not None and time.monotonic() - self._last_used >= self.idle_timeout:
+            self.close()
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            self._server.close()
+        finally:
+            self._server = None
+
+    def _connection(self):
+        if self._server is None:
+            self._server = self.email_sender.connect()
+            self._last_used = time.monotonic()
+        return self._server
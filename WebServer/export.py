@@ -0,0 +1,317 @@
+"""
+Streaming export of the weight and alarm history.
+
+Rows are never collected in memory: CSV from Postgres is produced by
+`COPY (...) TO STDOUT` and forwarded chunk by chunk, NDJSON and Parquet read
+the rows through a server-side cursor `chunk_size` rows at a time. Every
+export is a generator of byte chunks, so it can be written to a file or
+sent as a chunked HTTP response (see the `/export` endpoint of the web app).
+
+Parquet needs the optional dependency pyarrow (`poetry install -E parquet`).
+
+Examples:
+    python export.py --sensor 1 --start 2024-12-01 --end 2025-01-01 --output weights.csv
+    python export.py --table alarms --format ndjson
+    python export.py --sensor 1 --bucket 60 --format parquet --output weights_1m.parquet
+"""
+from configweb import Config
+from models import Weights, Alarms
+from history import weight_bucket_source
+from storage import get_storage
+from sqlalchemy import create_engine, select, type_coerce, DateTime, Float, Integer, String
+from datetime import datetime, timedelta
+import argparse
+import csv
+import io
+import json
+import queue
+import sys
+import threading
+
+TABLES = ('weights', 'alarms')
+FORMATS = ('csv', 'ndjson', 'parquet')
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+class ExportCancelled(Exception):
+    """
+    Raised into a running COPY when the consumer of the export went away.
+    """
+
+
+def build_export_query(table, sensor_ids=None, start=None, end=None, bucket=None, storage=None):
+    """
+    Builds the query of an export, ordered by sensor and time.
+
+    Args:
+        table (str): 'weights' or 'alarms'.
+        sensor_ids (list, optional): Only export these sensors.
+        start (datetime, optional): The inclusive start of the range.
+        end (datetime, optional): The exclusive end of the range.
+        bucket (timedelta, optional): Downsample the weights to min, max and
+            average per bucket, read from the continuous aggregates where possible.
+            The average is over the stored readings, not over time, see
+            `history.weight_bucket_source`.
+        storage (PostgresStorage, optional): The storage backend of the database, needed with `bucket`.
+
+    Returns:
+        sqlalchemy.sql.Select: The query.
+
+    Raises:
+        ValueError: If the table is unknown or a bucket is requested for alarms.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    if bucket is not None and table != 'weights':
+        raise ValueError("Only weights can be downsampled.")
+
+    if bucket is not None:
+        source_time, sensor_column, columns = weight_bucket_source(bucket, storage)
+        timestamp = storage.time_bucket(bucket, source_time).label('timestamp')
+        query = select(
+            timestamp,
+            sensor_column.label('sensor_id'),
+            type_coerce(columns[0], Float).label('min_value'),
+            type_coerce(columns[1], Float).label('max_value'),
+            type_coerce(columns[2], Float).label('avg_value'),
+        ).group_by(sensor_column, timestamp).order_by(sensor_column, timestamp)
+    else:
+        model = Weights if table == 'weights' else Alarms
+        source_time, sensor_column = model.timestamp, model.sensor_id
+        query = select(model.timestamp, model.sensor_id, model.value).order_by(model.sensor_id, model.timestamp)
+
+    if sensor_ids:
+        query = query.where(sensor_column.in_(sensor_ids))
+    if start:
+        query = query.where(source_time >= start)
+    if end:
+        query = query.where(source_time < end)
+    return query
+
+
+def stream_rows(engine, query, chunk_size=10000):
+    """
+    Reads the rows of a query through a server-side cursor.
+
+    Yields:
+        list: Up to `chunk_size` rows.
+    """
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+        for partition in result.partitions():
+            yield partition
+
+
+def export_csv(engine, query, chunk_size=10000):
+    """
+    Exports a query as CSV with a header row.
+
+    With Postgres the rows are formatted by `COPY ... TO STDOUT`, other
+    databases fall back to a server-side cursor and the csv module.
+
+    Yields:
+        bytes: The next chunk of the file.
+    """
+    if engine.dialect.driver == 'psycopg2':
+        yield from _copy_csv(engine, query)
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(query.selected_columns.keys())
+    for rows in stream_rows(engine, query, chunk_size):
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _copy_csv(engine, query):
+    # copy_expert pushes the data into a file object, a bounded queue turns that into a generator
+    chunks = queue.Queue(maxsize=16)
+    cancelled = threading.Event()
+
+    class Sink:
+        def write(self, data):
+            while True:
+                if cancelled.is_set():
+                    raise ExportCancelled()
+                try:
+                    chunks.put(data, timeout=1)
+                    return
+                except queue.Full:
+                    pass
+
+    def run():
+        try:
+            with engine.connect() as connection:
+                compiled = query.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+                cursor = connection.connection.cursor()
+                sql = cursor.mogrify(str(compiled), compiled.params).decode()
+                cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)", Sink(), size=65536)
+                cursor.close()
+        except Exception as e:
+            if not cancelled.is_set():
+                chunks.put(e)
+        finally:
+            if not cancelled.is_set():
+                chunks.put(None)
+
+    threading.Thread(target=run, name="export-copy", daemon=True).start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        cancelled.set()
+
+
+def export_ndjson(engine, query, chunk_size=10000):
+    """
+    Exports a query as one JSON object per line.
+
+    Yields:
+        bytes: The next chunk of the file.
+    """
+    keys = list(query.selected_columns.keys())
+    for rows in stream_rows(engine, query, chunk_size):
+        yield ''.join(
+            json.dumps(dict(zip(keys, row)), default=_json_value, separators=(',', ':')) + '\n'
+            for row in rows
+        ).encode()
+
+
+def _json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def export_parquet(engine, query, chunk_size=10000):
+    """
+    Exports a query as a Parquet file with one row group per chunk.
+
+    Returns:
+        generator: The byte chunks of the file.
+
+    Raises:
+        RuntimeError: If pyarrow is not installed, raised before the export starts.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (poetry install -E parquet).")
+
+    types = {DateTime: pa.timestamp('us'), Integer: pa.int64(), Float: pa.float64(), String: pa.string()}
+    schema = pa.schema([
+        (column.key, next((pa_type for sa_type, pa_type in types.items() if isinstance(column.type, sa_type)), pa.string()))
+        for column in query.selected_columns
+    ])
+
+    class Sink(io.RawIOBase):
+        def __init__(self):
+            self.chunks = []
+
+        def writable(self):
+            return True
+
+        def write(self, data):
+            self.chunks.append(bytes(data))
+            return len(data)
+
+        def drain(self):
+            data, self.chunks = b''.join(self.chunks), []
+            return data
+
+    def generate():
+        sink = Sink()
+        writer = pq.ParquetWriter(sink, schema)
+        try:
+            for rows in stream_rows(engine, query, chunk_size):
+                columns = list(zip(*rows))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema
+                ))
+                data = sink.drain()
+                if data:
+                    yield data
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    return generate()
+
+
+EXPORTERS = {
+    'csv': export_csv,
+    'ndjson': export_ndjson,
+    'parquet': export_parquet,
+}
+
+
+def export(engine, table='weights', fmt='csv', sensor_ids=None, start=None, end=None, bucket=None, chunk_size=10000):
+    """
+    Exports the history in constant memory.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The database engine.
+        table (str): 'weights' or 'alarms'.
+        fmt (str): 'csv', 'ndjson' or 'parquet'.
+        sensor_ids (list, optional): Only export these sensors.
+        start (datetime, optional): The inclusive start of the range.
+        end (datetime, optional): The exclusive end of the range.
+        bucket (timedelta, optional): Downsample the weights to this bucket width.
+        chunk_size (int): Rows fetched from the server-side cursor at a time.
+
+    Returns:
+        generator: The byte chunks of the file.
+
+    Raises:
+        ValueError: If the table or format is unknown.
+        RuntimeError: If the optional dependency of the format is not installed.
+    """
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown format: {fmt}")
+    query = build_export_query(table, sensor_ids, start, end, bucket, get_storage(engine))
+    return EXPORTERS[fmt](engine, query, chunk_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--table', choices=TABLES, default='weights')
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--db-uri', help="database URI, defaults to the one in config.yml")
+    parser.add_argument('--sensor', type=int, action='append', help="only export this sensor, can be repeated")
+    parser.add_argument('--start', type=datetime.fromisoformat, help="start of the range as ISO 8601 timestamp")
+    parser.add_argument('--end', type=datetime.fromisoformat, help="end of the range as ISO 8601 timestamp")
+    parser.add_argument('--bucket', type=float, help="downsample the weights to buckets of this many seconds")
+    parser.add_argument('--output', help="output file, defaults to stdout")
+    args = parser.parse_args()
+
+    config = Config()
+    engine = create_engine(args.db_uri or config.DB_URI)
+    bucket = timedelta(seconds=args.bucket) if args.bucket else None
+    chunks = export(engine, args.table, args.format, args.sensor, args.start, args.end, bucket, config.EXPORT_CHUNK_SIZE)
+
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""
+Gunicorn configuration of the web app.
+
+Server-Sent Events keep a connection open per browser, so the workers use
+threads: every open `/stream` occupies one thread, not a whole process.
+The number of workers and threads can be overridden with the environment
+variables WEB_CONCURRENCY and WEB_THREADS.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+
+# Create the tables and TimescaleDB policies once in the master instead of in every worker
+preload_app = True
+
+# Streams are kept open by heartbeats, requests are never expected to take this long
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Connections opened by the master during the preload must not be shared with the workers
+    from app import app
+    from models import db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    from app import shutdown
+    shutdown()
@@ -0,0 +1,111 @@
+"""
+Minimal HTTP server for the health checks and metrics of the control server.
+
+The control server has no web framework of its own, so this module serves
+
+- `/healthz`: 200 while all liveness checks pass, e.g. the worker threads run,
+- `/readyz`: 200 while all readiness checks pass, e.g. MQTT is connected and
+  the server is not draining,
+- `/metrics`: the metrics registry in the Prometheus text format,
+- `/debug/...`: admin routes, e.g. the profiler, only with the admin token,
+
+from a background thread of the standard library HTTP server.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import REGISTRY, CONTENT_TYPE
+from profiling import authorized
+from urllib.parse import parse_qs
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def run_checks(checks):
+    """
+    Runs health checks.
+
+    Args:
+        checks (dict): Check name mapped to a callable returning True if healthy.
+
+    Returns:
+        tuple: Whether all checks passed and the result of each check.
+    """
+    results = {}
+    for name, check in checks.items():
+        try:
+            results[name] = bool(check())
+        except Exception as e:
+            logger.warning(f"Health check {name} failed: {e}")
+            results[name] = False
+    return all(results.values()), results
+
+
+class HealthServer:
+    """
+    Serves the health checks and metrics on a separate port.
+    """
+
+    def __init__(self, host, port, liveness=None, readiness=None, admin_token=None, admin_routes=None):
+        """
+        Initializes the server without starting it.
+
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on.
+            liveness (dict, optional): The checks of `/healthz`.
+            readiness (dict, optional): The checks of `/readyz`.
+            admin_token (str, optional): The bearer token of the admin routes, None disables them.
+            admin_routes (dict, optional): Path mapped to a callable that takes the
+                parsed query string and returns the status, body and content type.
+        """
+        self.liveness = liveness or {}
+        self.readiness = readiness or {}
+        self.admin_token = admin_token
+        self.admin_routes = admin_routes or {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path, _, query = self.path.partition('?')
+                if path in server.admin_routes and server.admin_token:
+                    if not authorized(self.headers.get('Authorization'), server.admin_token):
+                        self._send(401, 'Unauthorized', 'text/plain')
+                        return
+                    try:
+                        self._send(*server.admin_routes[path](parse_qs(query)))
+                    except Exception as e:
+                        logger.error(f"Admin route {path} failed: {e}")
+                        self._send(500, str(e), 'text/plain')
+                elif path == '/metrics':
+                    self._send(200, REGISTRY.render(), CONTENT_TYPE)
+                elif path in ('/healthz', '/readyz'):
+                    healthy, results = run_checks(server.liveness if path == '/healthz' else server.readiness)
+                    body = json.dumps({'status': 'ok' if healthy else 'unavailable', 'checks': results})
+                    self._send(200 if healthy else 503, body, 'application/json')
+                else:
+                    self._send(404, 'Not found', 'text/plain')
+
+            def _send(self, status, body, content_type):
+                body = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="health-server", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info(f"Health server listening on {self._httpd.server_address[0]}:{self._httpd.server_address[1]}")
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
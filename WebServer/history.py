@@ -0,0 +1,323 @@
+from models import db, Weights, WEIGHT_ROLLUPS, select_weight_rollup
+from storage import get_storage
+from sqlalchemy import select, func, literal
+from datetime import datetime, timedelta
+from collections import namedtuple
+import hashlib
+import json
+import threading
+import time
+
+Step = namedtuple('Step', ['timestamp', 'value'])
+
+
+class ResponseCache:
+    """
+    Short-lived cache for serialized JSON responses.
+
+    Concurrent requests for the same key share one computation: the first
+    request runs the query while the others wait for its result, so many
+    dashboards polling the same sensor cause a single database query per
+    `ttl` seconds.
+    """
+
+    def __init__(self, ttl=5):
+        """
+        Initializes an empty cache.
+
+        Args:
+            ttl (float): Seconds a cached response is reused.
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached response for `key` or computes it.
+
+        Args:
+            key (hashable): The cache key, e.g. the normalized query arguments.
+            compute (callable): Returns the JSON-serializable response data.
+
+        Returns:
+            tuple: The serialized body and its ETag.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self.hits += 1
+                    return entry[1], entry[2]
+                event = self._in_flight.get(key)
+                if event is None:
+                    event = self._in_flight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            event.wait()
+
+        try:
+            body = json.dumps(compute(), separators=(',', ':'), default=str)
+            etag = hashlib.sha1(body.encode()).hexdigest()
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, body, etag)
+                self._evict_expired()
+            return body, etag
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+    def invalidate(self):
+        """
+        Drops all cached responses, e.g. after the settings of a sensor changed.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry[0] <= now]:
+            del self._entries[key]
+
+
+def parse_timestamp(value):
+    """
+    Parses an ISO 8601 timestamp from a query parameter.
+
+    The database stores naive local time, so timestamps with a UTC offset
+    are converted to local time and returned without the offset.
+
+    Args:
+        value (str): The timestamp, e.g. '2024-12-01T08:00:00' or '2024-12-01T07:00:00+00:00'.
+
+    Returns:
+        datetime: The parsed naive timestamp, or None if no value was given.
+
+    Raises:
+        ValueError: If the value is not a valid ISO 8601 timestamp.
+    """
+    if not value:
+        return None
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+
+def align_bucket(bucket, storage):
+    """
+    Rounds a bucket width up to a whole multiple of the coarsest aggregate not wider than it.
+
+    Widths derived from a range and a number of points are rarely multiples
+    of a minute or an hour. Rounding them up keeps the number of buckets
+    within the requested points and lets `weight_bucket_source` read the
+    aggregate instead of the raw readings.
+
+    Args:
+        bucket (timedelta): The bucket width.
+        storage (PostgresStorage): The storage backend of the database.
+
+    Returns:
+        timedelta: The aligned bucket width, unchanged if no aggregate fits.
+    """
+    if storage.timescale:
+        for width, _ in WEIGHT_ROLLUPS:
+            if bucket >= width:
+                return -(-bucket // width) * width
+    return bucket
+
+
+def weight_bucket_source(bucket, storage):
+    """
+    Selects the source of downsampled weights with the given bucket width.
+
+    Buckets that are a multiple of a minute are aggregated from the coarsest
+    continuous aggregate whose bucket divides them, all others and all
+    buckets of a backend without aggregates from the raw readings.
+
+    The average is the mean of the stored readings. The deadband filter only
+    stores changes and heartbeats, so it weights every stored reading equally
+    regardless of how long its weight lasted: a bucket with a noisy minute and
+    a steady rest leans towards the noisy minute. The time-weighted view is the
+    step series of `query_weight_steps`.
+
+    Args:
+        bucket (timedelta): The bucket width.
+        storage (PostgresStorage): The storage backend of the database.
+
+    Returns:
+        tuple: The time column, the sensor column and the min, max and average aggregates.
+    """
+    _, rollup = select_weight_rollup(bucket, storage.timescale)
+    if rollup is None:
+        return Weights.timestamp, Weights.sensor_id, (
+            func.min(Weights.value),
+            func.max(Weights.value),
+            func.avg(Weights.value),
+        )
+    return rollup.c.bucket, rollup.c.sensor_id, (
+        func.min(rollup.c.min_value),
+        func.max(rollup.c.max_value),
+        func.sum(rollup.c.avg_value * rollup.c.samples) / func.sum(rollup.c.samples),
+    )
+
+
+def query_weight_history(sensor_id, start, end, cursor=None, limit=500, points=None):
+    """
+    Returns one page of the weight history of a sensor, newest first.
+
+    Without `points` the raw readings are returned. With `points` the range is
+    downsampled server-side into at most `points` buckets with min, max and
+    average; buckets of a minute or more are rounded up to whole minutes or
+    hours and read from the continuous aggregates instead of the raw
+    hypertable where the backend has them. The
+    average is taken over the stored readings, not over time, see
+    `weight_bucket_source`.
+
+    Pages are addressed by keyset pagination: `next_cursor` is the timestamp of
+    the oldest returned point and is passed as `cursor` to get the next page.
+
+    Args:
+        sensor_id (int): The ID of the sensor.
+        start (datetime): The inclusive start of the range.
+        end (datetime): The exclusive end of the range.
+        cursor (datetime, optional): Only points older than this timestamp are returned.
+        limit (int): The maximum number of points in the page.
+        points (int, optional): The target number of points for the whole range.
+
+    Returns:
+        dict: The points of the page, the used bucket width in seconds and the next cursor.
+    """
+    storage = get_storage(db.engine)
+    upper = min(end, cursor) if cursor else end
+    bucket = None
+    if points:
+        bucket = align_bucket(storage.bucket_width(max((end - start) / points, timedelta(seconds=1))), storage)
+
+    if bucket is None:
+        query = select(
+            Weights.timestamp.label('timestamp'),
+            Weights.value.label('min_value'),
+            Weights.value.label('max_value'),
+            Weights.value.label('avg_value'),
+        ).where(
+            Weights.sensor_id == sensor_id,
+            Weights.timestamp >= start,
+            Weights.timestamp < upper,
+        ).order_by(Weights.timestamp.desc()).limit(limit)
+    else:
+        source_time, sensor_column, columns = weight_bucket_source(bucket, storage)
+        bucket_time = storage.time_bucket(bucket, source_time).label('timestamp')
+        query = select(
+            bucket_time,
+            columns[0].label('min_value'),
+            columns[1].label('max_value'),
+            columns[2].label('avg_value'),
+        ).where(
+            sensor_column == sensor_id,
+            source_time >= start,
+            source_time < upper,
+        ).group_by(bucket_time).order_by(bucket_time.desc()).limit(limit)
+
+    rows = db.session.execute(query).all()
+    result_points = [
+        {
+            'timestamp': row.timestamp.isoformat(),
+            'min': row.min_value,
+            'max': row.max_value,
+            'avg': float(row.avg_value) if row.avg_value is not None else None,
+        }
+        for row in rows
+    ]
+    return {
+        'sensor_id': sensor_id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'bucket_seconds': bucket.total_seconds() if bucket else None,
+        'points': result_points,
+        'next_cursor': result_points[-1]['timestamp'] if len(result_points) == limit else None,
+    }
+
+
+def fill_steps(values, previous, start, end, bucket):
+    """
+    Carries the last value forward over the buckets without a reading, like `locf`.
+
+    Args:
+        values (dict): The last value of each bucket that has readings, by bucket start.
+        previous (float): The value before the first bucket, or None.
+        start (datetime): The inclusive start of the range.
+        end (datetime): The exclusive end of the range.
+        bucket (timedelta): The bucket width, buckets start at multiples of it since the epoch.
+
+    Returns:
+        list: (timestamp, value) tuples of all buckets, oldest first.
+    """
+    epoch = datetime(1970, 1, 1)
+    timestamp = epoch + (start - epoch) // bucket * bucket
+    rows = []
+    while timestamp < end:
+        previous = values.get(timestamp, previous)
+        rows.append(Step(timestamp, previous))
+        timestamp += bucket
+    return rows
+
+
+def query_weight_steps(sensor_id, start, end, points):
+    """
+    Reconstructs the step series of a sensor from its stored readings.
+
+    The deadband filter only stores readings that changed noticeably, so the
+    weight between two stored readings is the value of the earlier one. The
+    range is divided into `points` buckets with `time_bucket_gapfill`, and
+    buckets without a stored reading carry the last value forward with
+    `locf`, seeded with the last reading before `start`. Backends without
+    TimescaleDB return the last reading of each bucket and the gaps are
+    filled in Python.
+
+    Args:
+        sensor_id (int): The ID of the sensor.
+        start (datetime): The inclusive start of the range.
+        end (datetime): The exclusive end of the range.
+        points (int): The number of buckets.
+
+    Returns:
+        dict: The value at the end of each bucket, oldest first, and the used bucket width in seconds.
+    """
+    storage = get_storage(db.engine)
+    bucket = storage.bucket_width(max((end - start) / points, timedelta(seconds=1)))
+    previous = select(Weights.value).where(
+        Weights.sensor_id == sensor_id,
+        Weights.timestamp < start,
+    ).order_by(Weights.timestamp.desc()).limit(1).scalar_subquery()
+    in_range = (
+        Weights.sensor_id == sensor_id,
+        Weights.timestamp >= start,
+        Weights.timestamp < end,
+    )
+
+    if storage.timescale:
+        bucket_time = func.time_bucket_gapfill(literal(bucket), Weights.timestamp, start, end).label('timestamp')
+        last_value = func.locf(func.last(Weights.value, Weights.timestamp), previous).label('value')
+        query = select(bucket_time, last_value).where(*in_range).group_by(bucket_time).order_by(bucket_time)
+        rows = db.session.execute(query).all()
+    else:
+        bucket_time = storage.time_bucket(bucket, Weights.timestamp).label('bucket')
+        query = storage.latest([bucket_time], Weights.timestamp, Weights.value).where(*in_range)
+        values = {row.bucket: row.value for row in db.session.execute(query)}
+        rows = fill_steps(values, db.session.execute(select(previous)).scalar(), start, end, bucket)
+
+    return {
+        'sensor_id': sensor_id,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'bucket_seconds': bucket.total_seconds(),
+        'points': [
+            {'timestamp': row.timestamp.isoformat(), 'value': row.value}
+            for row in rows
+        ],
+    }
@@ -0,0 +1,244 @@
+from collections import deque
+from payload import decode_batch, decode_legacy
+import paho.mqtt.client as mqtt
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    The queue of events for one connected client, optionally limited to some sensors.
+    """
+
+    def __init__(self, sensor_ids, max_queue):
+        self.sensor_ids = sensor_ids
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lagging = False
+
+    def wants(self, event):
+        return self.sensor_ids is None or event['sensor_id'] in self.sensor_ids
+
+    def get(self, timeout):
+        """
+        Waits for the next event.
+
+        Args:
+            timeout (float): Seconds to wait.
+
+        Returns:
+            dict: The next event, or None if none arrived within `timeout`.
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroadcaster:
+    """
+    Fans out sensor events to all connected clients of this process.
+
+    Every event is kept in a ring buffer of the last `history_size` events,
+    so a client reconnecting with the id of the last event it received gets
+    the missed events replayed. A client that does not keep up with its
+    queue is marked as lagging and disconnected; the browser then reconnects
+    and catches up from the ring buffer.
+
+    The id of an event is built from its source timestamp, the sensor and the
+    event type, see `event_id`. Every gunicorn worker runs its own broadcaster
+    on its own MQTT subscription, so a reconnect may reach another worker or a
+    restarted one; the id identifies the same event there. Readings without a
+    device timestamp are stamped on reception, so a reading received a few
+    milliseconds apart by two workers may be replayed twice.
+    """
+
+    def __init__(self, history_size=1000, client_queue_size=100):
+        """
+        Initializes the broadcaster.
+
+        Args:
+            history_size (int): Number of events kept for replay after a reconnect.
+            client_queue_size (int): Maximum number of undelivered events per client.
+        """
+        self.client_queue_size = client_queue_size
+        self._history = deque(maxlen=history_size)
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+
+    @property
+    def client_count(self):
+        return len(self._subscriptions)
+
+    def publish(self, sensor_id, event_type, data, timestamp):
+        """
+        Sends an event to all interested clients.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+            event_type (str): The event type, e.g. 'weight' or 'alarm'.
+            data (dict): The event data.
+            timestamp (datetime): The source timestamp of the event.
+        """
+        key = (round(timestamp.timestamp() * 1000), sensor_id, event_type)
+        event = {'id': event_id(*key), 'key': key, 'sensor_id': sensor_id, 'type': event_type, 'data': data}
+        with self._lock:
+            self._history.append(event)
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.lagging or not subscription.wants(event):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                subscription.lagging = True
+
+    def subscribe(self, sensor_ids=None, last_event_id=None):
+        """
+        Registers a client.
+
+        Args:
+            sensor_ids (set, optional): The sensors the client is interested in, all if None.
+            last_event_id (str, optional): The id of the last event the client received.
+
+        Returns:
+            Subscription: The subscription holding the events for the client.
+        """
+        subscription = Subscription(sensor_ids, self.client_queue_size)
+        last_key = parse_event_id(last_event_id)
+        with self._lock:
+            if last_key is not None:
+                missed = [event for event in self._history if event['key'] > last_key and subscription.wants(event)]
+                for event in missed[-self.client_queue_size:]:
+                    subscription.queue.put_nowait(event)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """
+        Removes a client.
+
+        Args:
+            subscription (Subscription): The subscription returned by `subscribe`.
+        """
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+
+def event_id(timestamp_ms, sensor_id, event_type):
+    """
+    Builds the id of an event, e.g. '1733040000123-17-weight'.
+
+    Args:
+        timestamp_ms (int): The source timestamp in ms since the epoch.
+        sensor_id (int): The ID of the sensor.
+        event_type (str): The event type.
+
+    Returns:
+        str: The id, which orders events by their source timestamp.
+    """
+    return f"{timestamp_ms}-{sensor_id}-{event_type}"
+
+
+def parse_event_id(value):
+    """
+    Parses an id built by `event_id`, e.g. from the `Last-Event-ID` header.
+
+    Returns:
+        tuple: The timestamp, sensor ID and event type, or None if the value is missing or malformed.
+    """
+    try:
+        timestamp_ms, sensor_id, event_type = value.split('-', 2)
+        return (int(timestamp_ms), int(sensor_id), event_type)
+    except (AttributeError, ValueError):
+        return None
+
+
+def format_sse(event):
+    """
+    Formats an event as a Server-Sent Events message.
+
+    Args:
+        event (dict): The event as created by `EventBroadcaster.publish`.
+
+    Returns:
+        str: The message including the terminating blank line.
+    """
+    data = dict(event['data'], sensor_id=event['sensor_id'])
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(data)}\n\n"
+
+
+class MqttEventSource:
+    """
+    Single upstream MQTT subscription that feeds sensor events into a broadcaster.
+    """
+
+    def __init__(self, broadcaster, broker, port, username=None, password=None):
+        """
+        Initializes the source without connecting.
+
+        Args:
+            broadcaster (EventBroadcaster): Receives the events.
+            broker (str): The MQTT broker address.
+            port (int): The MQTT broker port.
+            username (str, optional): The MQTT username.
+            password (str, optional): The MQTT password.
+        """
+        self.broadcaster = broadcaster
+        self.broker = broker
+        self.port = port
+        self._client = mqtt.Client()
+        if username:
+            self._client.username_pw_set(username, password)
+        self._client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Connects to the broker and starts the background network loop once.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._client.connect_async(self.broker, self.port, 60)
+            self._client.loop_start()
+            self._started = True
+
+    def close(self):
+        with self._lock:
+            if self._started:
+                self._client.disconnect()
+                self._client.loop_stop()
+                self._started = False
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe("mailbox/+/weight", qos=0)
+            client.subscribe("mailbox/+/weights", qos=0)
+            client.subscribe("mailbox/+/alarm", qos=0)
+        else:
+            logger.error(f"Live update subscription failed with code {rc}")
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            _, sensor_id, event_type = msg.topic.split('/')
+            if event_type == 'weights':
+                # Only the newest reading of a batch is shown live
+                _, _, readings = decode_batch(msg.payload)
+                readings = readings[-1:]
+                event_type = 'weight'
+            else:
+                readings = decode_legacy(msg.payload)
+            for timestamp, value in readings:
+                self.broadcaster.publish(int(sensor_id), event_type, {
+                    'value': value,
+                    'timestamp': timestamp.isoformat(),
+                }, timestamp)
+        except ValueError:
+            logger.debug(f"Ignoring live update on {msg.topic}: {msg.payload!r}")
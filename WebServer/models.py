@@ -1,8 +1,13 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from metrics import Gauge
+from storage import get_storage
+from sqlalchemy import inspect, table, column, DateTime, Integer, Float
+from datetime import datetime, timedelta
 
 db = SQLAlchemy()
 
+DB_POOL = Gauge('db_pool_connections', 'Connections of the database pool by state.', ['state'])
+
 class Weights(db.Model):
     __tablename__ = 'weights'
     timestamp = db.Column(db.DateTime, primary_key=True, default=datetime.now)
@@ -39,24 +44,162 @@ class AlarmStatus(db.Model):
     __tablename__ = 'alarm_status'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     is_active = db.Column(db.Boolean, nullable=False, default=True)
+    sensor_id = db.Column(db.Integer, unique=True)
+    state = db.Column(db.String(20))
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+class SensorStatusEvents(db.Model):
+    __tablename__ = 'sensor_status_events'
+    timestamp = db.Column(db.DateTime, primary_key=True, default=datetime.now)
+    sensor_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(10), nullable=False)
+    last_seen = db.Column(db.DateTime)
+
+class ReportRuns(db.Model):
+    __tablename__ = 'report_runs'
+    period_start = db.Column(db.DateTime, primary_key=True)
+    sent_at = db.Column(db.DateTime, default=datetime.now)
+
+
+# Continuous aggregates of the weights hypertable, created by setup_continuous_aggregates
+WeightsPerMinute = table(
+    'weights_1m',
+    column('bucket', DateTime),
+    column('sensor_id', Integer),
+    column('min_value', Float),
+    column('max_value', Float),
+    column('avg_value', Float),
+    column('samples', Integer),
+)
+
+WeightsPerHour = table(
+    'weights_1h',
+    column('bucket', DateTime),
+    column('sensor_id', Integer),
+    column('min_value', Float),
+    column('max_value', Float),
+    column('avg_value', Float),
+    column('samples', Integer),
+)
+
+WEIGHT_ROLLUPS = [
+    (timedelta(hours=1), WeightsPerHour),
+    (timedelta(minutes=1), WeightsPerMinute),
+]
+
+def select_weight_rollup(resolution, continuous_aggregates=True):
+    """
+    Selects the coarsest continuous aggregate that still provides the requested resolution.
+
+    An aggregate only fits if the resolution is a whole multiple of its
+    bucket, otherwise its buckets would straddle the requested ones and be
+    counted in the wrong one; a 90-minute resolution therefore uses the
+    1-minute aggregate, not the 1-hour one.
+
+    Args:
+        resolution (timedelta): The time between two points the caller needs.
+        continuous_aggregates (bool): Whether the storage backend has the aggregates.
+
+    Returns:
+        tuple: The bucket width and the aggregate table, or (None, None) if the raw
+        `weights` table has to be used.
+    """
+    if not continuous_aggregates:
+        return None, None
+    for bucket, rollup in WEIGHT_ROLLUPS:
+        if resolution >= bucket and resolution % bucket == timedelta(0):
+            return bucket, rollup
+    return None, None
+
+
+def engine_options(config):
+    """
+    Returns the engine options for `SQLALCHEMY_ENGINE_OPTIONS` from the `database` section of config.yml.
+
+    Args:
+        config (Config): The configuration with the pool settings.
+
+    Returns:
+        dict: The keyword arguments for `create_engine`.
+    """
+    return {
+        'pool_size': config.DB_POOL_SIZE,
+        'max_overflow': config.DB_MAX_OVERFLOW,
+        'pool_timeout': config.DB_POOL_TIMEOUT,
+        'pool_recycle': config.DB_POOL_RECYCLE,
+        'pool_pre_ping': config.DB_POOL_PRE_PING,
+    }
+
+def register_pool_metrics(engine):
+    """
+    Exposes the size and usage of the connection pool of an engine as metrics.
 
+    Args:
+        engine: A SQLAlchemy engine object with a queue pool.
+    """
+    pool = engine.pool
+    DB_POOL.labels('size').set_function(pool.size)
+    DB_POOL.labels('checked_out').set_function(pool.checkedout)
+    DB_POOL.labels('checked_in').set_function(pool.checkedin)
+    DB_POOL.labels('overflow').set_function(pool.overflow)
 
-def init_db(app):
+def init_db(app, config=None):
     """
     Initialize the database with the given Flask application context.
     This function sets up the database by initializing the app with the database,
-    creating all database tables, and setting up hypertables.
+    creating all database tables and indexes and, with TimescaleDB, setting up
+    hypertables, continuous aggregates and the compression and retention policies.
     Args:
         app (Flask): The Flask application instance.
+        config (Config, optional): The configuration with the pool and TimescaleDB policy settings.
     Returns:
         None
     """
+    if config is not None:
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(config))
     with app.app_context():
         db.init_app(app)
+        storage = get_storage(db.engine)
+        storage.configure(db.engine)
+        register_pool_metrics(db.engine)
         db.create_all()
-        setup_hypertables(db.engine)
+        setup_indexes(db.engine)
+        migrate_alarm_status(db.engine)
+        if storage.timescale:
+            setup_hypertables(db.engine)
+            setup_continuous_aggregates(db.engine)
+            if config is not None:
+                setup_policies(db.engine, config)
         print("Datenbanktabellen wurden erfolgreich erstellt.")
 
+def migrate_alarm_status(engine):
+    """
+    Adds the per-sensor state columns to an `alarm_status` table created by an older version.
+
+    SQLite has no `ADD COLUMN IF NOT EXISTS`, so only the columns missing
+    from the table are added, on both backends.
+
+    Args:
+        engine: A SQLAlchemy engine object that allows connecting to the database.
+    """
+    inspector = inspect(engine)
+    existing = {column['name'] for column in inspector.get_columns('alarm_status')}
+    unique = [constraint['column_names'] for constraint in inspector.get_unique_constraints('alarm_status')] + [
+        index['column_names'] for index in inspector.get_indexes('alarm_status') if index['unique']
+    ]
+    columns = (
+        ('sensor_id', 'INTEGER'),
+        ('state', 'VARCHAR(20)'),
+        ('updated_at', 'TIMESTAMP WITHOUT TIME ZONE'),
+    )
+    execute_statements(engine, [
+        f"ALTER TABLE alarm_status ADD COLUMN {name} {column_type};"
+        for name, column_type in columns
+        if name not in existing
+    ] + ([] if ['sensor_id'] in unique else [
+        "CREATE UNIQUE INDEX IF NOT EXISTS alarm_status_sensor_id_key ON alarm_status (sensor_id);",
+    ]))
+
 def setup_hypertables(engine):
     """
     Converts specified tables to hypertables using the provided database engine.
@@ -72,8 +215,121 @@ def setup_hypertables(engine):
     """
     with engine.connect() as connection:
         try:
-            connection.execute(db.text("SELECT create_hypertable('weights', 'timestamp');"))
-            connection.execute(db.text("SELECT create_hypertable('alarms', 'timestamp');"))
+            connection.execute(db.text("SELECT create_hypertable('weights', 'timestamp', if_not_exists => TRUE);"))
+            connection.execute(db.text("SELECT create_hypertable('alarms', 'timestamp', if_not_exists => TRUE);"))
             connection.commit()
         except Exception as e:
-            connection.rollback()
\ No newline at end of file
+            connection.rollback()
+
+def setup_indexes(engine):
+    """
+    Creates the indexes for the readings, alarms and status events of a sensor.
+
+    The primary keys start with the timestamp; lookups by sensor, e.g. the
+    latest reading of each sensor in the sensor list, need the sensor first.
+
+    Args:
+        engine: A SQLAlchemy engine object that allows connecting to the database.
+    """
+    execute_statements(engine, [
+        "CREATE INDEX IF NOT EXISTS weights_sensor_id_timestamp_idx ON weights (sensor_id, timestamp DESC);",
+        "CREATE INDEX IF NOT EXISTS alarms_sensor_id_timestamp_idx ON alarms (sensor_id, timestamp DESC);",
+        "CREATE INDEX IF NOT EXISTS sensor_status_events_sensor_id_timestamp_idx "
+        "ON sensor_status_events (sensor_id, timestamp DESC);",
+    ])
+
+def execute_statements(engine, statements):
+    """
+    Executes DDL statements one by one outside of a transaction.
+
+    Continuous aggregates cannot be created inside a transaction block, and a
+    failing statement (e.g. because the setting already exists) must not
+    prevent the remaining ones.
+
+    Args:
+        engine: A SQLAlchemy engine object that allows connecting to the database.
+        statements (list): The SQL statements to execute.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for statement in statements:
+            try:
+                connection.execute(db.text(statement))
+            except Exception as e:
+                print(f"Datenbank-Anweisung fehlgeschlagen: {statement} - {e}")
+
+def setup_continuous_aggregates(engine):
+    """
+    Creates the per-sensor 1-minute and 1-hour continuous aggregates of the weights
+    hypertable and their refresh policies.
+
+    Args:
+        engine: A SQLAlchemy engine object that allows connecting to the database.
+
+    The aggregates keep min, max, average and number of samples per bucket and are
+    real-time aggregates, i.e. queries include the not yet materialized recent data.
+    """
+    statements = []
+    for view, bucket, start_offset, schedule in (
+        ('weights_1m', '1 minute', '1 hour', '1 minute'),
+        ('weights_1h', '1 hour', '1 day', '30 minutes'),
+    ):
+        statements += [
+            f"""
+            CREATE MATERIALIZED VIEW IF NOT EXISTS {view}
+            WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+            SELECT time_bucket(INTERVAL '{bucket}', timestamp) AS bucket,
+                   sensor_id,
+                   min(value) AS min_value,
+                   max(value) AS max_value,
+                   avg(value) AS avg_value,
+                   count(*) AS samples
+            FROM weights
+            GROUP BY bucket, sensor_id
+            WITH NO DATA;
+            """,
+            f"""
+            SELECT add_continuous_aggregate_policy('{view}',
+                start_offset => INTERVAL '{start_offset}',
+                end_offset => INTERVAL '{bucket}',
+                schedule_interval => INTERVAL '{schedule}',
+                if_not_exists => TRUE);
+            """,
+        ]
+    execute_statements(engine, statements)
+
+def setup_policies(engine, config):
+    """
+    Enables native compression of older chunks and adds the retention policies
+    configured in the `timescale` section of config.yml.
+
+    Args:
+        engine: A SQLAlchemy engine object that allows connecting to the database.
+        config (Config): The configuration with the policy intervals. An interval of
+            None disables the corresponding policy.
+    """
+    statements = []
+    for hypertable, compress_after in (
+        ('weights', config.TIMESCALE_WEIGHTS_COMPRESS_AFTER),
+        ('alarms', config.TIMESCALE_ALARMS_COMPRESS_AFTER),
+    ):
+        if compress_after:
+            statements += [
+                f"""
+                ALTER TABLE {hypertable} SET (
+                    timescaledb.compress,
+                    timescaledb.compress_segmentby = 'sensor_id',
+                    timescaledb.compress_orderby = 'timestamp DESC');
+                """,
+                f"SELECT add_compression_policy('{hypertable}', INTERVAL '{compress_after}', if_not_exists => TRUE);",
+            ]
+    for relation, drop_after in (
+        ('weights', config.TIMESCALE_WEIGHTS_RETENTION),
+        ('alarms', config.TIMESCALE_ALARMS_RETENTION),
+        ('weights_1m', config.TIMESCALE_WEIGHTS_1M_RETENTION),
+        ('weights_1h', config.TIMESCALE_WEIGHTS_1H_RETENTION),
+    ):
+        if drop_after:
+            statements.append(
+                f"SELECT add_retention_policy('{relation}', INTERVAL '{drop_after}', if_not_exists => TRUE);"
+            )
+    execute_statements(engine, statements)
@@ -0,0 +1,140 @@
+import paho.mqtt.client as mqtt
+from metrics import Histogram
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PUBLISH_SECONDS = Histogram('mqtt_publish_seconds', 'Duration of MQTT publishes including the wait for the acknowledgement.', ['wait'])
+
+_shared_publisher = None
+_shared_lock = threading.Lock()
+
+
+class MqttPublisher:
+    """
+    Long-lived, thread-safe MQTT client for publishing messages.
+
+    The connection is opened on first use and kept open by paho's background
+    network loop, which also reconnects automatically after a connection loss.
+    QoS 1 messages can be published with `wait=True` to block until the
+    broker acknowledged them.
+    """
+
+    def __init__(self, broker, port, username=None, password=None, client_id="", keepalive=60, timeout=5.0):
+        """
+        Initializes the publisher without connecting.
+
+        Args:
+            broker (str): The MQTT broker address.
+            port (int): The MQTT broker port.
+            username (str, optional): The MQTT username.
+            password (str, optional): The MQTT password.
+            client_id (str): The MQTT client ID, a random one is used if empty.
+            keepalive (int): The keepalive interval in seconds.
+            timeout (float): Seconds `publish` waits for the connection and the acknowledgement.
+        """
+        self.broker = broker
+        self.port = port
+        self.keepalive = keepalive
+        self.timeout = timeout
+
+        self._client = mqtt.Client(client_id=client_id)
+        if username:
+            self._client.username_pw_set(username, password)
+        self._client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self._client.on_connect = self._on_connect
+        self._client.on_disconnect = self._on_disconnect
+        self._connected = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    def start(self):
+        """
+        Connects to the broker and starts the background network loop once.
+        """
+        with self._lock:
+            if self._started:
+                return
+            self._client.connect_async(self.broker, self.port, self.keepalive)
+            self._client.loop_start()
+            self._started = True
+
+    def publish(self, topic, payload, qos=1, retain=False, wait=True):
+        """
+        Publishes a message.
+
+        Args:
+            topic (str): The topic of the message.
+            payload (str | bytes | int | float): The payload of the message.
+            qos (int): The quality of service level.
+            retain (bool): Whether the broker retains the message.
+            wait (bool): Whether to block until the broker acknowledged the message.
+
+        Returns:
+            mqtt.MQTTMessageInfo: The info object of the published message.
+
+        Raises:
+            ConnectionError: If `wait` is set and the broker is not reachable.
+            TimeoutError: If `wait` is set and the message was not acknowledged in time.
+        """
+        self.start()
+        with PUBLISH_SECONDS.labels(wait).time():
+            deadline = time.monotonic() + self.timeout
+            if wait and not self._connected.wait(self.timeout):
+                raise ConnectionError(f"MQTT broker {self.broker}:{self.port} not reachable")
+            info = self._client.publish(topic, payload, qos=qos, retain=retain)
+            if wait:
+                info.wait_for_publish(max(0, deadline - time.monotonic()))
+                if not info.is_published():
+                    raise TimeoutError(f"Publishing to {topic} was not acknowledged")
+        return info
+
+    def close(self):
+        """
+        Disconnects from the broker and stops the network loop.
+        """
+        with self._lock:
+            if not self._started:
+                return
+            self._client.disconnect()
+            self._client.loop_stop()
+            self._started = False
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            self._connected.set()
+            logger.info(f"Publisher connected to {self.broker}:{self.port}")
+        else:
+            logger.error(f"Publisher connect failed with code {rc}")
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._connected.clear()
+        logger.info(f"Publisher disconnected with result code {rc}")
+
+
+def get_publisher(config):
+    """
+    Returns the publisher shared by the web app and the control server of this process.
+
+    Args:
+        config (Config): The configuration with the MQTT settings.
+
+    Returns:
+        MqttPublisher: The shared publisher.
+    """
+    global _shared_publisher
+    with _shared_lock:
+        if _shared_publisher is None:
+            _shared_publisher = MqttPublisher(
+                config.MQTT_BROKER,
+                config.MQTT_PORT,
+                config.MQTT_USERNAME,
+                config.MQTT_PASSWORD
+            )
+        return _shared_publisher
@@ -0,0 +1,178 @@
+from email_server import SMTPSession
+from metrics import Histogram
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SEND_SECONDS = Histogram('notification_send_seconds', 'Duration of e-mail deliveries.', ['result'])
+
+
+class Notification:
+    """
+    A single e-mail notification for all recipients of a sensor.
+    """
+
+    def __init__(self, sensor_id, subject, body, recipients, html_table=None):
+        self.sensor_id = sensor_id
+        self.subject = subject
+        self.body = body
+        self.recipients = list(recipients)
+        self.html_table = html_table
+        self.attempts = 0
+
+    @property
+    def key(self):
+        return (self.sensor_id, self.subject)
+
+
+class NotificationDispatcher:
+    """
+    Sends e-mail notifications from background worker threads.
+
+    `notify` only enqueues and never blocks the MQTT message loop. Each worker
+    keeps its own authenticated SMTP session open between messages and sends
+    one message to all recipients of a notification. Failed deliveries are
+    retried with exponential backoff. While a notification for a sensor and
+    subject is still waiting in the queue, further notifications with the same
+    key are coalesced into it instead of producing another e-mail.
+    """
+
+    def __init__(self, email_sender, workers=2, max_queue=1000, max_retries=3, retry_backoff=2.0, idle_timeout=60):
+        """
+        Initializes the dispatcher and starts the worker threads.
+
+        Args:
+            email_sender (EmailSender): Provides the SMTP connection settings.
+            workers (int): Number of worker threads, each with its own SMTP session.
+            max_queue (int): Maximum number of queued notifications.
+            max_retries (int): Number of retries after a failed delivery.
+            retry_backoff (float): Delay in seconds before the first retry, doubled for each further retry.
+            idle_timeout (float): Seconds after which an unused SMTP session is closed.
+        """
+        self.email_sender = email_sender
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.idle_timeout = idle_timeout
+
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._queued = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._workers = [
+            threading.Thread(target=self._run, name=f"notification-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def notify(self, sensor_id, subject, body, recipients, html_table=None):
+        """
+        Queues a notification.
+
+        Args:
+            sensor_id (int): The ID of the sensor the notification is about.
+            subject (str): The subject of the e-mail.
+            body (str): The plain-text body of the e-mail.
+            recipients (list): The e-mail addresses of the recipients.
+            html_table (str, optional): HTML appended to the body.
+
+        Returns:
+            bool: True if a new notification was queued, False if it was coalesced or dropped.
+        """
+        if not recipients:
+            return False
+        notification = Notification(sensor_id, subject, body, recipients, html_table)
+        with self._lock:
+            queued = self._queued.get(notification.key)
+            if queued is not None:
+                queued.body = body
+                queued.recipients = notification.recipients
+                queued.html_table = html_table
+                self.coalesced += 1
+                return False
+            try:
+                self._queue.put_nowait(notification)
+            except queue.Full:
+                self.dropped += 1
+                logger.error(f"Notification queue full, dropping '{subject}' for sensor_id {sensor_id}.")
+                return False
+            self._queued[notification.key] = notification
+        return True
+
+    def alive(self):
+        return all(worker.is_alive() for worker in self._workers)
+
+    def close(self, timeout=30):
+        """
+        Sends all queued notifications and stops the workers.
+
+        Args:
+            timeout (float): Seconds to wait for each worker.
+        """
+        self._stopping.set()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def stats(self):
+        """
+        Returns the delivery counters of the dispatcher.
+
+        Returns:
+            dict: The number of sent, failed, coalesced, dropped and queued notifications.
+        """
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize(),
+        }
+
+    def _run(self):
+        session = SMTPSession(self.email_sender, idle_timeout=self.idle_timeout)
+        try:
+            while True:
+                try:
+                    notification = self._queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    session.close_if_idle()
+                    continue
+                if notification is None:
+                    return
+                with self._lock:
+                    self._queued.pop(notification.key, None)
+                self._deliver(session, notification)
+        finally:
+            session.close()
+
+    def _deliver(self, session, notification):
+        while True:
+            started = time.perf_counter()
+            try:
+                session.send(notification.recipients, notification.subject, notification.body, notification.html_table)
+                SEND_SECONDS.labels('success').observe(time.perf_counter() - started)
+                self.sent += 1
+                logger.info(f"Sent '{notification.subject}' for sensor_id {notification.sensor_id} to {len(notification.recipients)} recipients.")
+                return
+            except Exception as e:
+                SEND_SECONDS.labels('error').observe(time.perf_counter() - started)
+                notification.attempts += 1
+                if notification.attempts > self.max_retries:
+                    self.failed += 1
+                    logger.error(f"Giving up on '{notification.subject}' for sensor_id {notification.sensor_id}: {e}")
+                    return
+                delay = self.retry_backoff * 2 ** (notification.attempts - 1)
+                logger.warning(f"Failed to send '{notification.subject}' for sensor_id {notification.sensor_id}, retrying in {delay}s: {e}")
+                if self._stopping.wait(delay):
+                    # Shutting down: one last attempt without further waiting
+                    notification.attempts = self.max_retries
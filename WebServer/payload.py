@@ -0,0 +1,175 @@
+"""
+Decoding of the weight payloads published by the mailboxes.
+
+Two formats are accepted:
+
+- Legacy: one reading as ASCII float on `mailbox/<id>/weight`, timestamped
+  with the time of reception.
+- Batch v1: several timestamped readings in one binary message on
+  `mailbox/<id>/weights`. All integers are little-endian:
+
+      header   version (uint8) = 1, flags (uint8) = 0, count (uint16),
+               sequence (uint32), base time in ms since the Unix epoch (uint64)
+      reading  offset from the base time in ms (uint32), weight (float32)
+
+  The sequence number starts at 0 when the device boots and increases by one
+  per message, which lets the server detect lost and redelivered batches; a
+  redelivered batch repeats both the sequence number and the base time.
+"""
+from collections import deque
+from datetime import datetime
+import struct
+
+BATCH_VERSION = 1
+HEADER = struct.Struct('<BBHIQ')
+READING = struct.Struct('<If')
+
+# Device clocks further off than this are considered unsynchronized
+MAX_CLOCK_SKEW_SECONDS = 24 * 60 * 60
+
+
+class PayloadError(ValueError):
+    """
+    Raised for payloads that cannot be decoded.
+    """
+
+
+def decode_legacy(payload, received_at=None):
+    """
+    Decodes a legacy plain-float reading.
+
+    Args:
+        payload (bytes | str): The ASCII float.
+        received_at (datetime, optional): The time of reception. Defaults to now.
+
+    Returns:
+        list: A single (timestamp, weight) tuple.
+    """
+    try:
+        return [(received_at or datetime.now(), float(payload))]
+    except ValueError as e:
+        raise PayloadError(f"Invalid weight payload: {payload!r}") from e
+
+
+def decode_batch(payload, received_at=None):
+    """
+    Decodes a binary batch of readings.
+
+    If the device clock is not synchronized (e.g. NTP not yet available), the
+    readings are rebased so that the newest one has the time of reception.
+
+    Args:
+        payload (bytes): The binary batch.
+        received_at (datetime, optional): The time of reception. Defaults to now.
+
+    Returns:
+        tuple: The sequence number, the base time of the device in ms and a
+        list of (timestamp, weight) tuples, oldest first.
+    """
+    received_at = received_at or datetime.now()
+    if len(payload) < HEADER.size:
+        raise PayloadError(f"Batch payload too short: {len(payload)} bytes")
+    version, _, count, sequence, device_ms = HEADER.unpack_from(payload)
+    if version != BATCH_VERSION:
+        raise PayloadError(f"Unsupported batch version: {version}")
+    if len(payload) != HEADER.size + count * READING.size:
+        raise PayloadError(f"Batch payload of {len(payload)} bytes does not hold {count} readings")
+
+    readings = list(READING.iter_unpack(payload[HEADER.size:]))
+    if not readings:
+        return sequence, device_ms, []
+    base_ms = device_ms
+    received_ms = received_at.timestamp() * 1000
+    newest_ms = base_ms + max(offset for offset, _ in readings)
+    if abs(received_ms - newest_ms) > MAX_CLOCK_SKEW_SECONDS * 1000:
+        base_ms = received_ms - (newest_ms - base_ms)
+    return sequence, device_ms, [
+        (datetime.fromtimestamp((base_ms + offset) / 1000), weight)
+        for offset, weight in sorted(readings)
+    ]
+
+
+def encode_batch(sequence, readings):
+    """
+    Encodes readings as a binary batch, e.g. for simulated mailboxes.
+
+    Args:
+        sequence (int): The sequence number of the message.
+        readings (list): (timestamp, weight) tuples with datetime timestamps.
+
+    Returns:
+        bytes: The binary batch.
+    """
+    if not readings:
+        return HEADER.pack(BATCH_VERSION, 0, 0, sequence, 0)
+    base_ms = int(min(timestamp for timestamp, _ in readings).timestamp() * 1000)
+    body = b''.join(
+        READING.pack(int(timestamp.timestamp() * 1000) - base_ms, weight)
+        for timestamp, weight in readings
+    )
+    return HEADER.pack(BATCH_VERSION, 0, len(readings), sequence & 0xFFFFFFFF, base_ms) + body
+
+
+class SequenceTracker:
+    """
+    Tracks the batch sequence number of each sensor.
+
+    Only an exact repeat of the sequence number and base time of one of the
+    recent batches is a duplicate, e.g. a QoS 1 redelivery. A sequence number
+    that jumps back or far ahead, or a base time earlier than the one of the
+    last batch, is a device restart, even if the first batches after the
+    restart were lost.
+
+    All batches of a sensor are handled on the same dispatcher worker, so no
+    locking is needed per sensor.
+    """
+
+    def __init__(self, restart_window=1000, history=64):
+        """
+        Initializes the tracker.
+
+        Args:
+            restart_window (int): Sequence numbers further ahead of the last one are taken as a device restart.
+            history (int): Number of recent batches per sensor a redelivery is recognized from.
+        """
+        self.restart_window = restart_window
+        self.history = history
+        self._last = {}
+        self._recent = {}
+
+    def check(self, sensor_id, sequence, base_time):
+        """
+        Records a batch and classifies it.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+            sequence (int): The sequence number of the batch.
+            base_time (int): The base time of the batch as sent by the device.
+
+        Returns:
+            str: 'first', 'ok', 'gap', 'duplicate' or 'restart'.
+        """
+        recent = self._recent.get(sensor_id)
+        if recent is None:
+            recent = self._recent[sensor_id] = deque(maxlen=self.history)
+        if (sequence, base_time) in recent:
+            return 'duplicate'
+        last = self._last.get(sensor_id)
+        if last is None:
+            state = 'first'
+        else:
+            last_sequence, last_time = last
+            delta = (sequence - last_sequence) & 0xFFFFFFFF
+            if base_time < last_time:
+                state = 'restart'
+            elif delta == 1:
+                state = 'ok'
+            elif 1 < delta <= self.restart_window:
+                state = 'gap'
+            else:
+                state = 'restart'
+        if state == 'restart':
+            recent.clear()
+        recent.append((sequence, base_time))
+        self._last[sensor_id] = (sequence, base_time)
+        return state
@@ -0,0 +1,196 @@
+"""
+On-demand profiling of a running process.
+
+`sample_stacks` is a sampling profiler over all threads: every `interval`
+seconds it reads the current frame of each thread from
+`sys._current_frames()`, without tracing hooks, so the profiled threads run
+at full speed. The result is in the collapsed-stack format
+
+    thread;outer function (file:line);...;inner function (file:line) samples
+
+that flamegraph.pl, speedscope or inferno turn into a flame graph.
+
+`SlowEventLog` keeps the per-stage timings of the sensor events that took
+longer than a threshold, e.g. to tell whether a slow event waited for the
+database, the configuration or the e-mail queue.
+
+Both are served only to requests with the admin token of the `profiling`
+section of config.yml, see `authorized`.
+"""
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """
+    Raised when a profile is requested while another one is still running.
+    """
+
+
+def authorized(authorization, token):
+    """
+    Checks the `Authorization` header of a profiling request.
+
+    Args:
+        authorization (str): The header value, e.g. 'Bearer <token>'.
+        token (str): The admin token; None rejects every request.
+
+    Returns:
+        bool: Whether the header carries the token.
+    """
+    if not token or not authorization:
+        return False
+    return hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+
+
+def sample_stacks(duration, interval=0.005):
+    """
+    Samples the stacks of all other threads of the process.
+
+    Only one profile runs at a time; the calling thread is blocked for `duration`.
+
+    Args:
+        duration (float): Seconds to sample.
+        interval (float): Seconds between two samples.
+
+    Returns:
+        str: The collapsed stacks, one line per distinct stack.
+
+    Raises:
+        ProfilerBusy: If another profile is running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy("Another profile is running.")
+    try:
+        own = threading.get_ident()
+        stacks = Counter()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                stacks[names.get(ident, str(ident)), tuple(reversed(codes))] += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+    return ''.join(
+        f"{';'.join([thread] + [_frame_name(code) for code in codes])} {count}\n"
+        for (thread, codes), count in stacks.most_common()
+    )
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+
+
+class SlowEventLog:
+    """
+    Records the stage timings of events slower than a threshold.
+
+    An event is traced with `trace` on the thread that handles it; the code
+    it calls wraps its stages in `stage`, which costs a thread-local lookup
+    when no event is traced. Stages of the same name add up, e.g. the e-mails
+    of several detections in one batch.
+    """
+
+    def __init__(self, threshold=0.25, size=200):
+        """
+        Initializes an empty log.
+
+        Args:
+            threshold (float): Seconds an event must take to be recorded, 0 disables tracing.
+            size (int): Number of slow events kept, the oldest are dropped.
+        """
+        self.threshold = threshold
+        self.slow = 0
+        self._entries = deque(maxlen=size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def configure(self, threshold, size):
+        """
+        Changes the threshold and the number of kept events, dropping the recorded ones.
+        """
+        with self._lock:
+            self.threshold = threshold
+            self._entries = deque(maxlen=size)
+
+    @contextmanager
+    def trace(self, event_type, sensor_id, queued=0.0):
+        """
+        Traces the handling of an event on the current thread.
+
+        Args:
+            event_type (str): The type of the event, e.g. 'weights'.
+            sensor_id (int): The ID of the sensor.
+            queued (float): Seconds the event waited before it was handled.
+        """
+        if not self.threshold:
+            yield
+            return
+        stages = self._local.stages = {}
+        if queued:
+            stages['queue'] = queued
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.stages = None
+            elapsed = time.perf_counter() - started + queued
+            if elapsed >= self.threshold:
+                self._record(event_type, sensor_id, elapsed, stages)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times a stage of the event traced on the current thread.
+
+        Args:
+            name (str): The name of the stage, e.g. 'db_write'.
+        """
+        stages = getattr(self._local, 'stages', None)
+        if stages is None:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            stages[name] = stages.get(name, 0.0) + time.perf_counter() - started
+
+    def entries(self):
+        """
+        Returns the recorded events, newest first.
+        """
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def _record(self, event_type, sensor_id, elapsed, stages):
+        entry = {
+            'timestamp': datetime.now().isoformat(),
+            'event_type': event_type,
+            'sensor_id': sensor_id,
+            'total_ms': round(elapsed * 1000, 3),
+            'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in stages.items()},
+        }
+        entry['stages_ms']['other'] = round(max(0.0, elapsed - sum(stages.values())) * 1000, 3)
+        with self._lock:
+            self.slow += 1
+            self._entries.append(entry)
+        logger.warning(f"Slow {event_type} event of sensor_id {sensor_id}: {entry['total_ms']} ms {entry['stages_ms']}")
@@ -0,0 +1,251 @@
+"""
+Replays stored weight readings through the package detection engine.
+
+Readings are read from the `weights` table or from a CSV file with the
+columns `sensor_id,timestamp,value` and run through the same detectors the
+control server uses, far faster than real time. With a labels file (columns
+`sensor_id,timestamp` of the actual package deliveries) every run reports
+detected, missed and false alerts, which makes it possible to tune the
+sensitivity and the detector before changing the live configuration.
+
+Readings stored by the deadband filter are a step series; `--resample`
+expands them to a regular grid again before the detection.
+
+Examples:
+    python replay.py --csv weights.csv --detector step --debounce 3
+    python replay.py --sensor 1 --start 2024-12-01 --labels packages.csv --sensitivity 20,50,100
+"""
+from configweb import Config
+from detection import DetectionEngine, create_detector, rolling_mean
+from baseline import RollingWindow
+from models import Weights, ThresholdSensitivity
+from sqlalchemy import create_engine, select
+from datetime import datetime
+import numpy as np
+import argparse
+import csv
+import time
+
+
+def load_csv(path):
+    """
+    Loads readings from a CSV file.
+
+    Args:
+        path (str): The file with the columns sensor_id, timestamp and value.
+
+    Returns:
+        dict: Sensor ID mapped to the times in seconds and the weights, sorted by time.
+    """
+    readings = {}
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            timestamp = datetime.fromisoformat(row['timestamp']).timestamp()
+            readings.setdefault(int(row['sensor_id']), []).append((timestamp, float(row['value'])))
+    return {sensor_id: _to_arrays(rows) for sensor_id, rows in readings.items()}
+
+
+def load_database(engine, sensor_ids=None, start=None, end=None):
+    """
+    Loads readings from the `weights` table.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The database engine.
+        sensor_ids (list, optional): Only load these sensors.
+        start (datetime, optional): The inclusive start of the range.
+        end (datetime, optional): The exclusive end of the range.
+
+    Returns:
+        dict: Sensor ID mapped to the times in seconds and the weights, sorted by time.
+    """
+    query = select(Weights.sensor_id, Weights.timestamp, Weights.value).order_by(Weights.sensor_id, Weights.timestamp)
+    if sensor_ids:
+        query = query.where(Weights.sensor_id.in_(sensor_ids))
+    if start:
+        query = query.where(Weights.timestamp >= start)
+    if end:
+        query = query.where(Weights.timestamp < end)
+    readings = {}
+    with engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=10000).execute(query)
+        for sensor_id, timestamp, value in result:
+            readings.setdefault(sensor_id, []).append((timestamp.timestamp(), value))
+    return {sensor_id: _to_arrays(rows) for sensor_id, rows in readings.items()}
+
+
+def load_sensitivities(engine):
+    """
+    Loads the configured threshold sensitivity of every sensor.
+    """
+    with engine.connect() as connection:
+        return dict(connection.execute(select(ThresholdSensitivity.sensor_id, ThresholdSensitivity.value)).all())
+
+
+def load_labels(path):
+    """
+    Loads the actual package deliveries.
+
+    Args:
+        path (str): The file with the columns sensor_id and timestamp.
+
+    Returns:
+        dict: Sensor ID mapped to the delivery times in seconds, sorted.
+    """
+    labels = {}
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            labels.setdefault(int(row['sensor_id']), []).append(datetime.fromisoformat(row['timestamp']).timestamp())
+    return {sensor_id: np.sort(np.array(times)) for sensor_id, times in labels.items()}
+
+
+def _to_arrays(rows):
+    rows.sort()
+    times = np.array([row[0] for row in rows])
+    weights = np.array([row[1] for row in rows], dtype=float)
+    return times, weights
+
+
+def resample(times, weights, interval):
+    """
+    Expands a step series to a regular grid by carrying the last value forward.
+    """
+    grid = np.arange(times[0], times[-1] + interval / 2, interval)
+    return grid, weights[np.searchsorted(times, grid, side='right') - 1]
+
+
+def compute_baselines(times, weights, window_seconds, statistic, trim_fraction):
+    """
+    Computes the baseline at every reading like `baseline.BaselineTracker` does.
+
+    The mean is computed vectorized, the robust statistics fall back to a
+    rolling window.
+    """
+    if statistic == 'mean':
+        return rolling_mean(times, weights, window_seconds)
+    window = RollingWindow(window_seconds, statistic, trim_fraction)
+    baselines = np.empty(len(weights))
+    for i, (timestamp, weight) in enumerate(zip(times, weights)):
+        window.add(datetime.fromtimestamp(timestamp), weight)
+        baselines[i] = window.value()
+    return baselines
+
+
+def score(detections, labels, tolerance):
+    """
+    Matches detections to the actual deliveries of a sensor.
+
+    A delivery counts as detected if a detection follows within `tolerance`
+    seconds; every further detection is a false alert.
+
+    Returns:
+        tuple: The number of detected deliveries, missed deliveries and false alerts.
+    """
+    detections = np.sort(np.asarray(detections, dtype=float))
+    labels = np.asarray(labels, dtype=float)
+    if not len(detections):
+        return 0, len(labels), 0
+    first = np.searchsorted(detections, labels, side='left')
+    hit = (first < len(detections)) & (detections[np.minimum(first, len(detections) - 1)] - labels <= tolerance)
+    detected = int(hit.sum())
+    return detected, len(labels) - detected, len(detections) - len(set(first[hit].tolist()))
+
+
+def replay(readings, detector, sensitivities, args, labels=None):
+    """
+    Runs the detector over all readings and prints the results.
+
+    Args:
+        readings (dict): Sensor ID mapped to the times and weights.
+        detector: The detector created by `detection.create_detector`.
+        sensitivities (callable): Returns the sensitivity of a sensor.
+        args (argparse.Namespace): The command line arguments.
+        labels (dict, optional): Sensor ID mapped to the actual delivery times.
+    """
+    engine = DetectionEngine(detector, settle_seconds=args.window)
+    batch = []
+    total = 0
+    for sensor_id, (times, weights) in readings.items():
+        if args.resample:
+            times, weights = resample(times, weights, args.resample)
+        baselines = compute_baselines(times, weights, args.window, args.statistic, args.trim_fraction)
+        batch.append((sensor_id, times, weights, baselines, sensitivities(sensor_id)))
+        total += len(weights)
+
+    started = time.perf_counter()
+    detections = engine.process_batch(batch)
+    elapsed = time.perf_counter() - started
+
+    by_sensor = {}
+    for detection in detections:
+        by_sensor.setdefault(detection.sensor_id, []).append(detection.timestamp)
+    span = sum(times[-1] - times[0] for _, times, _, _, _ in batch if len(times))
+    days = span / 86400 if span else None
+
+    summary = f"{detector.name}: {total} readings of {len(batch)} sensors in {elapsed * 1000:.1f} ms, {len(detections)} detections"
+    if days:
+        summary += f", {len(detections) / days:.2f} per sensor-day"
+    if labels is not None:
+        detected = missed = false_alerts = 0
+        for sensor_id in set(by_sensor) | set(labels):
+            result = score(by_sensor.get(sensor_id, []), labels.get(sensor_id, []), args.tolerance)
+            detected += result[0]
+            missed += result[1]
+            false_alerts += result[2]
+        summary += f", detected {detected}, missed {missed}, false alerts {false_alerts}"
+    print(summary)
+    if args.verbose:
+        for detection in detections:
+            print(f"  sensor {detection.sensor_id} at {datetime.fromtimestamp(detection.timestamp).isoformat()}: "
+                  f"{detection.weight:.1f} over baseline {detection.baseline:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--csv', help="read the readings from this CSV file instead of the database")
+    parser.add_argument('--db-uri', help="database URI, defaults to the one in config.yml")
+    parser.add_argument('--sensor', type=int, action='append', help="only replay this sensor, can be repeated")
+    parser.add_argument('--start', type=datetime.fromisoformat, help="start of the range as ISO 8601 timestamp")
+    parser.add_argument('--end', type=datetime.fromisoformat, help="end of the range as ISO 8601 timestamp")
+    parser.add_argument('--labels', help="CSV file with the actual deliveries (sensor_id,timestamp)")
+    parser.add_argument('--tolerance', type=float, default=60, help="seconds within which a delivery must be detected")
+    parser.add_argument('--resample', type=float, help="expand the step series to this interval in seconds")
+    parser.add_argument('--detector', default=None, help="threshold, step or cusum, defaults to the configured one")
+    parser.add_argument('--sensitivity', help="comma-separated sensitivities to compare, defaults to the stored ones")
+    parser.add_argument('--debounce', type=int, default=None)
+    parser.add_argument('--drift', type=float, default=None)
+    parser.add_argument('--threshold', type=float, default=None)
+    parser.add_argument('--verbose', action='store_true', help="print every detection")
+    args = parser.parse_args()
+
+    config = Config()
+    args.window = config.BASELINE_WINDOW_SECONDS
+    args.statistic = config.BASELINE_STATISTIC
+    args.trim_fraction = config.BASELINE_TRIM_FRACTION
+    detector = create_detector(
+        args.detector or config.DETECTION_ALGORITHM,
+        debounce=args.debounce if args.debounce is not None else config.DETECTION_DEBOUNCE,
+        drift=args.drift if args.drift is not None else config.DETECTION_CUSUM_DRIFT,
+        threshold=args.threshold if args.threshold is not None else config.DETECTION_CUSUM_THRESHOLD
+    )
+
+    engine = None
+    if args.csv:
+        readings = load_csv(args.csv)
+        if args.sensor:
+            readings = {sensor_id: value for sensor_id, value in readings.items() if sensor_id in args.sensor}
+    else:
+        engine = create_engine(args.db_uri or config.DB_URI)
+        readings = load_database(engine, args.sensor, args.start, args.end)
+    labels = load_labels(args.labels) if args.labels else None
+
+    if args.sensitivity:
+        for sensitivity in (float(value) for value in args.sensitivity.split(',')):
+            print(f"sensitivity {sensitivity}:", end=" ")
+            replay(readings, detector, lambda sensor_id: sensitivity, args, labels)
+    else:
+        stored = load_sensitivities(engine) if engine is not None else {}
+        replay(readings, detector, lambda sensor_id: stored.get(sensor_id, 50), args, labels)
+
+
+if __name__ == '__main__':
+    main()
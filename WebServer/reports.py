@@ -0,0 +1,396 @@
+"""
+Daily activity reports of the mailboxes.
+
+Once a day the report job sends every recipient a digest of the previous day
+with one row per mailbox: deliveries, alarms, uptime and the weight range.
+All numbers of all sensors come from a single query:
+
+- deliveries are the 1-minute buckets (the `weights_1m` continuous aggregate
+  with TimescaleDB, the raw readings otherwise) whose minimum weight rose by
+  more than the threshold sensitivity of the sensor compared to the bucket
+  before, found with `LAG`,
+- alarms are counted in `alarms`,
+- uptime is the part of the day not covered by an offline period of the
+  liveness watchdog in `sensor_status_events`, found with `LEAD`.
+
+The digests of all recipients are sent over one SMTP session. Each day is
+claimed in `report_runs` before it is sent, so several control servers or a
+restart never send a report twice.
+
+Example:
+    python reports.py --day 2024-12-01 --print
+"""
+from configweb import Config
+from email_server import EmailSender, SMTPSession
+from models import Alarms, ThresholdSensitivity, EmailNotification, SensorStatusEvents, ReportRuns
+from history import weight_bucket_source
+from storage import get_storage
+from watchdog import OFFLINE
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import create_engine, select, delete, func, case, literal, Float
+from collections import namedtuple
+from datetime import datetime, timedelta
+import argparse
+import html
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+BUCKET = timedelta(minutes=1)
+EPOCH = datetime(1970, 1, 1)
+
+SensorActivity = namedtuple('SensorActivity', [
+    'sensor_id', 'deliveries', 'alarms', 'uptime', 'min_weight', 'max_weight', 'email_addresses'
+])
+
+
+def query_activity(engine, start, end):
+    """
+    Computes the activity of all registered sensors in a period with one query.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The database engine.
+        start (datetime): The inclusive start of the period.
+        end (datetime): The exclusive end of the period.
+
+    Returns:
+        list: A `SensorActivity` tuple per sensor, ordered by sensor ID.
+    """
+    storage = get_storage(engine)
+    start_epoch = literal((start - EPOCH).total_seconds(), Float)
+    end_epoch = literal((end - EPOCH).total_seconds(), Float)
+
+    # The bucket before the period provides the LAG of the first bucket
+    source_time, sensor_column, (min_value, max_value, _) = weight_bucket_source(BUCKET, storage)
+    bucket_time = storage.time_bucket(BUCKET, source_time)
+    minutes = select(
+        sensor_column.label('sensor_id'),
+        bucket_time.label('bucket'),
+        min_value.label('min_value'),
+        max_value.label('max_value'),
+    ).where(
+        source_time >= start - BUCKET,
+        source_time < end,
+    ).group_by(sensor_column, bucket_time).cte('minutes')
+    steps = select(
+        minutes,
+        (minutes.c.min_value - func.lag(minutes.c.min_value).over(
+            partition_by=minutes.c.sensor_id, order_by=minutes.c.bucket
+        )).label('step'),
+    ).cte('steps')
+    weights = select(
+        steps.c.sensor_id,
+        func.sum(case((steps.c.step > func.coalesce(ThresholdSensitivity.value, 0), 1), else_=0)).label('deliveries'),
+        func.min(steps.c.min_value).label('min_weight'),
+        func.max(steps.c.max_value).label('max_weight'),
+    ).outerjoin(ThresholdSensitivity, ThresholdSensitivity.sensor_id == steps.c.sensor_id).where(
+        steps.c.bucket >= start
+    ).group_by(steps.c.sensor_id).subquery()
+
+    alarms = select(Alarms.sensor_id, func.count().label('alarms')).where(
+        Alarms.timestamp >= start,
+        Alarms.timestamp < end,
+    ).group_by(Alarms.sensor_id).subquery()
+
+    # Every status lasts until the next event of the sensor; offline periods are clipped to the period
+    transitions = select(
+        SensorStatusEvents.sensor_id,
+        SensorStatusEvents.status,
+        storage.epoch(SensorStatusEvents.timestamp).label('since'),
+        storage.epoch(func.lead(SensorStatusEvents.timestamp).over(
+            partition_by=SensorStatusEvents.sensor_id, order_by=SensorStatusEvents.timestamp
+        )).label('until'),
+    ).where(SensorStatusEvents.timestamp < end).cte('transitions')
+    until = func.coalesce(transitions.c.until, end_epoch)
+    offline = select(
+        transitions.c.sensor_id,
+        func.sum(
+            case((until > end_epoch, end_epoch), else_=until)
+            - case((transitions.c.since < start_epoch, start_epoch), else_=transitions.c.since)
+        ).label('offline_seconds'),
+    ).where(
+        transitions.c.status == OFFLINE,
+        until > start_epoch,
+    ).group_by(transitions.c.sensor_id).subquery()
+
+    recipients = select(
+        EmailNotification.sensor_id,
+        storage.array_agg(EmailNotification.email_address).label('email_addresses')
+    ).group_by(EmailNotification.sensor_id).subquery()
+
+    sensor_id = ThresholdSensitivity.sensor_id
+    query = select(
+        sensor_id,
+        weights.c.deliveries,
+        weights.c.min_weight,
+        weights.c.max_weight,
+        alarms.c.alarms,
+        offline.c.offline_seconds,
+        recipients.c.email_addresses,
+    ).outerjoin(weights, weights.c.sensor_id == sensor_id) \
+        .outerjoin(alarms, alarms.c.sensor_id == sensor_id) \
+        .outerjoin(offline, offline.c.sensor_id == sensor_id) \
+        .outerjoin(recipients, recipients.c.sensor_id == sensor_id) \
+        .order_by(sensor_id)
+
+    period = (end - start).total_seconds()
+    with engine.connect() as connection:
+        return [
+            SensorActivity(
+                sensor_id=row.sensor_id,
+                deliveries=int(row.deliveries or 0),
+                alarms=row.alarms or 0,
+                uptime=max(0.0, 1 - float(row.offline_seconds or 0) / period),
+                min_weight=row.min_weight,
+                max_weight=row.max_weight,
+                email_addresses=sorted(row.email_addresses or []),
+            )
+            for row in connection.execute(query)
+        ]
+
+
+def render_table(activities):
+    """
+    Renders the activity of sensors as HTML table for the `html_table` of an e-mail.
+
+    Args:
+        activities (list): `SensorActivity` tuples.
+
+    Returns:
+        str: The HTML table.
+    """
+    header = ''.join(
+        f"<th>{title}</th>"
+        for title in ('Mailbox', 'Deliveries', 'Alarms', 'Uptime', 'Min. weight', 'Max. weight')
+    )
+    rows = ''.join(
+        "<tr>"
+        f"<td>{html.escape(str(activity.sensor_id))}</td>"
+        f"<td>{activity.deliveries}</td>"
+        f"<td>{activity.alarms}</td>"
+        f"<td>{activity.uptime:.1%}</td>"
+        f"<td>{_format_weight(activity.min_weight)}</td>"
+        f"<td>{_format_weight(activity.max_weight)}</td>"
+        "</tr>"
+        for activity in activities
+    )
+    return f"<table border=\"1\" cellpadding=\"4\"><tr>{header}</tr>{rows}</table>"
+
+
+def _format_weight(weight):
+    return f"{weight:.1f}" if weight is not None else "-"
+
+
+def build_digests(activities, start):
+    """
+    Groups the activity of the sensors by recipient.
+
+    Args:
+        activities (list): `SensorActivity` tuples.
+        start (datetime): The start of the reported day.
+
+    Returns:
+        dict: The subject, plain-text body and HTML table by e-mail address.
+    """
+    by_recipient = {}
+    for activity in activities:
+        for address in activity.email_addresses:
+            by_recipient.setdefault(address, []).append(activity)
+
+    subject = f"DAILY REPORT {start.date().isoformat()}"
+    digests = {}
+    for address, sensor_activities in by_recipient.items():
+        lines = [
+            f"Mailbox {activity.sensor_id}: {activity.deliveries} deliveries, "
+            f"{activity.alarms} alarms, {activity.uptime:.1%} online"
+            for activity in sensor_activities
+        ]
+        digests[address] = (subject, f"Activity on {start.date().isoformat()}:\n" + "\n".join(lines),
+                            render_table(sensor_activities))
+    return digests
+
+
+def send_digests(email_sender, digests):
+    """
+    Sends the digests over a single SMTP session.
+
+    A failed digest is logged and does not stop the others.
+
+    Args:
+        email_sender (EmailSender): Provides the SMTP connection settings.
+        digests (dict): The result of `build_digests`.
+
+    Returns:
+        int: The number of sent digests.
+    """
+    session = SMTPSession(email_sender)
+    sent = 0
+    try:
+        for address, (subject, body, html_table) in digests.items():
+            try:
+                session.send([address], subject, body, html_table)
+                sent += 1
+            except Exception as e:
+                logger.error(f"Error sending the daily report to {address}: {e}")
+    finally:
+        session.close()
+    return sent
+
+
+def claim_report(engine, start):
+    """
+    Records that the report of a day is being sent.
+
+    Returns:
+        bool: False if the report was already claimed, e.g. by another control server.
+    """
+    with engine.begin() as connection:
+        result = connection.execute(
+            insert(ReportRuns).values(period_start=start, sent_at=datetime.now()).on_conflict_do_nothing()
+        )
+    return result.rowcount == 1
+
+
+def release_report(engine, start):
+    """
+    Removes the claim of a day whose report could not be sent.
+    """
+    with engine.begin() as connection:
+        connection.execute(delete(ReportRuns).where(ReportRuns.period_start == start))
+
+
+class ReportScheduler:
+    """
+    Sends the report of the previous day once a day at a fixed local time.
+
+    A report missed because the process was down at that time is sent on the
+    next start. A report that could not be sent, e.g. because the SMTP server
+    was unreachable, is retried the same day with a doubling delay.
+    """
+
+    def __init__(self, engine, email_sender, at='07:00', retry_backoff=60, max_retry_backoff=3600):
+        """
+        Initializes the scheduler without starting it.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): The database engine.
+            email_sender (EmailSender): Provides the SMTP connection settings.
+            at (str): The local time of day the reports are sent, e.g. '07:00'.
+            retry_backoff (float): Seconds before the first retry of a failed report.
+            max_retry_backoff (float): Upper bound of the delay between two retries.
+        """
+        self.engine = engine
+        self.email_sender = email_sender
+        self.at = datetime.strptime(at, '%H:%M').time()
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self.reported = None
+        self._retry = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="report-scheduler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def run(self, day):
+        """
+        Sends the report of a day unless it was already sent.
+
+        If the activity cannot be computed or none of the digests could be
+        sent, the claim is released again, so the report can be sent later,
+        e.g. by the next retry or with `python reports.py`.
+
+        Args:
+            day (date): The reported day.
+
+        Returns:
+            int: The number of sent digests.
+
+        Raises:
+            RuntimeError: If there were digests to send but none was sent.
+        """
+        start = datetime.combine(day, datetime.min.time())
+        if not claim_report(self.engine, start):
+            logger.info(f"Daily report of {day} was already sent.")
+            self.reported = day
+            return 0
+        try:
+            activities = query_activity(self.engine, start, start + timedelta(days=1))
+            digests = build_digests(activities, start)
+            sent = send_digests(self.email_sender, digests)
+        except Exception:
+            release_report(self.engine, start)
+            raise
+        if digests and not sent:
+            release_report(self.engine, start)
+            raise RuntimeError(f"None of the {len(digests)} digests could be sent.")
+        self.reported = day
+        logger.info(f"Sent the daily report of {day} for {len(activities)} sensors to {sent} recipients.")
+        return sent
+
+    def alive(self):
+        return self._thread.is_alive()
+
+    def close(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _seconds_until_due(self):
+        now = datetime.now()
+        due = datetime.combine(now.date(), self.at)
+        yesterday = now.date() - timedelta(days=1)
+        if now >= due and self.reported != yesterday:
+            if self._retry is not None and self._retry[0] == yesterday:
+                due = max(due, self._retry[1])
+            if now >= due:
+                return 0
+        elif now >= due:
+            due += timedelta(days=1)
+        # Wake up regularly so clock changes do not delay the report by hours
+        return min((due - now).total_seconds(), 300)
+
+    def _run(self):
+        while not self._stop.wait(self._seconds_until_due()):
+            if self._seconds_until_due():
+                continue
+            day = datetime.now().date() - timedelta(days=1)
+            try:
+                self.run(day)
+                self._retry = None
+            except Exception as e:
+                # (day, time of the next attempt, delay of the attempt after it)
+                delay = self._retry[2] if self._retry is not None and self._retry[0] == day else self.retry_backoff
+                retry_at = datetime.now() + timedelta(seconds=delay)
+                self._retry = (day, retry_at, min(delay * 2, self.max_retry_backoff))
+                logger.error(f"Error sending the daily report of {day}, retrying at {retry_at:%H:%M:%S}: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--day', type=lambda value: datetime.fromisoformat(value).date(),
+                        default=datetime.now().date() - timedelta(days=1), help="reported day, defaults to yesterday")
+    parser.add_argument('--db-uri', help="database URI, defaults to the one in config.yml")
+    parser.add_argument('--print', action='store_true', help="print the activity instead of sending e-mails")
+    args = parser.parse_args()
+
+    config = Config()
+    engine = create_engine(args.db_uri or config.DB_URI)
+    if args.print:
+        start = datetime.combine(args.day, datetime.min.time())
+        for activity in query_activity(engine, start, start + timedelta(days=1)):
+            print(activity)
+        return
+    email_sender = EmailSender(
+        config.EMAIL_SMTP_SERVER,
+        config.EMAIL_PORT,
+        config.EMAIL_USERNAME,
+        config.EMAIL_PASSWORD,
+        use_tls=config.EMAIL_USE_TLS
+    )
+    ReportScheduler(engine, email_sender, config.REPORTS_AT).run(args.day)
+
+
+if __name__ == '__main__':
+    main()
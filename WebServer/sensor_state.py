@@ -0,0 +1,181 @@
+from models import AlarmStatus, LowerThreshold
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import select
+from datetime import datetime
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+EMPTY = 'empty'
+PACKAGE_PRESENT = 'package_present'
+ARMED = 'armed'
+TRIGGERED = 'triggered'
+DISARMED = 'disarmed'
+STATES = (EMPTY, PACKAGE_PRESENT, ARMED, TRIGGERED, DISARMED)
+
+
+class SensorStateMachine:
+    """
+    Per-sensor state of the mailboxes.
+
+        empty / disarmed --package--> package_present --arm--> armed
+        armed --alarm--> triggered
+        any --disarm--> disarmed
+        disarmed / package_present --weight below lower threshold--> empty
+
+    The state decides whether an event causes a notification or a publish:
+    each transition returns True exactly once, repeated events in the same
+    state return False. A further package on top of an armed one is a new
+    transition, recognized by the higher lower threshold.
+
+    Every transition is written to `alarm_status` and the lower threshold
+    to `lower_threshold`, and the snapshots are loaded again on start, so a
+    restart neither re-alerts nor forgets an armed mailbox. Transitions are
+    rare compared to readings, so they are persisted synchronously.
+
+    Events of a sensor must be passed in order from a single thread, which
+    the sharded dispatcher guarantees.
+    """
+
+    def __init__(self, engine):
+        """
+        Initializes the state machine without any known sensor.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): The engine used to persist the snapshots.
+        """
+        self.engine = engine
+        self.transitions = 0
+        self._states = {}
+        self._lower_thresholds = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the persisted snapshots.
+
+        Returns:
+            int: The number of loaded sensors.
+        """
+        with self.engine.connect() as connection:
+            states = connection.execute(
+                select(AlarmStatus.sensor_id, AlarmStatus.state).where(AlarmStatus.sensor_id.is_not(None))
+            ).all()
+            lower_thresholds = connection.execute(select(LowerThreshold.sensor_id, LowerThreshold.value)).all()
+        self._states.update((sensor_id, state) for sensor_id, state in states if state in STATES)
+        self._lower_thresholds.update(lower_thresholds)
+        logger.info(f"Loaded the state of {len(self._states)} sensors.")
+        return len(self._states)
+
+    def state(self, sensor_id):
+        return self._states.get(sensor_id, EMPTY)
+
+    def counts(self):
+        """
+        Returns the number of sensors in each state.
+        """
+        with self._lock:
+            states = list(self._states.values())
+        return {state: states.count(state) for state in STATES}
+
+    def package_detected(self, sensor_id, lower_threshold):
+        """
+        Handles a detected package.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+            lower_threshold (float): The weight below which the package is gone.
+
+        Returns:
+            bool: True if the package is new and has to be notified.
+        """
+        state = self.state(sensor_id)
+        current = self._lower_thresholds.get(sensor_id)
+        if state in (PACKAGE_PRESENT, ARMED) and current is not None and lower_threshold <= current:
+            return False
+        self._transition(sensor_id, PACKAGE_PRESENT, lower_threshold)
+        return True
+
+    def armed(self, sensor_id):
+        """
+        Records that the alarm of the mailbox was armed with the current lower threshold.
+        """
+        if self.state(sensor_id) == PACKAGE_PRESENT:
+            self._transition(sensor_id, ARMED)
+
+    def alarm(self, sensor_id):
+        """
+        Handles an alarm reported by the mailbox.
+
+        Returns:
+            bool: True if the alarm is new and has to be notified.
+        """
+        if self.state(sensor_id) == TRIGGERED:
+            return False
+        self._transition(sensor_id, TRIGGERED)
+        return True
+
+    def disarm(self, sensor_id):
+        """
+        Handles the disarming of the alarm by the user.
+
+        Returns:
+            bool: True if the state changed.
+        """
+        if self.state(sensor_id) == DISARMED:
+            return False
+        self._transition(sensor_id, DISARMED)
+        return True
+
+    def weight(self, sensor_id, weight):
+        """
+        Handles a weight reading and detects that a package was taken out without alarm.
+
+        Returns:
+            bool: True if the mailbox became empty.
+        """
+        if self.state(sensor_id) not in (PACKAGE_PRESENT, DISARMED):
+            return False
+        lower_threshold = self._lower_thresholds.get(sensor_id)
+        if lower_threshold is None or weight >= lower_threshold:
+            return False
+        self._transition(sensor_id, EMPTY)
+        return True
+
+    def _transition(self, sensor_id, state, lower_threshold=None):
+        previous = self.state(sensor_id)
+        with self._lock:
+            self._states[sensor_id] = state
+            if lower_threshold is not None:
+                self._lower_thresholds[sensor_id] = lower_threshold
+        self.transitions += 1
+        logger.info(f"Sensor {sensor_id}: {previous} -> {state}")
+        try:
+            self._persist(sensor_id, state, lower_threshold)
+        except Exception as e:
+            logger.error(f"Error persisting the state of sensor_id {sensor_id}: {e}")
+
+    def _persist(self, sensor_id, state, lower_threshold):
+        status = insert(AlarmStatus).values(
+            sensor_id=sensor_id,
+            state=state,
+            is_active=state in (ARMED, TRIGGERED),
+            updated_at=datetime.now()
+        )
+        status = status.on_conflict_do_update(
+            index_elements=[AlarmStatus.sensor_id],
+            set_={
+                'state': status.excluded.state,
+                'is_active': status.excluded.is_active,
+                'updated_at': status.excluded.updated_at,
+            }
+        )
+        with self.engine.begin() as connection:
+            connection.execute(status)
+            if lower_threshold is not None:
+                threshold = insert(LowerThreshold).values(sensor_id=sensor_id, value=lower_threshold)
+                connection.execute(threshold.on_conflict_do_update(
+                    index_elements=[LowerThreshold.sensor_id],
+                    set_={'value': threshold.excluded.value}
+                ))
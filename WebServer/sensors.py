@@ -0,0 +1,167 @@
+from models import db, Weights, UpperThreshold, LowerThreshold, ThresholdSensitivity, EmailNotification, AlarmStatus
+from sqlalchemy.dialects.postgresql import insert
+from storage import get_storage
+from sqlalchemy import select, delete
+from numbers import Real
+
+SETTINGS = ('upper_threshold', 'threshold_sensitivity', 'email_addresses')
+
+
+def query_sensors(sensor_ids=None):
+    """
+    Lists the sensors with their settings, state and latest reading.
+
+    Everything is read with a single query: the latest reading of every
+    sensor comes from the index on (sensor_id, timestamp DESC), which
+    TimescaleDB answers with a skip scan of `DISTINCT ON (sensor_id)` instead
+    of reading all rows, and the recipients are aggregated per sensor.
+
+    Args:
+        sensor_ids (list, optional): Only list these sensors.
+
+    Returns:
+        dict: The sensors ordered by ID.
+    """
+    storage = get_storage(db.engine)
+    latest = storage.latest([Weights.sensor_id], Weights.timestamp, Weights.value)
+    recipients = select(
+        EmailNotification.sensor_id,
+        storage.array_agg(EmailNotification.email_address).label('email_addresses')
+    ).group_by(EmailNotification.sensor_id)
+    if sensor_ids:
+        latest = latest.where(Weights.sensor_id.in_(sensor_ids))
+        recipients = recipients.where(EmailNotification.sensor_id.in_(sensor_ids))
+    latest = latest.subquery()
+    recipients = recipients.subquery()
+
+    sensor_id = ThresholdSensitivity.sensor_id
+    query = select(
+        sensor_id,
+        ThresholdSensitivity.value.label('threshold_sensitivity'),
+        UpperThreshold.value.label('upper_threshold'),
+        LowerThreshold.value.label('lower_threshold'),
+        AlarmStatus.state,
+        AlarmStatus.updated_at,
+        latest.c.timestamp,
+        latest.c.value,
+        recipients.c.email_addresses,
+    ).outerjoin(UpperThreshold, UpperThreshold.sensor_id == sensor_id) \
+        .outerjoin(LowerThreshold, LowerThreshold.sensor_id == sensor_id) \
+        .outerjoin(AlarmStatus, AlarmStatus.sensor_id == sensor_id) \
+        .outerjoin(latest, latest.c.sensor_id == sensor_id) \
+        .outerjoin(recipients, recipients.c.sensor_id == sensor_id) \
+        .order_by(sensor_id)
+    if sensor_ids:
+        query = query.where(sensor_id.in_(sensor_ids))
+
+    return {'sensors': [
+        {
+            'sensor_id': row.sensor_id,
+            'state': row.state or 'empty',
+            'state_since': row.updated_at.isoformat() if row.updated_at else None,
+            'threshold_sensitivity': row.threshold_sensitivity,
+            'upper_threshold': row.upper_threshold,
+            'lower_threshold': row.lower_threshold,
+            'email_addresses': sorted(row.email_addresses or []),
+            'last_reading': {
+                'timestamp': row.timestamp.isoformat(),
+                'value': row.value,
+            } if row.timestamp else None,
+        }
+        for row in db.session.execute(query)
+    ]}
+
+
+def parse_settings(entries):
+    """
+    Validates settings updates of a JSON request body.
+
+    Args:
+        entries (list): Dicts with a `sensor_id` and any of `upper_threshold`,
+            `threshold_sensitivity` and `email_addresses`.
+
+    Returns:
+        list: The validated updates.
+
+    Raises:
+        ValueError: If an update is malformed.
+    """
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("expected a non-empty list of updates")
+    updates = []
+    seen = set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError("every update must be an object")
+        sensor_id = entry.get('sensor_id')
+        if not isinstance(sensor_id, int) or isinstance(sensor_id, bool) or sensor_id <= 0:
+            raise ValueError("sensor_id must be a positive integer")
+        if sensor_id in seen:
+            raise ValueError(f"sensor {sensor_id} is updated twice")
+        seen.add(sensor_id)
+        unknown = set(entry) - set(SETTINGS) - {'sensor_id'}
+        if unknown:
+            raise ValueError(f"unknown settings: {', '.join(sorted(unknown))}")
+        if not set(entry) & set(SETTINGS):
+            raise ValueError(f"no settings given for sensor {sensor_id}")
+        for name in ('upper_threshold', 'threshold_sensitivity'):
+            value = entry.get(name)
+            if name in entry and (not isinstance(value, Real) or isinstance(value, bool) or value < 0):
+                raise ValueError(f"{name} of sensor {sensor_id} must be a non-negative number")
+        addresses = entry.get('email_addresses')
+        if 'email_addresses' in entry and (
+            not isinstance(addresses, list)
+            or not all(isinstance(address, str) and '@' in address for address in addresses)
+        ):
+            raise ValueError(f"email_addresses of sensor {sensor_id} must be a list of e-mail addresses")
+        updates.append(entry)
+    return updates
+
+
+def update_sensor_settings(updates):
+    """
+    Applies the settings of many sensors in one transaction.
+
+    Thresholds are upserted with one multi-row statement per table;
+    `email_addresses` replaces all recipients of a sensor.
+
+    Args:
+        updates (list): The updates returned by `parse_settings`.
+
+    Returns:
+        list: The IDs of the updated sensors.
+    """
+    upper_thresholds = [
+        {'sensor_id': update['sensor_id'], 'value': update['upper_threshold']}
+        for update in updates if 'upper_threshold' in update
+    ]
+    sensitivities = [
+        {'sensor_id': update['sensor_id'], 'value': update['threshold_sensitivity']}
+        for update in updates if 'threshold_sensitivity' in update
+    ]
+    recipients = {
+        update['sensor_id']: set(update['email_addresses'])
+        for update in updates if 'email_addresses' in update
+    }
+    try:
+        for model, rows in ((UpperThreshold, upper_thresholds), (ThresholdSensitivity, sensitivities)):
+            if rows:
+                statement = insert(model).values(rows)
+                db.session.execute(statement.on_conflict_do_update(
+                    index_elements=[model.sensor_id],
+                    set_={'value': statement.excluded.value}
+                ))
+        if recipients:
+            db.session.execute(delete(EmailNotification).where(EmailNotification.sensor_id.in_(recipients)))
+            rows = [
+                {'sensor_id': sensor_id, 'email_address': address}
+                for sensor_id, addresses in recipients.items()
+                for address in sorted(addresses)
+            ]
+            if rows:
+                db.session.execute(insert(EmailNotification).values(rows))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return [update['sensor_id'] for update in updates]
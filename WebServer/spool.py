@@ -0,0 +1,217 @@
+"""
+Durable spool for weight readings the database could not take.
+
+When a bulk insert of the weight buffer fails, e.g. because Postgres is
+down, or the buffer is full because the database is too slow, the readings
+are appended to segment files on local disk instead of being dropped. As soon
+as the database accepts writes again the flush thread replays them in bulk,
+oldest first.
+
+Readings are stored as fixed-size little-endian records
+
+    sensor_id (uint32), unix time (float64), weight (float64)
+
+so a record torn by a crash is detected by the file size and cut off on the
+next start. Segments are deleted once replayed. The spool is bounded by
+`max_bytes`: when it is full the oldest segment is evicted, which keeps the
+most recent readings of a long outage.
+
+Replaying the same readings twice is harmless, the insert ignores rows whose
+(timestamp, sensor_id) already exists.
+"""
+from datetime import datetime
+import logging
+import os
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+RECORD = struct.Struct('<Idd')
+MAX_SENSOR_ID = 2 ** 32 - 1
+SEGMENT_SUFFIX = '.seg'
+
+
+class Spool:
+    """
+    Append-only segment files holding (sensor_id, timestamp, weight) readings.
+
+    Thread-safe: readings may be appended from any thread while the flush
+    thread replays them.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, segment_bytes=16 * 1024 * 1024, fsync=True):
+        """
+        Opens the spool and recovers the segments left by a previous run.
+
+        Args:
+            directory (str): The directory of the segment files, created if missing.
+            max_bytes (int): Disk space the spool may use before the oldest segment is evicted.
+            segment_bytes (int): Size after which a new segment is started.
+            fsync (bool): Whether `append` waits until the readings are on disk.
+
+        Raises:
+            ValueError: If a segment is larger than the whole spool.
+        """
+        if segment_bytes > max_bytes:
+            raise ValueError("The segment size must not exceed the size of the spool.")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+
+        self.spooled = 0
+        self.replayed = 0
+        self.evicted = 0
+
+        self._lock = threading.Lock()
+        self._segments = []
+        self._sizes = {}
+        self._offset = 0
+        self._writer = None
+
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            number = int(name[:-len(SEGMENT_SUFFIX)])
+            path = self._path(number)
+            size = os.path.getsize(path)
+            if size % RECORD.size:
+                logger.warning(f"Cutting off a torn record at the end of spool segment {path}.")
+                size -= size % RECORD.size
+                os.truncate(path, size)
+            self._segments.append(number)
+            self._sizes[number] = size
+        if self.depth:
+            logger.info(f"Spool {directory} holds {self.depth} readings to replay.")
+
+    @property
+    def depth(self):
+        """
+        The number of readings waiting to be replayed.
+        """
+        return (self.size - self._offset) // RECORD.size
+
+    @property
+    def size(self):
+        """
+        The disk space used by the segments in bytes.
+        """
+        return sum(self._sizes.values())
+
+    @property
+    def segments(self):
+        return len(self._segments)
+
+    def append(self, readings, fsync=None):
+        """
+        Appends readings to the newest segment.
+
+        Args:
+            readings (list): (sensor_id, timestamp, weight) tuples with naive local timestamps.
+            fsync (bool, optional): Overrides the `fsync` setting of the spool.
+
+        Raises:
+            OSError: If the readings could not be written.
+            struct.error: If a reading does not fit a record, e.g. a sensor ID above `MAX_SENSOR_ID`.
+        """
+        data = b''.join(
+            RECORD.pack(sensor_id, timestamp.timestamp(), weight)
+            for sensor_id, timestamp, weight in readings
+        )
+        if not data:
+            return
+        with self._lock:
+            if self._writer is None or self._sizes[self._segments[-1]] >= self.segment_bytes:
+                self._roll()
+            number = self._segments[-1]
+            self._writer.write(data)
+            self._writer.flush()
+            if (self.fsync if fsync is None else fsync):
+                os.fsync(self._writer.fileno())
+            self._sizes[number] += len(data)
+            self.spooled += len(data) // RECORD.size
+            self._evict()
+
+    def replay(self, write, limit=5000):
+        """
+        Writes the oldest spooled readings and removes them from the spool.
+
+        Args:
+            write (callable): Takes a list of (sensor_id, timestamp, weight)
+                tuples and raises if they could not be stored.
+            limit (int): Maximum number of readings passed to `write`.
+
+        Returns:
+            int: The number of replayed readings, 0 if the spool is empty.
+
+        Raises:
+            Exception: Whatever `write` raised; the readings stay in the spool.
+        """
+        with self._lock:
+            if not self._segments:
+                return 0
+            number = self._segments[0]
+            offset = self._offset
+            with open(self._path(number), 'rb') as file:
+                file.seek(offset)
+                data = file.read(min(limit * RECORD.size, self._sizes[number] - offset))
+        if not data:
+            with self._lock:
+                self._consumed(number, offset)
+            return 0
+
+        readings = [
+            (sensor_id, datetime.fromtimestamp(timestamp), weight)
+            for sensor_id, timestamp, weight in RECORD.iter_unpack(data)
+        ]
+        write(readings)
+
+        with self._lock:
+            self._consumed(number, offset + len(data))
+            self.replayed += len(readings)
+        return len(readings)
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _path(self, number):
+        return os.path.join(self.directory, f"{number:010d}{SEGMENT_SUFFIX}")
+
+    def _roll(self):
+        if self._writer is not None:
+            self._writer.close()
+        number = self._segments[-1] + 1 if self._segments else 0
+        self._writer = open(self._path(number), 'ab')
+        self._segments.append(number)
+        self._sizes[number] = 0
+
+    def _consumed(self, number, offset):
+        # The segment may have been evicted while its readings were written
+        if not self._segments or self._segments[0] != number:
+            return
+        self._offset = offset
+        if offset < self._sizes[number]:
+            return
+        if len(self._segments) == 1 and self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._remove(number)
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._segments) > 1:
+            number = self._segments[0]
+            lost = (self._sizes[number] - self._offset) // RECORD.size
+            self.evicted += lost
+            logger.error(f"Spool full, evicting {lost} readings of segment {number}.")
+            self._remove(number)
+
+    def _remove(self, number):
+        os.remove(self._path(number))
+        self._segments.remove(number)
+        del self._sizes[number]
+        self._offset = 0
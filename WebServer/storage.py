@@ -0,0 +1,152 @@
+"""
+Storage backends of the web app and the control server.
+
+Both share the schema of models.py; the few queries and settings that differ
+between the databases are built by the backend of an engine:
+
+- `PostgresStorage` (`database.backend: postgres`, the default) expects
+  TimescaleDB: hypertables, continuous aggregates, compression and
+  retention policies, `time_bucket` and `DISTINCT ON`.
+- `SqliteStorage` (`database.backend: sqlite`) keeps everything in a single
+  file for single-box and edge installs without a database server. The
+  file runs in WAL mode, so the web app reads while the control server
+  writes. Buckets are computed from the unix time and the history is always
+  aggregated from the raw readings; there are no continuous aggregates and
+  no retention policies.
+
+The upserts are written with `sqlalchemy.dialects.postgresql.insert`; its
+`ON CONFLICT` clauses compile unchanged for SQLite 3.24 and newer, so the
+helpers that write share the statements.
+"""
+from sqlalchemy import event, func, literal, select, type_coerce, cast, DateTime, Integer, JSON
+from datetime import timedelta
+
+
+class PostgresStorage:
+    """
+    Postgres with the TimescaleDB extension.
+    """
+
+    name = 'postgres'
+    timescale = True
+
+    def configure(self, engine):
+        """
+        Prepares a new engine before its first connection.
+        """
+
+    def bucket_width(self, bucket):
+        """
+        Returns the bucket width `time_bucket` actually uses for `bucket`.
+        """
+        return bucket
+
+    def time_bucket(self, bucket, column):
+        """
+        Truncates timestamps to the start of their bucket.
+
+        Args:
+            bucket (timedelta): The bucket width.
+            column: The timestamp column or expression.
+
+        Returns:
+            The bucket start as SQL expression of type DateTime.
+        """
+        return func.time_bucket(literal(bucket), column, type_=DateTime)
+
+    def epoch(self, column):
+        """
+        Converts timestamps to seconds since the epoch, naive timestamps are read as UTC.
+        """
+        return func.extract('epoch', column)
+
+    def latest(self, partition, order, *columns):
+        """
+        Selects the newest row of every group.
+
+        Args:
+            partition (list): The columns identifying a group, e.g. the sensor ID.
+            order: The timestamp column deciding which row is the newest.
+            *columns: Further columns of the newest row.
+
+        Returns:
+            sqlalchemy.sql.Select: The partition columns, `order` and `columns` of the newest rows.
+        """
+        return select(*partition, order, *columns).distinct(*partition).order_by(*partition, order.desc())
+
+    def array_agg(self, column):
+        """
+        Aggregates the values of a group into a list.
+        """
+        return func.array_agg(column)
+
+
+class SqliteStorage(PostgresStorage):
+    """
+    SQLite file in WAL mode.
+    """
+
+    name = 'sqlite'
+    timescale = False
+
+    # Readers never block the writer in WAL mode, synchronous=NORMAL only
+    # fsyncs at checkpoints, and concurrent writers wait instead of failing
+    PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA busy_timeout=10000",
+        "PRAGMA temp_store=MEMORY",
+    )
+
+    def configure(self, engine):
+        if not event.contains(engine, 'connect', self._set_pragmas):
+            event.listen(engine, 'connect', self._set_pragmas)
+
+    def bucket_width(self, bucket):
+        return timedelta(seconds=max(1, round(bucket.total_seconds())))
+
+    def time_bucket(self, bucket, column):
+        # Buckets start at multiples of the width since the epoch, like time_bucket
+        seconds = int(self.bucket_width(bucket).total_seconds())
+        return func.datetime(self.epoch(column) // seconds * seconds, 'unixepoch', type_=DateTime)
+
+    def epoch(self, column):
+        return cast(func.strftime('%s', column), Integer)
+
+    def latest(self, partition, order, *columns):
+        # The bare columns of a query with a single max() come from the row holding the maximum
+        return select(*partition, func.max(order).label(order.key), *columns).group_by(*partition)
+
+    def array_agg(self, column):
+        return type_coerce(func.json_group_array(column), JSON)
+
+    def _set_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in self.PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+BACKENDS = {
+    'postgresql': PostgresStorage(),
+    'sqlite': SqliteStorage(),
+}
+
+
+def get_storage(engine):
+    """
+    Returns the storage backend of an engine.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The database engine.
+
+    Returns:
+        PostgresStorage: The backend of the engine's database.
+
+    Raises:
+        ValueError: If the database is not supported.
+    """
+    try:
+        return BACKENDS[engine.dialect.name]
+    except KeyError:
+        raise ValueError(f"Unsupported database: {engine.dialect.name}")
@@ -0,0 +1,60 @@
+import socket
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from email_server import EmailSender
+
+
+class RecordingHandler:
+    """
+    aiosmtpd handler that records the delivered messages.
+
+    The next `fail` messages are rejected with a temporary error, -1 rejects all of them.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.fail = 0
+        self.quits = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.fail:
+            self.fail -= 1
+            return '451 Try again later'
+        self.messages.append(envelope)
+        return '250 OK'
+
+    async def handle_QUIT(self, server, session, envelope):
+        self.quits += 1
+        return '221 Bye'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_port():
+    return free_port()
+
+
+@pytest.fixture
+def smtp_server(smtp_port):
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=smtp_port)
+    controller.start()
+    try:
+        yield handler
+    finally:
+        controller.stop()
+
+
+@pytest.fixture
+def email_sender(smtp_port):
+    # Without a username no login is attempted, the stand-in server has no authentication
+    sender = EmailSender('127.0.0.1', smtp_port, None, None, use_tls=False, timeout=5)
+    sender.sender_email = 'alerts@example.com'
+    return sender
@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+
+from baseline import BaselineTracker
+from models import db, Weights
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}")
+    db.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def store(engine, rows):
+    with engine.begin() as connection:
+        connection.execute(Weights.__table__.insert(), [
+            {'sensor_id': sensor_id, 'timestamp': timestamp, 'value': value}
+            for sensor_id, timestamp, value in rows
+        ])
+
+
+def test_warm_start_weights_the_stored_steps_by_time(engine):
+    now = datetime.now()
+    # A steady 100 g stored once before the window, then a noisy burst of 200 g in its last seconds
+    rows = [(1, now - timedelta(seconds=70), 100.0)]
+    rows += [(1, now - timedelta(seconds=6 - i), 200.0 + i % 2) for i in range(6)]
+    store(engine, rows)
+
+    tracker = BaselineTracker(window_seconds=60, statistic='median')
+    assert tracker.warm_start(engine, points=60, heartbeat_seconds=60) == 60
+    assert tracker.baseline(1) == 100.0
+
+
+def test_warm_start_skips_the_time_before_the_first_reading(engine):
+    now = datetime.now()
+    store(engine, [(1, now - timedelta(seconds=30), 50.0)])
+
+    tracker = BaselineTracker(window_seconds=60)
+    assert 29 <= tracker.warm_start(engine, points=60) <= 31
+    assert tracker.baseline(1) == 50.0
@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from detection import CusumDetector, DetectionEngine, StepChangeDetector, ThresholdDetector, create_detector
+
+
+def detect(detector, residuals, sensitivity=1.0, state=None):
+    state = detector.initial_state() if state is None else state
+    return list(detector.detect(np.asarray(residuals, dtype=float), sensitivity, state)), state
+
+
+def test_threshold_reports_each_rising_edge_once():
+    found, _ = detect(ThresholdDetector(), [0, 2, 2, 0, 1, 3])
+    assert found == [1, 4]
+
+
+def test_threshold_keeps_its_state_between_calls():
+    detector = ThresholdDetector()
+    found, state = detect(detector, [0, 2])
+    assert found == [1]
+    found, state = detect(detector, [2, 2], state=state)
+    assert found == []
+    found, _ = detect(detector, [0, 2], state=state)
+    assert found == [1]
+
+
+def test_step_ignores_spikes_shorter_than_the_debounce():
+    found, _ = detect(StepChangeDetector(debounce=3), [2, 2, 0, 2, 2, 2, 2, 0])
+    assert found == [5]
+
+
+def test_step_counts_runs_across_calls():
+    detector = StepChangeDetector(debounce=3)
+    found, state = detect(detector, [0, 2, 2])
+    assert found == []
+    found, state = detect(detector, [2, 2], state=state)
+    assert found == [0]
+    found, _ = detect(detector, [2, 0, 2, 2, 2], state=state)
+    assert found == [4]
+
+
+def test_cusum_accumulates_small_deviations():
+    # Each reading adds 1 - 0.5 drift, the sum reaches the limit of 2 at the fourth
+    found, _ = detect(CusumDetector(drift=0.5, threshold=2.0), [1, 1, 1, 1, 1, 1])
+    assert found == [3]
+
+
+def test_cusum_ignores_noise_and_rearms_after_settling():
+    detector = CusumDetector(drift=0.5, threshold=2.0)
+    found, state = detect(detector, [0.4, -0.3, 0.5, 0.2, 3, 3, 0, 3])
+    assert found == [4, 7]
+    found, state = detect(detector, [3], state=state)
+    assert found == []
+    found, _ = detect(detector, [0.5, 2.5], state=state)
+    assert found == [1]
+
+
+def test_cusum_scales_with_the_sensitivity():
+    found, _ = detect(CusumDetector(drift=0.5, threshold=2.0), [15, 15, 15], sensitivity=10)
+    assert found == [1]
+
+
+def test_create_detector():
+    assert isinstance(create_detector('threshold'), ThresholdDetector)
+    assert create_detector('step', debounce=5).debounce == 5
+    cusum = create_detector('cusum', drift=0.2, threshold=4.0)
+    assert (cusum.drift, cusum.threshold) == (0.2, 4.0)
+    with pytest.raises(ValueError):
+        create_detector('unknown')
+
+
+def test_engine_keeps_the_state_per_sensor():
+    engine = DetectionEngine(ThresholdDetector())
+    detections = engine.process(1, [0, 1], [100, 105], [100, 100], 2.0)
+    assert [(d.sensor_id, d.timestamp, d.weight, d.baseline, d.detector) for d in detections] == [
+        (1, 1, 105.0, 100.0, 'threshold')
+    ]
+    assert engine.process(1, [2], [106], [100], 2.0) == []
+    assert len(engine.process(2, [2], [106], [100], 2.0)) == 1
+
+    engine.reset(1)
+    assert len(engine.process(1, [3], [106], [100], 2.0)) == 1
+    assert engine.process(1, [], [], [], 2.0) == []
+
+
+def rolling_baselines(weights, window=60):
+    # A reading per second, the baseline is the mean of the trailing window
+    return [float(np.mean(weights[max(0, i - window + 1):i + 1])) for i in range(len(weights))]
+
+
+def run_engine(detector, weights, sensitivity=50.0, one_by_one=True):
+    engine = DetectionEngine(detector, settle_seconds=60)
+    baselines = rolling_baselines(weights)
+    if not one_by_one:
+        return [d.timestamp for d in engine.process(1, list(range(len(weights))), weights, baselines, sensitivity)]
+    return [
+        d.timestamp
+        for i, (weight, baseline) in enumerate(zip(weights, baselines))
+        for d in engine.process(1, [i], [weight], [baseline], sensitivity)
+    ]
+
+
+@pytest.mark.parametrize('detector', [ThresholdDetector(), StepChangeDetector(debounce=3), CusumDetector()])
+@pytest.mark.parametrize('one_by_one', [True, False])
+def test_engine_reports_stacked_packages(detector, one_by_one):
+    # Empty at 10, a package at s=30 and a second one at s=40, before the baseline caught up
+    weights = [10.0] * 30 + [310.0] * 10 + [610.0] * 100
+    found = run_engine(detector, weights, one_by_one=one_by_one)
+    assert len(found) == 2
+    assert 30 <= found[0] <= 33
+    assert 40 <= found[1] <= 43
+
+
+@pytest.mark.parametrize('detector', [ThresholdDetector(), StepChangeDetector(debounce=3), CusumDetector()])
+def test_engine_reports_a_package_right_after_one_was_taken_out(detector):
+    # The baseline still holds the removed package when the next one arrives
+    weights = [10.0] * 30 + [1010.0] * 100 + [10.0] * 20 + [210.0] * 100
+    found = run_engine(detector, weights)
+    assert len(found) == 2
+    assert 150 <= found[1] <= 153
+
+
+def test_engine_reports_a_package_once_while_the_baseline_catches_up():
+    weights = [10.0] * 30 + [310.0] * 200
+    assert len(run_engine(ThresholdDetector(), weights)) == 1
+    assert len(run_engine(CusumDetector(), weights, one_by_one=False)) == 1
+
+
+def test_engine_keeps_the_reported_level_within_a_batch():
+    engine = DetectionEngine(ThresholdDetector(), settle_seconds=60)
+    detections = engine.process(1, [0, 1, 2, 3], [10, 110, 110, 210], [10, 10, 20, 30], 50)
+    assert [(d.timestamp, d.baseline) for d in detections] == [(1, 10.0), (3, 110.0)]
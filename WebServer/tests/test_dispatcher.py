@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+
+import pytest
+
+from dispatcher import ShardedDispatcher
+
+
+def test_events_of_a_sensor_are_processed_in_order():
+    processed = {}
+
+    def handler(sensor_id, event):
+        time.sleep(random.random() / 1000)
+        processed.setdefault(sensor_id, []).append(event)
+
+    dispatcher = ShardedDispatcher(handler, workers=4, max_queue=1000)
+    for event in range(50):
+        for sensor_id in range(10):
+            assert dispatcher.submit(sensor_id, event)
+    dispatcher.close()
+
+    assert processed == {sensor_id: list(range(50)) for sensor_id in range(10)}
+    assert dispatcher.stats()['processed'] == 500
+
+
+def test_handler_errors_do_not_stop_the_worker():
+    processed = []
+
+    def handler(sensor_id, event):
+        if event == 'bad':
+            raise ValueError(event)
+        processed.append(event)
+
+    dispatcher = ShardedDispatcher(handler, workers=1)
+    for event in ('a', 'bad', 'b'):
+        dispatcher.submit(1, event)
+    dispatcher.close()
+
+    assert processed == ['a', 'b']
+    assert dispatcher.errors == 1
+
+
+def blocked_dispatcher(overflow):
+    started = threading.Event()
+    release = threading.Event()
+    processed = []
+
+    def handler(sensor_id, event):
+        started.set()
+        release.wait(5)
+        processed.append(event)
+
+    dispatcher = ShardedDispatcher(handler, workers=1, max_queue=1, overflow=overflow, put_timeout=0.01)
+    dispatcher.submit(1, 'first')
+    assert started.wait(5)
+    return dispatcher, release, processed
+
+
+@pytest.mark.parametrize('overflow', ['block', 'drop_newest'])
+def test_full_queue_drops_the_new_event(overflow):
+    dispatcher, release, processed = blocked_dispatcher(overflow)
+    assert dispatcher.submit(1, 'second')
+    assert not dispatcher.submit(1, 'third')
+    release.set()
+    dispatcher.close()
+
+    assert processed == ['first', 'second']
+    assert dispatcher.dropped == 1
+
+
+def test_full_queue_drops_the_oldest_event():
+    dispatcher, release, processed = blocked_dispatcher('drop_oldest')
+    assert dispatcher.submit(1, 'second')
+    assert dispatcher.submit(1, 'third')
+    release.set()
+    dispatcher.close()
+
+    assert processed == ['first', 'third']
+    assert dispatcher.dropped == 1
+
+
+def test_close_gives_up_on_a_full_queue():
+    dispatcher, release, processed = blocked_dispatcher('block')
+    dispatcher.submit(1, 'second')
+
+    started = time.monotonic()
+    dispatcher.close(timeout=0.1)
+    assert time.monotonic() - started < 1
+    release.set()
+
+
+def test_counters_are_not_lost_between_threads():
+    dispatcher = ShardedDispatcher(lambda sensor_id, event: None, workers=4, max_queue=10, overflow='drop_oldest')
+    producers = [
+        threading.Thread(target=lambda offset=offset: [dispatcher.submit(offset + i, i) for i in range(2000)])
+        for offset in range(4)
+    ]
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    dispatcher.close()
+
+    assert dispatcher.processed + dispatcher.dropped == 8000
+
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        ShardedDispatcher(lambda sensor_id, event: None, workers=1, overflow='ignore')
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+import pytest
+
+from history import align_bucket, weight_bucket_source
+from models import Weights, WeightsPerHour, WeightsPerMinute, select_weight_rollup
+from storage import BACKENDS
+
+
+@pytest.mark.parametrize('bucket, rollup', [
+    (timedelta(seconds=30), None),
+    (timedelta(seconds=90), None),
+    (timedelta(minutes=1), WeightsPerMinute),
+    (timedelta(minutes=90), WeightsPerMinute),
+    (timedelta(hours=2), WeightsPerHour),
+    (timedelta(days=1), WeightsPerHour),
+])
+def test_rollup_buckets_must_divide_the_requested_bucket(bucket, rollup):
+    assert select_weight_rollup(bucket)[1] is rollup
+
+
+def test_bucket_source_falls_back_to_the_raw_readings():
+    source_time, _, _ = weight_bucket_source(timedelta(seconds=90), BACKENDS['postgresql'])
+    assert source_time is Weights.timestamp
+    source_time, _, _ = weight_bucket_source(timedelta(minutes=90), BACKENDS['postgresql'])
+    assert source_time is WeightsPerMinute.c.bucket
+    source_time, _, _ = weight_bucket_source(timedelta(hours=2), BACKENDS['sqlite'])
+    assert source_time is Weights.timestamp
+
+
+def test_computed_buckets_are_aligned_to_the_aggregates():
+    postgres, sqlite = BACKENDS['postgresql'], BACKENDS['sqlite']
+    assert align_bucket(timedelta(seconds=5403), postgres) == timedelta(hours=2)
+    assert align_bucket(timedelta(seconds=3599), postgres) == timedelta(hours=1)
+    assert align_bucket(timedelta(seconds=61), postgres) == timedelta(minutes=2)
+    assert align_bucket(timedelta(seconds=59), postgres) == timedelta(seconds=59)
+    assert align_bucket(timedelta(seconds=61), sqlite) == timedelta(seconds=61)
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from live_updates import EventBroadcaster, format_sse, parse_event_id
+
+START = datetime(2024, 12, 1, 8, 0, 0)
+
+
+def publish(broadcaster, count):
+    for second in range(count):
+        for sensor_id in (1, 2):
+            timestamp = START + timedelta(seconds=second)
+            broadcaster.publish(sensor_id, 'weight', {'value': float(second)}, timestamp)
+
+
+def drain(subscription):
+    events = []
+    while (event := subscription.get(timeout=0)) is not None:
+        events.append(event)
+    return events
+
+
+def test_workers_give_an_event_the_same_id():
+    first = EventBroadcaster(history_size=100, client_queue_size=100)
+    second = EventBroadcaster(history_size=100, client_queue_size=100)
+    publish(first, 2)
+    publish(second, 2)
+
+    assert [event['id'] for event in first._history] == [event['id'] for event in second._history]
+    event = first._history[0]
+    assert event['id'] == f"{round(START.timestamp() * 1000)}-1-weight"
+    assert f"id: {event['id']}\n" in format_sse(event)
+
+
+def test_reconnect_to_another_worker_replays_only_missed_events():
+    first = EventBroadcaster(history_size=100, client_queue_size=100)
+    second = EventBroadcaster(history_size=100, client_queue_size=100)
+    subscription = first.subscribe({1})
+    for broadcaster in (first, second):
+        publish(broadcaster, 4)
+
+    received = drain(subscription)
+    last_event_id = received[1]['id']
+    replayed = drain(second.subscribe({1}, last_event_id))
+    assert [event['id'] for event in replayed] == [event['id'] for event in received[2:]]
+    assert [event['data']['value'] for event in replayed] == [2.0, 3.0]
+
+
+def test_malformed_last_event_id_replays_nothing():
+    broadcaster = EventBroadcaster(history_size=100, client_queue_size=100)
+    publish(broadcaster, 2)
+    assert drain(broadcaster.subscribe(None, '17')) == []
+    assert parse_event_id('17') is None
+    assert parse_event_id(None) is None
+    assert parse_event_id('1733040000123-17-weight') == (1733040000123, 17, 'weight')
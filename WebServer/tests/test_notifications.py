@@ -0,0 +1,111 @@
+import time
+
+from email_server import SMTPSession
+from notifications import NotificationDispatcher
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_session_reuses_the_connection(smtp_server, email_sender):
+    session = SMTPSession(email_sender)
+    session.send(['a@example.com'], 'First', 'Body')
+    connection = session._server
+    session.send(['a@example.com', 'b@example.com'], 'Second', 'Body', '<table></table>')
+    assert session._server is connection
+    session.close()
+
+    assert [message.rcpt_tos for message in smtp_server.messages] == [
+        ['a@example.com'], ['a@example.com', 'b@example.com']
+    ]
+    assert smtp_server.quits == 1
+
+
+def test_session_reconnects_after_the_server_dropped_it(smtp_server, email_sender):
+    session = SMTPSession(email_sender)
+    session.send(['a@example.com'], 'First', 'Body')
+    session._server.close()
+    session.send(['a@example.com'], 'Second', 'Body')
+    session.close()
+
+    assert len(smtp_server.messages) == 2
+
+
+def test_session_closes_when_idle(smtp_server, email_sender):
+    session = SMTPSession(email_sender, idle_timeout=0.05)
+    session.send(['a@example.com'], 'Subject', 'Body')
+    session.close_if_idle()
+    assert session._server is not None
+
+    time.sleep(0.06)
+    session.close_if_idle()
+    assert session._server is None
+    assert wait_for(lambda: smtp_server.quits == 1)
+
+
+def test_dispatcher_sends_one_message_to_all_recipients(smtp_server, email_sender):
+    dispatcher = NotificationDispatcher(email_sender, workers=1)
+    assert dispatcher.notify(1, 'Package', 'Body', ['a@example.com', 'b@example.com'])
+    dispatcher.close()
+
+    assert dispatcher.stats()['sent'] == 1
+    assert [message.rcpt_tos for message in smtp_server.messages] == [['a@example.com', 'b@example.com']]
+
+
+def test_dispatcher_retries_failed_deliveries(smtp_server, email_sender):
+    smtp_server.fail = 2
+    dispatcher = NotificationDispatcher(email_sender, workers=1, max_retries=3, retry_backoff=0.01)
+    dispatcher.notify(1, 'Package', 'Body', ['a@example.com'])
+    assert wait_for(lambda: dispatcher.sent == 1)
+    dispatcher.close()
+
+    assert dispatcher.failed == 0
+    assert len(smtp_server.messages) == 1
+
+
+def test_dispatcher_gives_up_after_max_retries(smtp_server, email_sender):
+    smtp_server.fail = -1
+    dispatcher = NotificationDispatcher(email_sender, workers=1, max_retries=2, retry_backoff=0.01)
+    dispatcher.notify(1, 'Package', 'Body', ['a@example.com'])
+    assert wait_for(lambda: dispatcher.failed == 1)
+    dispatcher.close()
+
+    assert dispatcher.sent == 0
+    assert smtp_server.messages == []
+
+
+def test_dispatcher_closes_idle_sessions(smtp_server, email_sender):
+    dispatcher = NotificationDispatcher(email_sender, workers=1, idle_timeout=0.05)
+    dispatcher.notify(1, 'Package', 'Body', ['a@example.com'])
+    assert wait_for(lambda: dispatcher.sent == 1)
+    assert wait_for(lambda: smtp_server.quits == 1)
+    dispatcher.close()
+
+    assert smtp_server.quits == 1
+
+
+def test_dispatcher_coalesces_queued_notifications(email_sender):
+    dispatcher = NotificationDispatcher(email_sender, workers=0)
+    assert dispatcher.notify(1, 'Package', 'First', ['a@example.com'])
+    assert not dispatcher.notify(1, 'Package', 'Second', ['b@example.com'])
+    assert dispatcher.notify(2, 'Package', 'Other sensor', ['a@example.com'])
+    assert not dispatcher.notify(3, 'Package', 'No recipients', [])
+
+    stats = dispatcher.stats()
+    assert stats['coalesced'] == 1
+    assert stats['queued'] == 2
+    notification = dispatcher._queue.get_nowait()
+    assert (notification.body, notification.recipients) == ('Second', ['b@example.com'])
+
+
+def test_dispatcher_drops_when_the_queue_is_full(email_sender):
+    dispatcher = NotificationDispatcher(email_sender, workers=0, max_queue=1)
+    assert dispatcher.notify(1, 'Package', 'Body', ['a@example.com'])
+    assert not dispatcher.notify(2, 'Package', 'Body', ['a@example.com'])
+    assert dispatcher.stats()['dropped'] == 1
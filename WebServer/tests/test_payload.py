@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from payload import HEADER, PayloadError, SequenceTracker, decode_batch, decode_legacy, encode_batch
+
+
+def test_decode_batch_round_trip():
+    start = datetime(2024, 12, 1, 8, 0, 0)
+    readings = [(start + timedelta(seconds=i), 100.0 + i) for i in range(3)]
+    sequence, device_ms, decoded = decode_batch(encode_batch(7, readings), received_at=start + timedelta(seconds=3))
+
+    assert sequence == 7
+    assert device_ms == int(start.timestamp() * 1000)
+    assert decoded == readings
+
+
+def test_decode_batch_rebases_an_unsynchronized_clock():
+    # Device clock still at the epoch because NTP was not available yet
+    readings = [(datetime.fromtimestamp(1), 1.0), (datetime.fromtimestamp(3), 2.0)]
+    received_at = datetime(2024, 12, 1, 8, 0, 0)
+    _, device_ms, decoded = decode_batch(encode_batch(0, readings), received_at=received_at)
+
+    assert device_ms == 1000
+    assert decoded == [(received_at - timedelta(seconds=2), 1.0), (received_at, 2.0)]
+
+
+def test_decode_batch_without_readings():
+    assert decode_batch(encode_batch(3, [])) == (3, 0, [])
+
+
+@pytest.mark.parametrize('payload', [
+    b'',
+    HEADER.pack(2, 0, 0, 0, 0),
+    HEADER.pack(1, 0, 2, 0, 0) + b'\x00' * 8,
+])
+def test_decode_batch_rejects_malformed_payloads(payload):
+    with pytest.raises(PayloadError):
+        decode_batch(payload)
+
+
+def test_decode_legacy():
+    received_at = datetime(2024, 12, 1, 8, 0, 0)
+    assert decode_legacy(b'12.5', received_at) == [(received_at, 12.5)]
+    with pytest.raises(PayloadError):
+        decode_legacy(b'heavy')
+
+
+def test_sequence_tracker_classifies_batches():
+    tracker = SequenceTracker(restart_window=10)
+    batches = [(0, 100), (1, 200), (1, 200), (2, 300), (5, 400), (1, 50), (2, 60), (3, 70), (0, 90)]
+    assert [tracker.check(1, sequence, base_time) for sequence, base_time in batches] == [
+        'first', 'ok', 'duplicate', 'ok', 'gap', 'restart', 'ok', 'ok', 'restart'
+    ]
+
+
+def test_sequence_tracker_recognizes_late_redeliveries():
+    tracker = SequenceTracker()
+    for sequence in range(5):
+        tracker.check(1, sequence, sequence * 100)
+    assert tracker.check(1, 2, 200) == 'duplicate'
+    assert tracker.check(1, 5, 500) == 'ok'
+
+
+def test_sequence_tracker_takes_a_far_jump_as_restart():
+    tracker = SequenceTracker(restart_window=10)
+    tracker.check(1, 100, 1000)
+    assert tracker.check(1, 111, 2000) == 'restart'
+    # A restart with the same sequence number but a new base time is not a duplicate
+    assert tracker.check(1, 0, 3000) == 'restart'
+    assert tracker.check(1, 0, 4000) == 'restart'
+
+
+def test_sequence_tracker_handles_wraparound_and_sensors_separately():
+    tracker = SequenceTracker()
+    tracker.check(1, 0xFFFFFFFF, 100)
+    assert tracker.check(1, 0, 200) == 'ok'
+    assert tracker.check(2, 0, 200) == 'first'
@@ -0,0 +1,77 @@
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, select
+
+from models import db, EmailNotification, ReportRuns, ThresholdSensitivity
+from reports import ReportScheduler, claim_report, release_report
+
+DAY = date(2024, 12, 1)
+START = datetime(2024, 12, 1)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'reports.db'}")
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(ThresholdSensitivity.__table__.insert(), [{'sensor_id': 1, 'value': 1.0}])
+        connection.execute(EmailNotification.__table__.insert(), [
+            {'sensor_id': 1, 'email_address': 'a@example.com'},
+            {'sensor_id': 1, 'email_address': 'b@example.com'},
+        ])
+    yield engine
+    engine.dispose()
+
+
+def claims(engine):
+    with engine.connect() as connection:
+        return connection.execute(select(ReportRuns.period_start)).scalars().all()
+
+
+def test_claim_and_release(engine):
+    assert claim_report(engine, START)
+    assert not claim_report(engine, START)
+
+    release_report(engine, START)
+    assert claims(engine) == []
+    assert claim_report(engine, START)
+
+
+def test_run_sends_a_digest_per_recipient_once(engine, smtp_server, email_sender):
+    scheduler = ReportScheduler(engine, email_sender)
+    assert scheduler.run(DAY) == 2
+    assert scheduler.reported == DAY
+    assert claims(engine) == [START]
+    assert sorted(message.rcpt_tos[0] for message in smtp_server.messages) == ['a@example.com', 'b@example.com']
+
+    assert ReportScheduler(engine, email_sender).run(DAY) == 0
+    assert len(smtp_server.messages) == 2
+
+
+def test_run_releases_the_claim_if_nothing_was_sent(engine, smtp_server, email_sender):
+    smtp_server.fail = -1
+    scheduler = ReportScheduler(engine, email_sender)
+    with pytest.raises(RuntimeError):
+        scheduler.run(DAY)
+    assert scheduler.reported is None
+    assert claims(engine) == []
+
+    smtp_server.fail = 0
+    assert scheduler.run(DAY) == 2
+    assert scheduler.reported == DAY
+
+
+def test_run_keeps_the_claim_if_some_digests_were_sent(engine, smtp_server, email_sender):
+    smtp_server.fail = 1
+    scheduler = ReportScheduler(engine, email_sender)
+    assert scheduler.run(DAY) == 1
+    assert claims(engine) == [START]
+
+
+def test_run_releases_the_claim_if_the_query_fails(engine, email_sender):
+    EmailNotification.__table__.drop(engine)
+    scheduler = ReportScheduler(engine, email_sender)
+    with pytest.raises(Exception):
+        scheduler.run(DAY)
+    assert claims(engine) == []
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from spool import RECORD, Spool
+
+
+def readings(count, start=0):
+    base = datetime(2024, 12, 1, 8, 0, 0)
+    return [(sensor_id, base + timedelta(seconds=sensor_id), float(sensor_id)) for sensor_id in range(start, start + count)]
+
+
+def replay_all(spool, limit=5000):
+    replayed = []
+    while spool.replay(replayed.extend, limit):
+        pass
+    return replayed
+
+
+def test_replay_returns_the_readings_oldest_first(tmp_path):
+    spool = Spool(str(tmp_path), fsync=False)
+    spool.append(readings(3))
+    spool.append(readings(2, start=3))
+    assert spool.depth == 5
+
+    assert replay_all(spool, limit=2) == readings(5)
+    assert spool.depth == 0
+    assert spool.replayed == 5
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_write_keeps_the_readings(tmp_path):
+    spool = Spool(str(tmp_path), fsync=False)
+    spool.append(readings(3))
+
+    def fail(batch):
+        raise RuntimeError("database down")
+
+    with pytest.raises(RuntimeError):
+        spool.replay(fail)
+    assert spool.depth == 3
+    assert replay_all(spool) == readings(3)
+
+
+def test_readings_survive_a_restart(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(readings(4))
+    spool.replay(lambda batch: None, limit=1)
+    spool.close()
+
+    # The replay offset is not persisted, a restart replays the whole segment again
+    reopened = Spool(str(tmp_path))
+    assert replay_all(reopened) == readings(4)
+
+
+def test_torn_record_is_cut_off(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(readings(2))
+    spool.close()
+    segment = next(tmp_path.iterdir())
+    with open(segment, 'ab') as file:
+        file.write(b'\x01\x02\x03')
+
+    reopened = Spool(str(tmp_path))
+    assert reopened.depth == 2
+    assert replay_all(reopened) == readings(2)
+
+
+def test_full_spool_evicts_the_oldest_segment(tmp_path):
+    spool = Spool(str(tmp_path), max_bytes=4 * RECORD.size, segment_bytes=2 * RECORD.size, fsync=False)
+    for reading in readings(6):
+        spool.append([reading])
+
+    assert spool.evicted == 2
+    assert spool.size <= spool.max_bytes
+    assert replay_all(spool) == readings(4, start=2)
+
+
+def test_eviction_accounts_for_partly_replayed_segments(tmp_path):
+    spool = Spool(str(tmp_path), max_bytes=4 * RECORD.size, segment_bytes=2 * RECORD.size, fsync=False)
+    for reading in readings(4):
+        spool.append([reading])
+    spool.replay(lambda batch: None, limit=1)
+    spool.append(readings(1, start=4))
+
+    assert spool.evicted == 1
+    assert replay_all(spool) == readings(3, start=2)
+
+
+def test_segment_must_fit_the_spool(tmp_path):
+    with pytest.raises(ValueError):
+        Spool(str(tmp_path), max_bytes=RECORD.size, segment_bytes=2 * RECORD.size)
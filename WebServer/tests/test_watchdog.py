@@ -0,0 +1,134 @@
+import pytest
+
+import watchdog
+from watchdog import OFFLINE, ONLINE, LivenessWatchdog, TimerWheel
+
+
+def test_wheel_expires_timers_at_their_deadline():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(0)
+    wheel.schedule('a', 3.0)
+    wheel.schedule('b', 4.5)
+    assert len(wheel) == 2
+
+    assert wheel.advance(2.9) == []
+    assert wheel.advance(3.0) == ['a']
+    assert wheel.advance(4.9) == []
+    assert wheel.advance(5.0) == ['b']
+    assert len(wheel) == 0
+
+
+def test_wheel_keeps_timers_more_than_one_revolution_ahead():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(0)
+    wheel.schedule('a', 20.0)
+
+    assert wheel.advance(12.0) == []
+    assert wheel.advance(19.0) == []
+    assert wheel.advance(20.0) == ['a']
+
+
+def test_wheel_reschedules_and_cancels():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(0)
+    wheel.schedule('a', 2.0)
+    wheel.schedule('a', 6.0)
+    wheel.schedule('b', 2.0)
+    wheel.cancel('b')
+
+    assert wheel.advance(3.0) == []
+    assert wheel.advance(6.0) == ['a']
+
+
+def test_wheel_catches_up_after_a_long_pause():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(0)
+    for key in range(5):
+        wheel.schedule(key, key + 1.0)
+    assert sorted(wheel.advance(100.0)) == [0, 1, 2, 3, 4]
+
+
+def test_wheel_never_schedules_into_the_past():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(10.0)
+    wheel.schedule('a', 5.0)
+    assert wheel.advance(11.0) == ['a']
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(watchdog, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def dog(clock):
+    return LivenessWatchdog(lambda events: None, offline_after=10)
+
+
+def test_silent_sensors_go_offline_and_come_back(clock):
+    changes = []
+    dog = LivenessWatchdog(changes.extend, offline_after=10)
+    dog.seen(1)
+    dog.seen(2)
+
+    clock.now += 5
+    assert dog.check() == []
+    dog.seen(2)
+    clock.now += 6
+    events = dog.check()
+    assert [(event.sensor_id, event.status) for event in events] == [(1, OFFLINE)]
+    assert changes == events
+    assert dog.counts() == {ONLINE: 1, OFFLINE: 1}
+
+    dog.seen(1)
+    events = dog.check()
+    assert [(event.sensor_id, event.status) for event in events] == [(1, ONLINE)]
+    assert events[0].last_seen is not None
+    assert dog.came_online == 1
+
+
+def test_seen_sensor_moves_to_its_new_deadline(clock, dog):
+    dog.seen(1)
+    clock.now += 8
+    dog.seen(1)
+
+    # The first deadline passes, but the sensor was seen since
+    clock.now += 3
+    assert dog.check() == []
+    clock.now += 8
+    assert [event.status for event in dog.check()] == [OFFLINE]
+    assert dog.went_offline == 1
+
+
+def test_loaded_sensors_keep_their_offline_status(clock, dog):
+    dog.load([1, 2, 3], offline=[3])
+    assert dog.counts() == {ONLINE: 2, OFFLINE: 1}
+
+    clock.now += 11
+    assert sorted(event.sensor_id for event in dog.check()) == [1, 2]
+
+    dog.seen(3)
+    assert [(event.sensor_id, event.status, event.last_seen) for event in dog.check()] == [(3, ONLINE, None)]
+
+
+def test_suspended_watchdog_reports_nothing(clock, dog):
+    dog.seen(1)
+    dog.suspend()
+
+    clock.now += 11
+    assert dog.check() == []
+    dog.resume()
+    clock.now += 5
+    assert dog.check() == []
+    clock.now += 6
+    assert [event.status for event in dog.check()] == [OFFLINE]
@@ -0,0 +1,255 @@
+"""
+Liveness watchdog for the mailboxes.
+
+Every message of a sensor only stores its last-seen time in a dict. Each
+online sensor additionally has one entry in a hashed timer wheel, due when
+it would be offline if nothing arrives in the meantime. Once per tick the
+watchdog looks at the entries of a single slot: an entry whose sensor was
+seen since it was scheduled moves to its new deadline, an entry whose
+sensor stayed silent turns the sensor offline. The next message of an
+offline sensor turns it online again.
+
+A tick therefore costs time proportional to the sensors due in that slot,
+not to all sensors, and no per-sensor query is ever sent to the database.
+"""
+from collections import namedtuple
+from datetime import datetime
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+ONLINE = 'online'
+OFFLINE = 'offline'
+
+StatusEvent = namedtuple('StatusEvent', ['sensor_id', 'status', 'timestamp', 'last_seen'])
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel with one timer per key.
+
+    Deadlines are rounded up to whole ticks and hashed into `slots` buckets;
+    deadlines more than one revolution ahead stay in their bucket until their
+    round comes. Scheduling and cancelling are O(1).
+
+    Not thread-safe, the watchdog serializes the access.
+    """
+
+    def __init__(self, tick=1.0, slots=512):
+        self.tick = tick
+        self._slots = [{} for _ in range(slots)]
+        self._keys = {}
+        self._current = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def schedule(self, key, deadline):
+        """
+        Sets the timer of `key`, replacing an earlier one.
+
+        Args:
+            key (hashable): The key of the timer.
+            deadline (float): The monotonic time at which the timer expires.
+        """
+        self.cancel(key)
+        due = math.ceil(deadline / self.tick)
+        if self._current is not None:
+            due = max(due, self._current + 1)
+        slot = self._slots[due % len(self._slots)]
+        slot[key] = due
+        self._keys[key] = slot
+
+    def cancel(self, key):
+        slot = self._keys.pop(key, None)
+        if slot is not None:
+            del slot[key]
+
+    def advance(self, now):
+        """
+        Moves the wheel to `now` and removes the expired timers.
+
+        Args:
+            now (float): The current monotonic time.
+
+        Returns:
+            list: The keys of the expired timers.
+        """
+        target = math.floor(now / self.tick)
+        if self._current is None:
+            # Timers scheduled before the first advance may be due already
+            self._current = min([slot[key] for key, slot in self._keys.items()] + [target]) - 1
+        expired = []
+        # After a long pause every slot is visited at most once
+        start = max(self._current + 1, target - len(self._slots) + 1)
+        for tick in range(start, target + 1):
+            slot = self._slots[tick % len(self._slots)]
+            due = [key for key, when in slot.items() if when <= target]
+            for key in due:
+                del slot[key]
+                del self._keys[key]
+            expired.extend(due)
+        self._current = max(self._current, target)
+        return expired
+
+
+class LivenessWatchdog:
+    """
+    Tracks the last message of every sensor and reports offline and online transitions.
+
+    `seen` is cheap enough for the MQTT network thread. The transitions are
+    passed in batches to `on_change` from the watchdog thread, at most one
+    tick after they happened, so a whole fleet going silent at once results
+    in a single call.
+    """
+
+    def __init__(self, on_change, offline_after=300, tick=1.0, slots=512):
+        """
+        Initializes the watchdog without starting it.
+
+        Args:
+            on_change (callable): Called with a list of `StatusEvent` tuples.
+            offline_after (float): Seconds without message after which a sensor is offline.
+            tick (float): Seconds between two checks of the timer wheel.
+            slots (int): Number of buckets of the timer wheel.
+        """
+        self.on_change = on_change
+        self.offline_after = offline_after
+        self.tick = tick
+
+        self.went_offline = 0
+        self.came_online = 0
+
+        self._wheel = TimerWheel(tick, slots)
+        self._last_seen = {}
+        self._offline = set()
+        self._events = []
+        self._suspended = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="liveness-watchdog", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def load(self, sensor_ids, offline=()):
+        """
+        Starts watching known sensors, e.g. the ones of the sensor registry.
+
+        Sensors that were offline before the restart stay offline without a
+        new event until they send a message; all others get a full period to
+        report.
+
+        Args:
+            sensor_ids (iterable): The IDs of the known sensors.
+            offline (iterable): The IDs of the sensors whose last recorded status is offline.
+        """
+        now = time.monotonic()
+        wall = datetime.now()
+        offline = set(offline)
+        with self._lock:
+            for sensor_id in sensor_ids:
+                if sensor_id in offline:
+                    self._offline.add(sensor_id)
+                elif sensor_id not in self._last_seen:
+                    self._last_seen[sensor_id] = (now, wall)
+                    self._wheel.schedule(sensor_id, now + self.offline_after)
+
+    def seen(self, sensor_id):
+        """
+        Records a message of a sensor.
+
+        Args:
+            sensor_id (int): The ID of the sensor.
+        """
+        now = time.monotonic()
+        wall = datetime.now()
+        with self._lock:
+            last_seen = self._last_seen.get(sensor_id)
+            self._last_seen[sensor_id] = (now, wall)
+            if last_seen is not None and sensor_id not in self._offline:
+                return
+            # A new or offline sensor, the only case that touches the wheel
+            self._wheel.schedule(sensor_id, now + self.offline_after)
+            if sensor_id in self._offline:
+                self._offline.discard(sensor_id)
+                self.came_online += 1
+                self._events.append(StatusEvent(sensor_id, ONLINE, wall, last_seen[1] if last_seen else None))
+
+    def suspend(self):
+        """
+        Stops reporting sensors offline, e.g. while the broker is unreachable.
+        """
+        with self._lock:
+            self._suspended = True
+
+    def resume(self):
+        """
+        Reports again after `suspend`; every online sensor gets a full period to report.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not self._suspended:
+                return
+            self._suspended = False
+            for sensor_id, (_, wall) in self._last_seen.items():
+                if sensor_id not in self._offline:
+                    self._last_seen[sensor_id] = (now, wall)
+                    self._wheel.schedule(sensor_id, now + self.offline_after)
+
+    def counts(self):
+        with self._lock:
+            return {ONLINE: len(self._last_seen.keys() - self._offline), OFFLINE: len(self._offline)}
+
+    def check(self, now=None):
+        """
+        Advances the timer wheel and reports the transitions.
+
+        Called every tick by the watchdog thread.
+
+        Args:
+            now (float, optional): The current monotonic time.
+
+        Returns:
+            list: The reported `StatusEvent` tuples.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = self._wheel.advance(now)
+            events, self._events = self._events, []
+            for sensor_id in expired:
+                seen_at, wall = self._last_seen[sensor_id]
+                deadline = seen_at + self.offline_after
+                if self._suspended:
+                    deadline = now + self.offline_after
+                if deadline > now:
+                    self._wheel.schedule(sensor_id, deadline)
+                    continue
+                self._offline.add(sensor_id)
+                self.went_offline += 1
+                events.append(StatusEvent(sensor_id, OFFLINE, datetime.now(), wall))
+        if events:
+            try:
+                self.on_change(events)
+            except Exception as e:
+                logger.error(f"Error handling {len(events)} sensor status events: {e}")
+        return events
+
+    def alive(self):
+        return self._thread.is_alive()
+
+    def close(self):
+        """
+        Stops the watchdog thread after reporting the pending transitions.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.check()
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            self.check()
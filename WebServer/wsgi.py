@@ -0,0 +1,7 @@
+"""
+WSGI entry point of the web app, e.g. `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+The control server is not started here; it runs as its own process
+(`python control_server.py`).
+"""
+from app import app